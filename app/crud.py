@@ -1,4 +1,6 @@
 from fastapi import Depends, HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from . import models, schemas
 from datetime import datetime
@@ -26,8 +28,26 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.refresh(db_user)
     return db_user
 
-def get_users(db: Session):
-    return db.query(models.User).all()
+def _users_query(db: Session, after_id: int = None, columns=None):
+    query = db.query(*columns) if columns else db.query(models.User)
+    if after_id is not None:
+        query = query.filter(models.User.id > after_id)
+    return query.order_by(models.User.id)
+
+def get_users(db: Session, after_id: int = None, limit: int = None, columns=None):
+    """Users in id order. `after_id` is the keyset cursor (last id of the previous page);
+    `columns` selects only those User columns and returns rows instead of User objects."""
+    query = _users_query(db, after_id, columns)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+def iter_users(db: Session, after_id: int = None, limit: int = None, columns=None, batch_size: int = 500):
+    """Like get_users, but fetches `batch_size` rows at a time from a server-side cursor."""
+    query = _users_query(db, after_id, columns)
+    if limit is not None:
+        query = query.limit(limit)
+    yield from query.execution_options(yield_per=batch_size)
 
 def create_or_update_oauth_user(db: Session, email: str, firstName: str, lastName: str = None, 
                                  picture: str = None, provider: str = "google", provider_id: str = None):
@@ -57,6 +77,68 @@ def create_or_update_oauth_user(db: Session, email: str, firstName: str, lastNam
     db.refresh(oauth_user)
     return oauth_user
 
+
+# ── Async variants (AsyncSession), used by the async endpoints in main.py ──
+
+def _users_select(after_id: int = None, limit: int = None, columns=None):
+    stmt = select(*columns) if columns else select(models.User)
+    if after_id is not None:
+        stmt = stmt.where(models.User.id > after_id)
+    stmt = stmt.order_by(models.User.id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+async def get_user_by_email_async(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).where(models.User.email == email))
+    return result.scalars().first()
+
+async def update_password_async(db: AsyncSession, user_id: int, hashed: str):
+    await db.execute(update(models.User).where(models.User.id == user_id).values(password=hashed))
+    await db.commit()
+
+async def get_oauth_user_by_email_async(db: AsyncSession, email: str):
+    result = await db.execute(select(models.OAuthUser).where(models.OAuthUser.email == email))
+    return result.scalars().first()
+
+async def get_users_async(db: AsyncSession, after_id: int = None, limit: int = None, columns=None):
+    result = await db.execute(_users_select(after_id, limit, columns))
+    return result.all() if columns else result.scalars().all()
+
+async def iter_users_async(db: AsyncSession, after_id: int = None, limit: int = None, columns=None,
+                           batch_size: int = 500):
+    """Like iter_users: rows arrive `batch_size` at a time from a server-side cursor."""
+    stmt = _users_select(after_id, limit, columns).execution_options(yield_per=batch_size)
+    result = await (db.stream(stmt) if columns else db.stream_scalars(stmt))
+    async for row in result:
+        yield row
+
+async def create_or_update_oauth_user_async(db: AsyncSession, email: str, firstName: str, lastName: str = None,
+                                            picture: str = None, provider: str = "google", provider_id: str = None):
+    """Async create_or_update_oauth_user"""
+    existing_user = await get_oauth_user_by_email_async(db, email)
+
+    if existing_user:
+        existing_user.last_login = datetime.utcnow()
+        await db.commit()
+        await db.refresh(existing_user)
+        return existing_user
+
+    oauth_user = models.OAuthUser(
+        email=email,
+        firstName=firstName,
+        lastName=lastName,
+        picture=picture,
+        provider=provider,
+        provider_id=provider_id,
+        created_at=datetime.utcnow(),
+        last_login=datetime.utcnow()
+    )
+    db.add(oauth_user)
+    await db.commit()
+    await db.refresh(oauth_user)
+    return oauth_user
+
 from datetime import datetime, timedelta
 from jose import jwt
 
@@ -79,7 +161,8 @@ from jose import JWTError
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+# async so FastAPI runs it on the event loop instead of the threadpool; it never blocks.
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return payload.get("sub")
@@ -1,26 +1,323 @@
-import os 
+import os
+import threading
+import time
 from dotenv import load_dotenv
-from sqlalchemy import URL, create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import URL, create_engine, exc, make_url
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
 
-# engine = create_engine(
-#     DATABASE_URL, connect_args={"check_same_thread": False}
-# )
-
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL,
-    pool_pre_ping=True,        # 🔥 REQUIRED
-    pool_recycle=300,          # 🔥 closes stale connections
+# Pool sizing; the defaults are SQLAlchemy's except for recycle and pre-ping.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "300"))      # closes stale connections
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") != "0"
+# Connections opened at startup so the first burst after a deploy doesn't pay for them.
+DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", "2"))
+
+# Comma-separated read replicas; read-only endpoints use them round-robin.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# A replica that fails to connect is skipped for this long before it is tried again.
+DB_REPLICA_RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", "30"))
+# After a user writes, their reads go to the primary for this long (read-your-writes).
+DB_READ_STICKY_SECONDS = float(os.getenv("DB_READ_STICKY_SECONDS", "5"))
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that counts checkouts, time spent waiting for a connection,
+    overflow connections and checkout timeouts."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._overflow_events = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _do_get(self):
+        overflow_before = self._overflow
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self._timeouts += 1
+            raise
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            # _overflow counts up from -pool_size; above zero the pool is past its size.
+            if self._overflow > overflow_before and self._overflow > 0:
+                self._overflow_events += 1
+        return conn
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            checkouts = self._checkouts
+            return {
+                "size": self.size(),
+                "max_overflow": self._max_overflow,
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": max(self.overflow(), 0),
+                "checkouts": checkouts,
+                "overflow_events": self._overflow_events,
+                "timeouts": self._timeouts,
+                "wait_ms_mean": self._wait_total / checkouts * 1000 if checkouts else 0.0,
+                "wait_ms_max": self._wait_max * 1000,
+            }
+
+
+class InstrumentedAsyncQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    """The same telemetry over the asyncio-compatible queue that async engines need."""
+
+
+def async_url(url: str) -> str:
+    """`url` with the async driver of its backend: psycopg (3) for Postgres, aiosqlite for SQLite."""
+    url = make_url(url)
+    driver = {"postgresql": "psycopg", "sqlite": "aiosqlite"}.get(url.get_backend_name())
+    if driver:
+        url = url.set(drivername=f"{url.get_backend_name()}+{driver}")
+    return url.render_as_string(hide_password=False)
+
+
+def _pool_options(url: str, poolclass) -> dict:
+    options = dict(
+        poolclass=poolclass,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
     )
+    if str(url).startswith("sqlite"):
+        options["connect_args"] = {"check_same_thread": False}
+    return options
+
+
+def make_engine(url: str = DATABASE_URL, **overrides):
+    """The one place an engine is built; keyword arguments override the DB_POOL_* settings."""
+    options = _pool_options(url, InstrumentedQueuePool)
+    options.update(overrides)
+    return create_engine(url, **options)
+
+
+def make_async_engine(url: str, **overrides):
+    """`make_engine` for an async driver URL (see `async_url`)."""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    options = _pool_options(url, InstrumentedAsyncQueuePool)
+    options.update(overrides)
+    return create_async_engine(url, **options)
+
+
+def warm_up_pool(engine, connections: int = DB_POOL_WARMUP) -> int:
+    """Open `connections` connections at once and hand them back to the pool."""
+    connections = min(connections, engine.pool.size())
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(engine.connect())
+    finally:
+        for conn in opened:
+            conn.close()
+    return len(opened)
+
+
+async def warm_up_async_pool(engine, connections: int = DB_POOL_WARMUP) -> int:
+    connections = min(connections, engine.pool.size())
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(await engine.connect())
+    finally:
+        for conn in opened:
+            await conn.close()
+    return len(opened)
+
+
+def pool_stats(engine) -> dict:
+    pool = getattr(engine, "sync_engine", engine).pool
+    return pool.stats() if isinstance(pool, InstrumentedQueuePool) else {"status": pool.status()}
+
+
+# Failures that mark a replica down: driver errors, a full pool, and unreachable hosts.
+REPLICA_ERRORS = (exc.DBAPIError, exc.TimeoutError, OSError)
+
+
+class ReplicaRouter:
+    """Hands out read sessions: replicas round-robin, the primary as a fallback.
+
+    Checking out the session's connection is the health check. A replica that fails it
+    is marked down for `retry_seconds` and the next one is tried. Users who wrote within
+    `sticky_seconds` (see `mark_write`) read from the primary so they see their own writes.
+    The write times are kept per process. `read_session` returns a Session;
+    `async_read_session` returns an AsyncSession over async engines for the same replicas.
+    """
+
+    def __init__(self, primary_sessions, replica_engines, retry_seconds: float, sticky_seconds: float):
+        self.primary_sessions = primary_sessions
+        self.engines = list(replica_engines)
+        self.sessions = [sessionmaker(autocommit=False, autoflush=False, bind=e) for e in self.engines]
+        self.async_engines = None
+        self.async_sessions = None
+        self.retry_seconds = retry_seconds
+        self.sticky_seconds = sticky_seconds
+        self._lock = threading.Lock()
+        self._next = 0
+        self._down_until = [0.0] * len(self.engines)
+        self._sticky_until = {}
+        self._reads = [0] * len(self.engines)
+        self._primary_reads = 0
+        self._sticky_reads = 0
+        self._failovers = 0
+
+    def mark_write(self, user) -> None:
+        if not user or not self.engines:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if len(self._sticky_until) > 10000:
+                self._sticky_until = {u: t for u, t in self._sticky_until.items() if t > now}
+            self._sticky_until[user] = now + self.sticky_seconds
+
+    def _candidates(self, user):
+        """Replica indices to try in order, or None when `user` must read from the primary."""
+        now = time.monotonic()
+        with self._lock:
+            if self.engines and user is not None and self._sticky_until.get(user, 0.0) > now:
+                self._sticky_reads += 1
+                return None
+            start = self._next
+            self._next = (self._next + 1) % max(len(self.engines), 1)
+            order = [(start + offset) % len(self.engines) for offset in range(len(self.engines))]
+            return [i for i in order if self._down_until[i] <= now]
+
+    def _record(self, i, healthy: bool) -> None:
+        with self._lock:
+            if healthy:
+                self._reads[i] += 1
+            else:
+                self._down_until[i] = time.monotonic() + self.retry_seconds
+                self._failovers += 1
+
+    def _fallback(self, sessions):
+        with self._lock:
+            self._primary_reads += 1
+        return sessions()
+
+    def read_session(self, user=None) -> Session:
+        candidates = self._candidates(user)
+        if candidates is None:
+            return self.primary_sessions()
+        for i in candidates:
+            session = self.sessions[i]()
+            try:
+                session.connection()
+            except REPLICA_ERRORS:
+                session.close()
+                self._record(i, healthy=False)
+                continue
+            self._record(i, healthy=True)
+            return session
+        return self._fallback(self.primary_sessions)
+
+    async def async_read_session(self, user=None):
+        candidates = self._candidates(user)
+        if candidates is None:
+            return AsyncSessionLocal()
+        if self.async_sessions is None:
+            from sqlalchemy.ext.asyncio import async_sessionmaker
+
+            self.async_engines = [
+                make_async_engine(async_url(e.url.render_as_string(hide_password=False))) for e in self.engines
+            ]
+            self.async_sessions = [
+                async_sessionmaker(e, autoflush=False, expire_on_commit=False) for e in self.async_engines
+            ]
+        for i in candidates:
+            session = self.async_sessions[i]()
+            try:
+                await session.connection()
+            except REPLICA_ERRORS:
+                await session.close()
+                self._record(i, healthy=False)
+                continue
+            self._record(i, healthy=True)
+            return session
+        return self._fallback(AsyncSessionLocal)
+
+    async def dispose_async(self) -> None:
+        for e in self.async_engines or []:
+            await e.dispose()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "replicas": [
+                    {
+                        "url": e.url.render_as_string(hide_password=True),
+                        "healthy": self._down_until[i] <= now,
+                        "reads": self._reads[i],
+                        "pool": pool_stats(e),
+                        **({"async_pool": pool_stats(self.async_engines[i])} if self.async_engines else {}),
+                    }
+                    for i, e in enumerate(self.engines)
+                ],
+                "primary_reads": self._primary_reads,
+                "sticky_reads": self._sticky_reads,
+                "failovers": self._failovers,
+                "sticky_users": sum(1 for t in self._sticky_until.values() if t > now),
+            }
+
+
+engine = make_engine()
 
 SessionLocal = sessionmaker(
     autocommit=False,
     autoflush=False,
     bind=engine
 )
+
+# The async engine is built on first use so the sync-only tools (alembic, training
+# scripts) don't need an async driver installed.
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or (async_url(DATABASE_URL) if DATABASE_URL else None)
+_async_engine = None
+_async_sessions = None
+_async_lock = threading.Lock()
+
+
+def get_async_engine():
+    global _async_engine, _async_sessions
+    with _async_lock:
+        if _async_engine is None:
+            from sqlalchemy.ext.asyncio import async_sessionmaker
+
+            _async_engine = make_async_engine(ASYNC_DATABASE_URL)
+            _async_sessions = async_sessionmaker(_async_engine, autoflush=False, expire_on_commit=False)
+    return _async_engine
+
+
+def AsyncSessionLocal():
+    get_async_engine()
+    return _async_sessions()
+
+
+router = ReplicaRouter(
+    SessionLocal,
+    [make_engine(url) for url in DATABASE_REPLICA_URLS],
+    DB_REPLICA_RETRY_SECONDS,
+    DB_READ_STICKY_SECONDS,
+)
 # EVEN BETTER VERSION TO CRETATE DATABASE ENGINE
 # DATABASE_URL = URL.create(
 #     drivername="postgresql+psycopg2",
@@ -31,7 +328,4 @@ SessionLocal = sessionmaker(
 #     database=os.getenv("DATABASE_NAME"),
 # )
 
-engine=create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
 Base = declarative_base()
@@ -1,20 +1,61 @@
-from fastapi import FastAPI, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Depends, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import timedelta
+from datetime import date, datetime, timedelta
+from typing import Optional
 
 from app.oauth2_config import GOOGLE_CLIENT_ID
-from app.security import hash_password, verify_password
+from app.security import (
+    PASSWORD_PARAMS_VERSION,
+    PasswordHasherBusy,
+    hash_password_async,
+    password_hasher,
+    verify_and_update_async,
+)
+from app.services import ml_service, model_registry
 from . import models, schemas, crud
-from .database import SessionLocal, engine
+from .database import (
+    AsyncSessionLocal,
+    engine,
+    get_async_engine,
+    pool_stats,
+    router,
+    warm_up_async_pool,
+)
 
-models.Base.metadata.create_all(bind=engine)
 # Caching Mechanism (Redis) at SERVER LEVEL
-from redis import Redis
+from redis.asyncio import Redis
 from urllib.parse import urlparse
+import json
 import os
 
-app = FastAPI()
+ADMIN_EMAILS = {email.strip() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+
+# Set ML_WARMUP_ON_STARTUP=0 to defer model loading until the first /predict call.
+ML_WARMUP_ON_STARTUP = os.getenv("ML_WARMUP_ON_STARTUP", "1") != "0"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    models.Base.metadata.create_all(bind=engine)
+    await warm_up_async_pool(get_async_engine())
+    # The model loads in the background so /login and friends are served right away.
+    if ML_WARMUP_ON_STARTUP:
+        ml_service.start_warm_up()
+    ml_service.start_model_watcher()
+    await password_hasher.start()
+    yield
+    ml_service.shutdown()
+    password_hasher.shutdown()
+    await get_async_engine().dispose()
+    await router.dispose_async()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -38,28 +79,130 @@ redis_client = Redis(
     ssl=True,
     decode_responses=True
 )
-def get_db():
-    db = SessionLocal()
+# Endpoints are async and use AsyncSession; torch work is pushed to a thread with
+# run_in_threadpool and argon2 to the password_hasher processes, so neither blocks the event loop.
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# Read-only endpoints: a replica when one is configured and healthy, else the primary.
+async def get_read_db():
+    db = await router.async_read_session()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+# Same, but a user who has just written reads their own writes from the primary.
+async def get_user_read_db(current_user: str = Depends(crud.get_current_user)):
+    db = await router.async_read_session(current_user)
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
+
+
+# Liveness only says the process is up; readiness also needs a warm model.
+@app.get("/health/live")
+async def health_live():
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+async def health_ready():
+    state = ml_service.readiness()
+    if not state["model_warm"]:
+        ml_service.start_warm_up()
+        raise HTTPException(status_code=503, detail=state)
+    return {"status": "ready", **state}
+
+
+# Never served, whatever the response schema says.
+PRIVATE_USER_FIELDS = {"password"}
+USER_FIELDS = [name for name in schemas.UserResponse.model_fields if name not in PRIVATE_USER_FIELDS]
+USERS_PAGE_DEFAULT = int(os.getenv("USERS_PAGE_DEFAULT", "100"))
+USERS_PAGE_MAX = int(os.getenv("USERS_PAGE_MAX", "1000"))
+USERS_STREAM_BATCH = int(os.getenv("USERS_STREAM_BATCH", "500"))
+
+
+def _user_columns(fields: Optional[str]):
+    if not fields:
+        names = USER_FIELDS
+    else:
+        names = [name.strip() for name in fields.split(",") if name.strip()]
+        private = sorted(set(names) & PRIVATE_USER_FIELDS)
+        if private:
+            raise HTTPException(status_code=400, detail={"forbidden_fields": private})
+        unknown = sorted(set(names) - set(USER_FIELDS))
+        if unknown:
+            raise HTTPException(status_code=400, detail={"unknown_fields": unknown, "allowed": USER_FIELDS})
+        # id is the pagination cursor, so it is always returned.
+        names = ["id"] + [name for name in names if name != "id"]
+    return [getattr(models.User, name) for name in names]
 
 
-@app.get("/users", response_model=list[schemas.UserResponse])
-def read_users(db: Session = Depends(get_db)):
-    return crud.get_users(db)
+def _user_dict(row) -> dict:
+    return {key: value.isoformat() if isinstance(value, (date, datetime)) else value for key, value in row._mapping.items()}
+
+
+async def _stream_users(after_id: Optional[int], limit: Optional[int], columns, fmt: str):
+    # Own session: the response body is produced after the request's dependencies have exited.
+    db = await router.async_read_session()
+    try:
+        rows = crud.iter_users_async(db, after_id, limit, columns, USERS_STREAM_BATCH)
+        if fmt == "ndjson":
+            async for row in rows:
+                yield json.dumps(_user_dict(row)) + "\n"
+            return
+        yield "["
+        first = True
+        async for row in rows:
+            yield ("" if first else ",") + json.dumps(_user_dict(row))
+            first = False
+        yield "]"
+    finally:
+        await db.close()
+
+
+@app.get("/users")
+async def read_users(
+    after_id: Optional[int] = Query(None, ge=0, description="return users with id greater than this"),
+    limit: Optional[int] = Query(None, ge=1, le=USERS_PAGE_MAX),
+    fields: Optional[str] = Query(None, description="comma-separated UserResponse fields; id is always included"),
+    stream: Optional[str] = Query(None, pattern="^(ndjson|json)$", description="stream every matching user"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Users in id order, one keyset page at a time, or streamed with constant memory.
+
+    A full page sets `X-Next-After-Id`; pass it back as `after_id` for the next one.
+    `stream` ignores the page size and sends all users (up to `limit`) as NDJSON or a
+    JSON array, reading them from the database in batches.
+    """
+    columns = _user_columns(fields)
+    if stream:
+        media_type = "application/x-ndjson" if stream == "ndjson" else "application/json"
+        return StreamingResponse(_stream_users(after_id, limit, columns, stream), media_type=media_type)
+
+    page_size = limit or USERS_PAGE_DEFAULT
+    users = [_user_dict(row) for row in await crud.get_users_async(db, after_id, page_size, columns)]
+    headers = {"X-Next-After-Id": str(users[-1]["id"])} if len(users) == page_size else {}
+    return JSONResponse(users, headers=headers)
 
 
 # ── Standard Login/Signup ──
 @app.post("/signup")
-def signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def signup(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     # Check if user already exists
-    existing = db.query(models.User).filter(models.User.email == user.email).first()
+    existing = await crud.get_user_by_email_async(db, user.email)
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_pw = hash_password(user.password)
+    try:
+        hashed_pw = await hash_password_async(user.password)
+    except PasswordHasherBusy as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "1"})
     db_user = models.User(
         firstName=user.firstName,
         lastName=user.lastName,
@@ -79,55 +222,106 @@ def signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
         password=hashed_pw,
     )
     db.add(db_user)
-    db.commit()
+    await db.commit()
+    router.mark_write(user.email)
+    # The email may be cached as unknown from an earlier login attempt.
+    await _forget_credentials(user.email)
     return {"message": "User created successfully"}
 
 
 from fastapi.security import OAuth2PasswordRequestForm
 
+# /login caches email -> {id, argon2 hash, params version} so it can skip the database,
+# never the password check. Emails with no account are cached too (LOGIN_CACHE_UNKNOWN),
+# for a shorter time, so credential-stuffing floods of made-up emails don't reach the
+# database. Signup and password changes drop or overwrite the entry.
+LOGIN_CACHE_TTL = int(os.getenv("LOGIN_CACHE_TTL", "300"))
+LOGIN_NEGATIVE_CACHE_TTL = int(os.getenv("LOGIN_NEGATIVE_CACHE_TTL", "60"))
+LOGIN_CACHE_UNKNOWN = "unknown"
 
-@app.post("/login")
-def login(
-    form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
-):
 
-    cache_key = f"user:{form_data.username}"
+def _login_cache_key(email: str) -> str:
+    return f"login:{email}"
+
 
-    # 1️⃣ Check Redis Cache
+async def _cached_credentials(email: str):
+    """The cached entry, LOGIN_CACHE_UNKNOWN, or None on a miss (or a stale or unreadable entry)."""
     try:
-        cached_user = redis_client.get(cache_key)
+        raw = await redis_client.get(_login_cache_key(email))
     except Exception:
-        cached_user = None
+        return None
+    if raw is None or raw == LOGIN_CACHE_UNKNOWN:
+        return raw
+    try:
+        entry = json.loads(raw)
+    except ValueError:
+        return None
+    # Entries written under other ARGON2_* settings are ignored so the hash gets upgraded.
+    return entry if entry.get("params") == PASSWORD_PARAMS_VERSION else None
 
-    if cached_user:
-        token = crud.create_access_token({"sub": form_data.username, "type": "standard"})
-        return {
-            "access_token": token,
-            "token_type": "bearer",
-            "user_type": "standard",
-            "source": "redis"
-        }
 
-    # 2️⃣ Query Database
-    user = db.query(models.User).filter(models.User.email == form_data.username).first()
+async def _cache_credentials(email: str, credentials: Optional[dict]) -> None:
+    """Cache `credentials` ({"id", "hash"}), or that `email` has no account when None."""
+    try:
+        if credentials is None:
+            await redis_client.set(_login_cache_key(email), LOGIN_CACHE_UNKNOWN, ex=LOGIN_NEGATIVE_CACHE_TTL)
+        else:
+            entry = json.dumps({**credentials, "params": PASSWORD_PARAMS_VERSION})
+            await redis_client.set(_login_cache_key(email), entry, ex=LOGIN_CACHE_TTL)
+    except Exception:
+        pass
 
-    if not user or not verify_password(form_data.password, user.password):
-        raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    # 3️⃣ Store in Redis (TTL = 5 minutes)
+async def _forget_credentials(email: str) -> None:
     try:
-       redis_client.set(cache_key, user.email, ex=300)
+        await redis_client.delete(_login_cache_key(email))
     except Exception:
-       pass
+        pass
+
+
+@app.post("/login")
+async def login(
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: AsyncSession = Depends(get_db)
+):
+
+    # 1️⃣ Credentials from Redis, else the database. Either way the password is verified.
+    cached = await _cached_credentials(form_data.username)
+    if cached == LOGIN_CACHE_UNKNOWN:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if cached:
+        user_id, hashed, source = cached["id"], cached["hash"], "redis"
+    else:
+        user = await crud.get_user_by_email_async(db, form_data.username)
+        if not user:
+            await _cache_credentials(form_data.username, None)
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        user_id, hashed, source = user.id, user.password, "database"
+
+    # 2️⃣ Verify
+    try:
+        valid, new_hash = await verify_and_update_async(form_data.password, hashed)
+    except PasswordHasherBusy as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "1"})
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # Hashed with older ARGON2_* parameters; replace it while we have the plaintext.
+        await crud.update_password_async(db, user_id, new_hash)
+        router.mark_write(form_data.username)
+        hashed = new_hash
+
+    # 3️⃣ Store in Redis
+    if source == "database" or new_hash:
+        await _cache_credentials(form_data.username, {"id": user_id, "hash": hashed})
 
-    token = crud.create_access_token({"sub": user.email, "type": "standard"})
+    token = crud.create_access_token({"sub": form_data.username, "type": "standard"})
 
     return {
         "access_token": token,
         "token_type": "bearer",
         "user_type": "standard",
-        "source": "database"
+        "source": source
     }
 
 # ── OAuth2 Google Login ──
@@ -151,14 +345,15 @@ def verify_google_token(token: str) -> dict:
 
 
 @app.post("/auth/google", response_model=schemas.TokenResponse)
-def google_login(request: schemas.GoogleTokenRequest, db: Session = Depends(get_db)):
+async def google_login(request: schemas.GoogleTokenRequest, db: AsyncSession = Depends(get_db)):
     """
     Google OAuth2 login endpoint.
     Expects Google ID token from frontend (from google-signin library).
     """
     try:
         # Verify the Google ID token
-        payload = verify_google_token(request.idToken)
+        # Fetches Google's certificates over blocking HTTP.
+        payload = await run_in_threadpool(verify_google_token, request.idToken)
 
         email = payload.get("email")
         first_name = payload.get("given_name", "User")
@@ -167,7 +362,7 @@ def google_login(request: schemas.GoogleTokenRequest, db: Session = Depends(get_
         provider_id = payload.get("sub")
 
         # Create or update OAuth user in database
-        oauth_user = crud.create_or_update_oauth_user(
+        oauth_user = await crud.create_or_update_oauth_user_async(
             db=db,
             email=email,
             firstName=first_name,
@@ -197,14 +392,14 @@ def google_login(request: schemas.GoogleTokenRequest, db: Session = Depends(get_
 
 
 @app.get("/profile", response_model=dict)
-def profile(
-    current_user: str = Depends(crud.get_current_user), db: Session = Depends(get_db)
+async def profile(
+    current_user: str = Depends(crud.get_current_user), db: AsyncSession = Depends(get_user_read_db)
 ):
     """
     Get user profile - supports both standard and OAuth users.
     """
     # Try standard user first
-    user = db.query(models.User).filter(models.User.email == current_user).first()
+    user = await crud.get_user_by_email_async(db, current_user)
     if user:
         return {
             "id": user.id,
@@ -226,7 +421,7 @@ def profile(
         }
 
     # Try OAuth user
-    oauth_user = db.query(models.OAuthUser).filter(models.OAuthUser.email == current_user).first()
+    oauth_user = await crud.get_oauth_user_by_email_async(db, current_user)
     if oauth_user:
         return {
             "id": oauth_user.id,
@@ -249,12 +444,12 @@ def profile(
 
 # Health Record Endpoints
 @app.post("/health-records")
-def add_health_record(
+async def add_health_record(
     record: schemas.HealthRecordCreate,
     current_user: str = Depends(crud.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    user = db.query(models.User).filter(models.User.email == current_user).first()
+    user = await crud.get_user_by_email_async(db, current_user)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -262,7 +457,8 @@ def add_health_record(
         user_id=user.id, record_type=record.record_type, value=record.value
     )
     db.add(health_record)
-    db.commit()
+    await db.commit()
+    router.mark_write(current_user)
     return {"message": "Health record added successfully"}
 
 
@@ -273,39 +469,139 @@ from app.services.fitness_service import (
     calculate_fitness_score,
     classify_fitness,
     generate_recommendations,
-    get_user_fitness_summary,
-    update_user_fitness_analysis,
+    get_user_fitness_summary_async,
+    update_user_fitness_analysis_async,
 )
-from app.services.ml_service import encode_user_profile, predict
+from concurrent.futures import TimeoutError as InferenceTimeout
+from app.services.inference_pool import InferencePoolFull, InferenceWorkerCrashed
+from app.services.ml_service import (
+    ModelNotReady,
+    batcher,
+    encode_user_profile,
+    encode_user_profiles,
+    predict_batch,
+    predict_batched,
+)
+
+PREDICT_BATCH_MAX_ROWS = int(os.getenv("PREDICT_BATCH_MAX_ROWS", "4096"))
+# Transient inference failures: a full queue, a timeout, or a worker that kept crashing.
+# The input was fine, so the client is told to retry rather than given a 500.
+INFERENCE_UNAVAILABLE = (InferencePoolFull, InferenceWorkerCrashed, InferenceTimeout)
+
+
+def _inference_unavailable(exc: Exception) -> HTTPException:
+    return HTTPException(
+        status_code=503, detail=str(exc) or "Prediction timed out", headers={"Retry-After": "1"}
+    )
 
 
-@app.post("/predict")
-def get_prediction(data: PredictionInput):
+async def require_model_ready():
+    try:
+        ml_service.ensure_ready()
+    except ModelNotReady as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "1"})
+
+
+@app.post("/predict", dependencies=[Depends(require_model_ready)])
+async def get_prediction(data: PredictionInput):
     payload = data.model_dump() if hasattr(data, "model_dump") else data.dict()
     features = encode_user_profile(payload)
-    result = predict(features)
+    try:
+        # Blocks until the micro-batcher has run the forward pass.
+        result = await run_in_threadpool(predict_batched, features)
+    except INFERENCE_UNAVAILABLE as exc:
+        raise _inference_unavailable(exc)
     return {"prediction": result, "features_used": features}
 
+
+@app.post("/predict/batch", dependencies=[Depends(require_model_ready)])
+async def get_batch_prediction(data: list[PredictionInput]):
+    if len(data) > PREDICT_BATCH_MAX_ROWS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {PREDICT_BATCH_MAX_ROWS} profiles can be scored per request",
+        )
+    payloads = [item.model_dump() if hasattr(item, "model_dump") else item.dict() for item in data]
+    features = await run_in_threadpool(encode_user_profiles, payloads)
+    try:
+        results = await run_in_threadpool(predict_batch, features)
+    except INFERENCE_UNAVAILABLE as exc:
+        raise _inference_unavailable(exc)
+    return {"predictions": results, "features_used": features.tolist()}
+
+
+async def require_admin(current_user: str = Depends(crud.get_current_user)):
+    if current_user not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+
+@app.get("/admin/models", dependencies=[Depends(require_admin)])
+def list_models():
+    return {
+        "active_version": model_registry.get_active_version(),
+        "serving_version": ml_service.readiness()["model_version"],
+        "versions": model_registry.list_versions(),
+    }
+
+
+@app.post("/admin/models/{version}/activate", dependencies=[Depends(require_admin)])
+def activate_model(version: str):
+    try:
+        return ml_service.activate_model(version)
+    except model_registry.UnknownModelVersion as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+
+
+@app.get("/metrics/memory")
+def get_memory_metrics():
+    from app.services.shared_weights import process_memory
+
+    loaded = ml_service.readiness()
+    weights_path = getattr(ml_service.get_model().recommender, "weights_path", None) if loaded["model_loaded"] else None
+    return process_memory(os.getpid(), weights_path)
+
+
+@app.get("/metrics/db-pool")
+async def get_db_pool_metrics():
+    return {**pool_stats(get_async_engine()), "read_routing": router.stats()}
+
+
+@app.get("/metrics/passwords")
+def get_password_metrics():
+    return password_hasher.stats()
+
+
+@app.get("/predict/stats")
+def get_prediction_stats():
+    return {
+        "batcher": batcher.stats(),
+        "cache": ml_service.prediction_cache.stats(),
+        "pool": ml_service.pool_stats(),
+    }
+
 # To get Score and Level from fitness analysis
 @app.post("/fitness/analyze")
-def fitness_analyze(
+async def fitness_analyze(
     data: FitnessInput,
     current_user: str = Depends(crud.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     try:
-        return update_user_fitness_analysis(db, current_user, data)
+        result = await update_user_fitness_analysis_async(db, current_user, data)
     except ValueError as exc:
         raise HTTPException(status_code=404, detail=str(exc))
+    router.mark_write(current_user)
+    return result
 
 
 @app.get("/fitness/score")
-def get_fitness_score(
+async def get_fitness_score(
     current_user: str = Depends(crud.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_user_read_db),
 ):
     try:
-        return get_user_fitness_summary(db, current_user)
+        return await get_user_fitness_summary_async(db, current_user)
     except ValueError as exc:
         raise HTTPException(status_code=404, detail=str(exc))
 
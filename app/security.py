@@ -1,9 +1,187 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+# Argon2 cost, per environment. Hashes made with other parameters still verify and
+# are replaced on the next successful login (see verify_and_update_async).
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+# Hashing runs in its own processes so a signup/login burst can't starve the web
+# worker; 0 runs it on a thread instead. Beyond PASSWORD_POOL_MAX_PENDING outstanding
+# requests, new ones are rejected with PasswordHasherBusy.
+PASSWORD_POOL_PROCESSES = int(os.getenv("PASSWORD_POOL_PROCESSES", "2"))
+PASSWORD_POOL_MAX_PENDING = int(os.getenv("PASSWORD_POOL_MAX_PENDING", "64"))
+
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__time_cost=ARGON2_TIME_COST,
+    argon2__memory_cost=ARGON2_MEMORY_COST,
+    argon2__parallelism=ARGON2_PARALLELISM,
+)
+
+# Changes whenever the parameters above do, so caches of hashes can tell theirs are stale.
+PASSWORD_PARAMS_VERSION = f"argon2:t={ARGON2_TIME_COST},m={ARGON2_MEMORY_COST},p={ARGON2_PARALLELISM}"
 
 def hash_password(password: str):
     return pwd_context.hash(password)
 
 def verify_password(plain: str, hashed: str):
     return pwd_context.verify(plain, hashed)
+
+
+class PasswordHasherBusy(RuntimeError):
+    """Raised when PASSWORD_POOL_MAX_PENDING hash/verify requests are already outstanding."""
+
+
+def _timed(op: str, *args):
+    # Runs in the pool. time.monotonic is system-wide, so the parent can subtract its own timestamps.
+    started = time.monotonic()
+    if op == "hash":
+        result = pwd_context.hash(*args)
+    else:
+        result = pwd_context.verify_and_update(*args)
+    return result, started, time.monotonic()
+
+
+class PasswordHasher:
+    def __init__(self, processes: int = PASSWORD_POOL_PROCESSES, max_pending: int = PASSWORD_POOL_MAX_PENDING):
+        self.processes = processes
+        self.max_pending = max_pending
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._rejected = 0
+        self._counts = {"hash": 0, "verify": 0}
+        self._run_s = {"hash": 0.0, "verify": 0.0}
+        self._max_run_s = {"hash": 0.0, "verify": 0.0}
+        self._wait_s = 0.0
+        self._max_wait_s = 0.0
+        self._rehashes = 0
+        self._pool_restarts = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.processes > 0:
+                    self._executor = ProcessPoolExecutor(
+                        self.processes, mp_context=multiprocessing.get_context("spawn")
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(1, thread_name_prefix="password-hasher")
+            return self._executor
+
+    def _replace_broken(self, broken) -> None:
+        # A worker that dies (OOM kill, segfault) breaks the whole ProcessPoolExecutor for good;
+        # drop it so the next _get_executor starts a fresh one. Only the first caller to see a
+        # given broken pool replaces it.
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+            self._pool_restarts += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    async def _submit(self, op: str, *args):
+        executor = self._get_executor()
+        try:
+            return await asyncio.wrap_future(executor.submit(_timed, op, *args))
+        except BrokenProcessPool:
+            self._replace_broken(executor)
+        # One retry on the new pool; if that breaks too, callers get the same 503 as a full queue.
+        executor = self._get_executor()
+        try:
+            return await asyncio.wrap_future(executor.submit(_timed, op, *args))
+        except BrokenProcessPool as exc:
+            self._replace_broken(executor)
+            raise PasswordHasherBusy("password hashing workers crashed; pool restarted") from exc
+
+    async def start(self) -> None:
+        """Start the workers now (and import passlib in them) instead of on the first login.
+
+        All of the warm-up work runs in the pool; this only awaits it.
+        """
+        jobs = [self._submit("hash", "warm-up") for _ in range(max(self.processes, 1))]
+        (hashed, _, _), *_ = await asyncio.gather(*jobs)
+        await self._submit("verify", "warm-up", hashed)
+
+    async def _run(self, op: str, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise PasswordHasherBusy(f"{self._pending} password hashing requests already pending")
+            self._pending += 1
+        submitted = time.monotonic()
+        try:
+            result, started, finished = await self._submit(op, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+        with self._lock:
+            self._counts[op] += 1
+            self._run_s[op] += finished - started
+            self._max_run_s[op] = max(self._max_run_s[op], finished - started)
+            waited = max(started - submitted, 0.0)
+            self._wait_s += waited
+            self._max_wait_s = max(self._max_wait_s, waited)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", password)
+
+    async def verify_and_update(self, plain: str, hashed: str):
+        """(valid, new_hash). new_hash is set when `hashed` was made with outdated parameters."""
+        valid, new_hash = await self._run("verify", plain, hashed)
+        if new_hash is not None:
+            with self._lock:
+                self._rehashes += 1
+        return valid, new_hash
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = sum(self._counts.values())
+            return {
+                "processes": self.processes,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "rejected": self._rejected,
+                "hashes": self._counts["hash"],
+                "verifies": self._counts["verify"],
+                "rehashes": self._rehashes,
+                "pool_restarts": self._pool_restarts,
+                "mean_hash_ms": self._run_s["hash"] / self._counts["hash"] * 1000 if self._counts["hash"] else 0.0,
+                "max_hash_ms": self._max_run_s["hash"] * 1000,
+                "mean_verify_ms": (
+                    self._run_s["verify"] / self._counts["verify"] * 1000 if self._counts["verify"] else 0.0
+                ),
+                "max_verify_ms": self._max_run_s["verify"] * 1000,
+                "mean_queue_wait_ms": self._wait_s / requests * 1000 if requests else 0.0,
+                "max_queue_wait_ms": self._max_wait_s * 1000,
+                "params": {
+                    "time_cost": ARGON2_TIME_COST,
+                    "memory_cost": ARGON2_MEMORY_COST,
+                    "parallelism": ARGON2_PARALLELISM,
+                },
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_hasher = PasswordHasher()
+
+async def hash_password_async(password: str) -> str:
+    return await password_hasher.hash(password)
+
+async def verify_and_update_async(plain: str, hashed: str):
+    return await password_hasher.verify_and_update(plain, hashed)
@@ -0,0 +1,225 @@
+"""Stage-by-stage benchmark of the /predict pipeline.
+
+Times `encode_user_profile`, tensor construction, the WorkoutRecommender forward
+pass, `_safe_category_from_features` and response assembly separately (plus the
+vectorized encode/safety paths used by /predict/batch) over a grid of batch sizes
+and thread counts, and writes a JSON report. Inputs are seeded, so two reports
+from different commits on the same machine are directly comparable; pass
+`--baseline` to fail on regressions.
+
+    python -m app.services.benchmark_inference --out bench.json
+    python -m app.services.benchmark_inference --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.services import ml_service
+
+DEFAULT_BATCH_SIZES = [1, 4, 16, 64, 256, 1024, 4096]
+STAGES = ("encode", "encode_vectorized", "tensor", "forward", "safety", "safety_vectorized", "assemble")
+# Stages that together make up one /predict-style request.
+PIPELINE_STAGES = ("encode", "tensor", "forward", "safety", "assemble")
+
+
+def sample_profiles(n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    profiles = []
+    for _ in range(n):
+        post_surgery = rng.random() < 0.3
+        profiles.append(
+            {
+                "age": rng.randint(14, 80),
+                "weight_kg": rng.uniform(45.0, 120.0),
+                "height_cm": rng.uniform(150.0, 200.0),
+                "fitness_level": rng.choice(list(ml_service.FITNESS_LEVEL_MAP)),
+                "is_post_surgery": post_surgery,
+                "recovery_phase": rng.choice(list(ml_service.RECOVERY_PHASE_MAP)) if post_surgery else "normal",
+                "surgery_date": None,
+                "pain_level": rng.uniform(0.0, 9.0),
+                "sleep_hours": rng.choice([None, rng.uniform(4.0, 9.5)]),
+                "goal": rng.choice(list(ml_service.GOAL_ONE_HOT)),
+                "medical_conditions": rng.sample(["diabetes", "hypertension", "asthma", "arthritis"], rng.randint(0, 2)),
+            }
+        )
+    return profiles
+
+
+def _percentiles(samples: Sequence[float]) -> Dict[str, float]:
+    values = np.asarray(samples) * 1_000_000
+    return {
+        "p50_us": float(np.percentile(values, 50)),
+        "p95_us": float(np.percentile(values, 95)),
+        "p99_us": float(np.percentile(values, 99)),
+    }
+
+
+def _time(fn: Callable[[], Any], repeats: int, warmup: int = 3) -> List[float]:
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def _thread_limits(threads: int):
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return nullcontext()
+    return threadpool_limits(limits=threads)
+
+
+def _tensor_fn(recommender, rows: List[List[float]]) -> Callable[[], Any]:
+    if getattr(recommender, "backend", "") in ("torch", "int8"):
+        import torch
+
+        return lambda: torch.tensor(rows, dtype=torch.float32)
+    return lambda: np.asarray(rows, dtype=np.float32)
+
+
+def bench_config(recommender, batch_size: int, repeats: int) -> Dict[str, Any]:
+    profiles = sample_profiles(batch_size)
+    rows = [ml_service.encode_user_profile(profile) for profile in profiles]
+    features = np.asarray(rows, dtype=np.float64)
+    x = features.astype(np.float32)
+    logits, intensity, duration = recommender(x)
+    raw_categories = np.argmax(logits, axis=1)
+    raw_list = raw_categories.tolist()
+    safe_list = [ml_service._safe_category_from_features(c, row) for c, row in zip(raw_list, rows)]
+    intensities, durations = intensity[:, 0].tolist(), duration[:, 0].tolist()
+
+    stage_fns: Dict[str, Callable[[], Any]] = {
+        "encode": lambda: [ml_service.encode_user_profile(profile) for profile in profiles],
+        "encode_vectorized": lambda: ml_service.encode_user_profiles(profiles),
+        "tensor": _tensor_fn(recommender, rows),
+        "forward": lambda: recommender(x),
+        "safety": lambda: [ml_service._safe_category_from_features(c, row) for c, row in zip(raw_list, rows)],
+        "safety_vectorized": lambda: ml_service._safe_categories_from_features(raw_categories, features),
+        "assemble": lambda: [
+            ml_service._build_result(c, i, d, "bench") for c, i, d in zip(safe_list, intensities, durations)
+        ],
+    }
+
+    stages = {}
+    for name in STAGES:
+        timings = _time(stage_fns[name], repeats)
+        stages[name] = _percentiles(timings)
+        stages[name]["rows_per_s"] = batch_size / float(np.median(timings))
+
+    pipeline_p50 = sum(stages[name]["p50_us"] for name in PIPELINE_STAGES)
+    return {
+        "batch_size": batch_size,
+        "repeats": repeats,
+        "stages": stages,
+        "pipeline_p50_us": pipeline_p50,
+        "pipeline_rows_per_s": batch_size / (pipeline_p50 / 1_000_000),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ml_service.BASE_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(batch_sizes: Sequence[int], thread_counts: Sequence[int], repeats: int) -> Dict[str, Any]:
+    recommender = ml_service.load_recommender(ml_service.MODEL_PATH)
+    results = []
+    for threads in thread_counts:
+        with _thread_limits(threads):
+            for batch_size in batch_sizes:
+                # Keep total work per configuration roughly bounded for the big batches.
+                config_repeats = max(5, min(repeats, (repeats * 64) // batch_size))
+                result = bench_config(recommender, batch_size, config_repeats)
+                result["threads"] = threads
+                results.append(result)
+                print(
+                    f"threads={threads} batch={batch_size} "
+                    f"forward_p50={result['stages']['forward']['p50_us']:.1f}us "
+                    f"pipeline={result['pipeline_rows_per_s']:.0f} rows/s",
+                    file=sys.stderr,
+                )
+
+    return {
+        "created_at": datetime.utcnow().isoformat(),
+        "git_commit": _git_commit(),
+        "backend": getattr(recommender, "backend", ml_service.ML_BACKEND),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "torch": sys.modules["torch"].__version__ if "torch" in sys.modules else None,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+
+def find_regressions(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """List (threads, batch, stage) cells whose p50 got more than `tolerance` slower than the baseline."""
+    previous = {(r["threads"], r["batch_size"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in report["results"]:
+        before = previous.get((result["threads"], result["batch_size"]))
+        if before is None:
+            continue
+        for stage, timings in result["stages"].items():
+            old = before["stages"].get(stage, {}).get("p50_us")
+            if old and timings["p50_us"] > old * (1.0 + tolerance):
+                regressions.append(
+                    f"threads={result['threads']} batch={result['batch_size']} {stage}: "
+                    f"p50 {old:.1f}us -> {timings['p50_us']:.1f}us"
+                )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the recommender inference pipeline stage by stage.")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=DEFAULT_BATCH_SIZES)
+    parser.add_argument("--threads", type=int, nargs="+", default=None, help="default: 1..nproc")
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--backend", default=None, help="override ML_BACKEND (torch, numpy, int8, mmap)")
+    parser.add_argument("--out", default=None, help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", default=None, help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed p50 slowdown vs baseline")
+    args = parser.parse_args()
+
+    if args.backend:
+        ml_service.ML_BACKEND = args.backend
+    thread_counts = args.threads or list(range(1, (os.cpu_count() or 1) + 1))
+
+    report = run(args.batch_sizes, thread_counts, args.repeats)
+    if args.out:
+        with open(args.out, "w") as fh:
+            json.dump(report, fh, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            regressions = find_regressions(report, json.load(fh), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
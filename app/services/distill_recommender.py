@@ -0,0 +1,318 @@
+"""Distil the WorkoutRecommender into the smallest student that passes the audit.
+
+The teacher's outputs are computed once over the whole dataset. Each student is
+trained on a blend of the teacher's temperature-softened category distribution and
+the hard labels, and on the teacher's intensity and duration predictions. Candidates
+are tried from the smallest up. The first one whose validation accuracy is within
+`--max-accuracy-drop` of the teacher's, and whose fairness gaps are within
+`--max-gap-increase` of the teacher's, is saved. Both models are audited on the same
+split. The checkpoint records its layer sizes in `metadata["architecture"]`, so
+`torch_inference.load_model` (and so every `ML_BACKEND`) serves it like the full model.
+
+    python -m app.services.distill_recommender --register
+"""
+import argparse
+import json
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from app.services.numpy_inference import NumpyRecommender, file_sha256, fold_state_dict
+from app.services.torch_inference import TorchRecommender, load_checkpoint, load_model
+from app.services.train_workout_recommender import (
+    MODEL_OUT_PATH,
+    SEED,
+    WorkoutRecommender,
+    audit_model,
+    audit_with_subgroups,
+    load_training_data,
+    save_checkpoint,
+    split_indices,
+)
+
+STUDENT_OUT_PATH = MODEL_OUT_PATH.with_name("workout_recommender_student.pt")
+STUDENT_WIDTHS = (8, 12, 16, 24, 32, 48, 64)
+GAPS = ("goal_gap", "fitness_gap", "age_gap")
+BENCHMARK_BATCH_SIZES = (1, 32, 256)
+
+
+@dataclass
+class DistillConfig:
+    temperature: float = 3.0
+    soft_weight: float = 0.7
+    intensity_weight: float = 0.5
+    duration_weight: float = 0.5
+    lr: float = 3e-3
+    weight_decay: float = 1e-5
+    batch_size: int = 256
+    epochs: int = 60
+    dropout: float = 0.0
+
+
+def student_architecture(width: int) -> Dict[str, Any]:
+    """One hidden layer of `width` units; the heads are scaled down with it."""
+    return {"hidden": [width], "embedding": width, "category_hidden": width, "regression_hidden": max(4, width // 2)}
+
+
+def parameter_count(model: nn.Module) -> int:
+    return sum(p.numel() for p in model.parameters())
+
+
+def teacher_outputs(teacher: nn.Module, x: np.ndarray) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    teacher.eval()
+    with torch.no_grad():
+        return teacher(torch.tensor(x, dtype=torch.float32))
+
+
+def distill(
+    config: DistillConfig,
+    architecture: Dict[str, Any],
+    data: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray],
+    targets: Tuple[torch.Tensor, torch.Tensor, torch.Tensor],
+    train_idx: np.ndarray,
+    val_idx: np.ndarray,
+) -> Tuple[nn.Module, Dict[str, Any]]:
+    """Train one student. The best epoch is picked by the usual label loss on the validation split."""
+    x, y_cat, y_i, y_d = data[:4]
+    t_logits, t_i, t_d = targets
+    index = torch.from_numpy(np.asarray(train_idx))
+    train = (
+        torch.tensor(x[train_idx], dtype=torch.float32),
+        torch.tensor(y_cat[train_idx], dtype=torch.long),
+        F.softmax(t_logits[index] / config.temperature, dim=1),
+        t_i[index],
+        t_d[index],
+    )
+    x_val = torch.tensor(x[val_idx], dtype=torch.float32)
+    yc_val = torch.tensor(y_cat[val_idx], dtype=torch.long)
+    yi_val = torch.tensor(y_i[val_idx], dtype=torch.float32)
+    yd_val = torch.tensor(y_d[val_idx], dtype=torch.float32)
+
+    torch.manual_seed(SEED)
+    student = WorkoutRecommender(config.dropout, **architecture)
+    optim = torch.optim.Adam(student.parameters(), lr=config.lr, weight_decay=config.weight_decay)
+    ce = nn.CrossEntropyLoss()
+    mse = nn.MSELoss()
+    temperature = config.temperature
+
+    n_train = train[0].shape[0]
+    shuffled = tuple(torch.empty_like(t) for t in train)
+    best_state = {k: torch.empty_like(v) for k, v in student.state_dict().items()}
+    best: Dict[str, Any] = {"loss": float("inf"), "epoch": 0, "state": None}
+
+    for epoch in range(1, config.epochs + 1):
+        student.train()
+        order = torch.randperm(n_train)
+        for src, dst in zip(train, shuffled):
+            torch.index_select(src, 0, order, out=dst)
+        xs, ycs, soft, tis, tds = shuffled
+        for start in range(0, n_train, config.batch_size):
+            end = min(start + config.batch_size, n_train)
+            if end - start < 2:
+                continue  # BatchNorm needs two rows
+            logits, p_i, p_d = student(xs[start:end])
+            soft_loss = F.kl_div(F.log_softmax(logits / temperature, dim=1), soft[start:end], reduction="batchmean")
+            loss = (
+                config.soft_weight * temperature**2 * soft_loss
+                + (1.0 - config.soft_weight) * ce(logits, ycs[start:end])
+                + config.intensity_weight * mse(p_i, tis[start:end])
+                + config.duration_weight * mse(p_d, tds[start:end])
+            )
+            optim.zero_grad()
+            loss.backward()
+            optim.step()
+
+        student.eval()
+        with torch.no_grad():
+            vc, vi, vd = student(x_val)
+            vloss = float(ce(vc, yc_val) + 0.5 * mse(vi, yi_val) + 0.5 * mse(vd, yd_val))
+            if vloss < best["loss"]:
+                for k, v in student.state_dict().items():
+                    best_state[k].copy_(v)
+                best.update(loss=vloss, epoch=epoch, state=best_state)
+
+    student.load_state_dict(best["state"])
+    return student, best
+
+
+def check_thresholds(
+    audit: Dict[str, Any], teacher_audit: Dict[str, Any], max_accuracy_drop: float, max_gap_increase: float
+) -> List[str]:
+    """Failed thresholds, empty when the student is acceptable."""
+    failures = []
+    accuracy = audit["overall"]["category_acc"]
+    min_accuracy = teacher_audit["overall"]["category_acc"] - max_accuracy_drop
+    if accuracy < min_accuracy:
+        failures.append(f"category_acc {accuracy:.4f} < {min_accuracy:.4f}")
+    for gap in GAPS:
+        value = audit["fairness_gaps"][gap]
+        limit = teacher_audit["fairness_gaps"][gap] + max_gap_increase
+        if value > limit:
+            failures.append(f"{gap} {value:.4f} > {limit:.4f}")
+    return failures
+
+
+def _median_latency_us(fn: Callable[[np.ndarray], Any], x: np.ndarray, repeats: int) -> float:
+    timings = []
+    for _ in range(10):
+        fn(x)
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn(x)
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings) * 1_000_000)
+
+
+def benchmark(
+    teacher: nn.Module,
+    student: nn.Module,
+    batch_sizes: Sequence[int] = BENCHMARK_BATCH_SIZES,
+    repeats: int = 200,
+) -> Dict[str, Any]:
+    """Median forward latency of teacher and student through the torch and numpy serving backends."""
+    backends = {
+        "torch": (TorchRecommender(teacher.eval()), TorchRecommender(student.eval())),
+        "numpy": (
+            NumpyRecommender(fold_state_dict(teacher.state_dict())),
+            NumpyRecommender(fold_state_dict(student.state_dict())),
+        ),
+    }
+    rng = np.random.default_rng(0)
+    latency: Dict[str, Dict[str, Any]] = {}
+    for batch_size in batch_sizes:
+        x = rng.random((batch_size, 14), dtype=np.float32)
+        for backend, (teacher_fn, student_fn) in backends.items():
+            teacher_us = _median_latency_us(teacher_fn, x, repeats)
+            student_us = _median_latency_us(student_fn, x, repeats)
+            latency.setdefault(str(batch_size), {})[backend] = {
+                "teacher_us": teacher_us,
+                "student_us": student_us,
+                "speedup": teacher_us / student_us,
+            }
+    return {
+        "torch_version": torch.__version__,
+        "threads": torch.get_num_threads(),
+        "parameters": {"teacher": parameter_count(teacher), "student": parameter_count(student)},
+        "median_latency": latency,
+    }
+
+
+def _summary(audit: Dict[str, Any]) -> Dict[str, float]:
+    return {"category_acc": audit["overall"]["category_acc"], **audit["fairness_gaps"]}
+
+
+def distill_and_save(
+    teacher_path: Path = MODEL_OUT_PATH,
+    out_path: Path = STUDENT_OUT_PATH,
+    widths: Sequence[int] = STUDENT_WIDTHS,
+    config: Optional[DistillConfig] = None,
+    max_accuracy_drop: float = 0.01,
+    max_gap_increase: float = 0.02,
+    samples_per_cell: int = 22,
+    generator: str = "vectorized",
+    repeats: int = 200,
+) -> Dict[str, Any]:
+    config = config or DistillConfig()
+    teacher = load_model(str(teacher_path))
+    teacher_metadata = load_checkpoint(str(teacher_path)).get("metadata") or {}
+    data = load_training_data(samples_per_cell, generator)
+    train_idx, val_idx = split_indices(data[1])
+    targets = teacher_outputs(teacher, data[0])
+    teacher_audit = audit_model(teacher, data, train_idx, val_idx)
+
+    candidates = []
+    chosen = None
+    for width in sorted(widths):
+        architecture = student_architecture(width)
+        student, best = distill(config, architecture, data, targets, train_idx, val_idx)
+        audit, subgroups = audit_with_subgroups(student, data, train_idx, val_idx)
+        failures = check_thresholds(audit, teacher_audit, max_accuracy_drop, max_gap_increase)
+        candidates.append(
+            {
+                "width": width,
+                "parameters": parameter_count(student),
+                "best_epoch": best["epoch"],
+                "val_loss": best["loss"],
+                **_summary(audit),
+                "failures": failures,
+            }
+        )
+        print(f"width={width} params={parameter_count(student)} {_summary(audit)} failures={failures}")
+        if not failures:
+            chosen = (width, student, best, audit, subgroups)
+            break
+
+    report: Dict[str, Any] = {
+        "teacher": {"path": str(teacher_path), "parameters": parameter_count(teacher), **_summary(teacher_audit)},
+        "thresholds": {"max_accuracy_drop": max_accuracy_drop, "max_gap_increase": max_gap_increase},
+        "candidates": candidates,
+        "chosen": None,
+    }
+    if chosen is None:
+        return report
+
+    width, student, best, audit, subgroups = chosen
+    extra = {
+        "generator": generator,
+        "samples_per_cell": samples_per_cell,
+        "distillation": {
+            **asdict(config),
+            "width": width,
+            "teacher_sha256": file_sha256(str(teacher_path)),
+            "teacher_generator": teacher_metadata.get("generator"),
+            "teacher_audit": _summary(teacher_audit),
+            "thresholds": report["thresholds"],
+        },
+    }
+    save_checkpoint(student, best["epoch"], best["loss"], audit, extra, out_path, subgroups)
+    report["chosen"] = {"width": width, "path": str(out_path), "architecture": student.architecture}
+    report["benchmark"] = benchmark(teacher, student, repeats=repeats)
+    return report
+
+
+def main() -> None:
+    defaults = DistillConfig()
+    parser = argparse.ArgumentParser(description="Distil the WorkoutRecommender into a compact student.")
+    parser.add_argument("--teacher", type=Path, default=MODEL_OUT_PATH)
+    parser.add_argument("--out", type=Path, default=STUDENT_OUT_PATH)
+    parser.add_argument("--widths", type=int, nargs="+", default=list(STUDENT_WIDTHS), help="candidates, smallest tried first")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.01, help="below the teacher's category accuracy")
+    parser.add_argument("--max-gap-increase", type=float, default=0.02, help="above each of the teacher's fairness gaps")
+    parser.add_argument("--samples-per-cell", type=int, default=22)
+    parser.add_argument("--generator", choices=["python", "vectorized"], default="vectorized")
+    parser.add_argument("--epochs", type=int, default=defaults.epochs)
+    parser.add_argument("--temperature", type=float, default=defaults.temperature)
+    parser.add_argument("--soft-weight", type=float, default=defaults.soft_weight, help="soft vs hard category loss")
+    parser.add_argument("--repeats", type=int, default=200, help="benchmark repetitions per batch size")
+    parser.add_argument("--register", action="store_true", help="add the student to the model registry")
+    args = parser.parse_args()
+
+    config = DistillConfig(epochs=args.epochs, temperature=args.temperature, soft_weight=args.soft_weight)
+    report = distill_and_save(
+        args.teacher,
+        args.out,
+        args.widths,
+        config,
+        args.max_accuracy_drop,
+        args.max_gap_increase,
+        args.samples_per_cell,
+        args.generator,
+        args.repeats,
+    )
+    if report["chosen"] is not None and args.register:
+        from app.services import model_registry
+
+        report["chosen"]["version"] = model_registry.register(str(args.out))
+    print(json.dumps(report, indent=2))
+    if report["chosen"] is None:
+        raise SystemExit("No student width met the thresholds")
+
+
+if __name__ == "__main__":
+    main()
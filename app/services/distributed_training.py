@@ -0,0 +1,332 @@
+"""Data-parallel WorkoutRecommender training on CPU processes (gloo).
+
+Each rank trains a replica on its slice of every global batch. The gradients are
+averaged over ranks with one flat all-reduce per step, and the BatchNorm layers
+all-reduce their batch statistics
+so every rank normalises with the statistics of the whole global batch, exactly as
+the single-process loop does. Rank 0 validates, keeps the best state and writes the
+checkpoint through `finish_training`, so the payload is the one `train_and_save`
+produces.
+
+    python -m app.services.distributed_training --world-size 4
+    python -m app.services.distributed_training --scaling --epochs 3
+"""
+import argparse
+import json
+import os
+import socket
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+
+from app.services.train_workout_recommender import (
+    MODEL_OUT_PATH,
+    SEED,
+    WorkoutRecommender,
+    finish_training,
+    load_training_data,
+    split_indices,
+)
+
+
+class _AllReduceSum(torch.autograd.Function):
+    """Sum over ranks whose backward sums the incoming gradients over ranks as well."""
+
+    @staticmethod
+    def forward(ctx, tensor: torch.Tensor) -> torch.Tensor:
+        tensor = tensor.clone()
+        dist.all_reduce(tensor)
+        return tensor
+
+    @staticmethod
+    def backward(ctx, grad: torch.Tensor) -> torch.Tensor:
+        grad = grad.clone()
+        dist.all_reduce(grad)
+        return grad
+
+
+class CPUSyncBatchNorm1d(nn.BatchNorm1d):
+    """BatchNorm1d whose training statistics are summed over every rank.
+
+    `nn.SyncBatchNorm` only supports CUDA. The state dict is identical to BatchNorm1d,
+    so checkpoints load into the plain model unchanged.
+    """
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if not self.training or not dist.is_initialized():
+            return super().forward(x)
+
+        count = torch.full((1,), float(x.shape[0]), dtype=x.dtype)
+        # Differentiable all-reduce: gradients flow back through the global statistics.
+        totals = _AllReduceSum.apply(torch.cat([x.sum(dim=0), (x * x).sum(dim=0), count]))
+        n = totals[-1]
+        mean = totals[: self.num_features] / n
+        var = totals[self.num_features : 2 * self.num_features] / n - mean * mean
+
+        with torch.no_grad():
+            self.num_batches_tracked += 1
+            unbiased = var * n / (n - 1)
+            self.running_mean.mul_(1 - self.momentum).add_(self.momentum * mean)
+            self.running_var.mul_(1 - self.momentum).add_(self.momentum * unbiased)
+        return (x - mean) / torch.sqrt(var + self.eps) * self.weight + self.bias
+
+
+def convert_sync_batchnorm(module: nn.Module) -> nn.Module:
+    for name, child in module.named_children():
+        if isinstance(child, nn.BatchNorm1d) and not isinstance(child, CPUSyncBatchNorm1d):
+            sync = CPUSyncBatchNorm1d(child.num_features, child.eps, child.momentum, child.affine)
+            sync.load_state_dict(child.state_dict())
+            setattr(module, name, sync)
+        else:
+            convert_sync_batchnorm(child)
+    return module
+
+
+def broadcast_parameters(model: nn.Module) -> None:
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        dist.broadcast(tensor.data, src=0)
+
+
+def average_gradients(model: nn.Module, world_size: int) -> None:
+    """Average every gradient over the ranks with a single all-reduce on one flat buffer."""
+    grads = [p.grad for p in model.parameters() if p.grad is not None]
+    flat = torch.cat([g.reshape(-1) for g in grads])
+    dist.all_reduce(flat)
+    flat /= world_size
+    offset = 0
+    for g in grads:
+        g.copy_(flat[offset : offset + g.numel()].view_as(g))
+        offset += g.numel()
+
+
+def physical_cores() -> int:
+    """Distinct (physical id, core id) pairs in /proc/cpuinfo; falls back to os.cpu_count()."""
+    cores = set()
+    physical_id = core_id = None
+    try:
+        with open("/proc/cpuinfo") as fh:
+            for line in fh:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "physical id":
+                    physical_id = value.strip()
+                elif key == "core id":
+                    core_id = value.strip()
+                elif not key and core_id is not None:
+                    cores.add((physical_id, core_id))
+                    physical_id = core_id = None
+        if core_id is not None:
+            cores.add((physical_id, core_id))
+    except OSError:
+        pass
+    return len(cores) or os.cpu_count() or 1
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _worker(
+    rank: int,
+    world_size: int,
+    port: int,
+    data,
+    train_idx: np.ndarray,
+    val_idx: np.ndarray,
+    epochs: int,
+    batch_size: int,
+    threads_per_rank: int,
+    extra_metadata: Dict[str, Any],
+    out_path: Optional[Path],
+    results,
+) -> None:
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    torch.set_num_threads(threads_per_rank)
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    try:
+        x, y_cat, y_i, y_d, _ = data
+        x_train = torch.tensor(x[train_idx], dtype=torch.float32)
+        yc_train = torch.tensor(y_cat[train_idx], dtype=torch.long)
+        yi_train = torch.tensor(y_i[train_idx], dtype=torch.float32)
+        yd_train = torch.tensor(y_d[train_idx], dtype=torch.float32)
+        x_val = torch.tensor(x[val_idx], dtype=torch.float32)
+        yc_val = torch.tensor(y_cat[val_idx], dtype=torch.long)
+        yi_val = torch.tensor(y_i[val_idx], dtype=torch.float32)
+        yd_val = torch.tensor(y_d[val_idx], dtype=torch.float32)
+
+        torch.manual_seed(SEED)
+        model = convert_sync_batchnorm(WorkoutRecommender())
+        broadcast_parameters(model)
+        torch.manual_seed(SEED + rank)  # independent dropout masks per rank
+        optim = torch.optim.Adam(model.parameters(), lr=8e-4, weight_decay=1e-5)
+        ce = nn.CrossEntropyLoss()
+        mse = nn.MSELoss()
+
+        best: Dict[str, Any] = {"loss": float("inf"), "epoch": 0, "state": None}
+        n_train = x_train.shape[0]
+        # Every rank draws the same permutation; rank r takes rows r, r + world_size, ... of each global batch.
+        order_gen = torch.Generator().manual_seed(SEED)
+        epoch_seconds: List[float] = []
+
+        for epoch in range(1, epochs + 1):
+            started = time.perf_counter()
+            model.train()
+            order = torch.randperm(n_train, generator=order_gen)
+            total = torch.zeros(())
+            for start in range(0, n_train, batch_size):
+                batch = order[start : start + batch_size]
+                # Decided on the global batch so every rank skips it together; otherwise the
+                # ranks that don't would wait forever in the SyncBatchNorm/gradient all_reduce.
+                if len(batch) < 2 * world_size:
+                    continue
+                b = batch[rank::world_size]
+                cat_logits, p_i, p_d = model(x_train[b])
+                loss = ce(cat_logits, yc_train[b]) + 0.5 * mse(p_i, yi_train[b]) + 0.5 * mse(p_d, yd_train[b])
+                optim.zero_grad()
+                loss.backward()
+                average_gradients(model, world_size)
+                optim.step()
+                total += loss.detach()
+            dist.all_reduce(total)
+            epoch_seconds.append(time.perf_counter() - started)
+
+            if rank == 0:
+                model.eval()
+                with torch.no_grad():
+                    vc, vi, vd = model(x_val)
+                    vloss = ce(vc, yc_val) + 0.5 * mse(vi, yi_val) + 0.5 * mse(vd, yd_val)
+                if vloss.item() < best["loss"]:
+                    best["loss"] = float(vloss.item())
+                    best["epoch"] = epoch
+                    best["state"] = {k: v.detach().cpu().clone() for k, v in model.state_dict().items()}
+                if epoch % 10 == 0:
+                    print(f"epoch={epoch} train_loss={float(total) / world_size:.4f} val_loss={vloss.item():.6f}")
+
+        if rank == 0:
+            if out_path is not None:
+                finish_training(WorkoutRecommender(), best, data, train_idx, val_idx, extra_metadata, out_path)
+            results.put({"epoch_seconds": epoch_seconds})
+    finally:
+        dist.destroy_process_group()
+
+
+def _run(
+    world_size: int,
+    data,
+    epochs: int,
+    batch_size: int,
+    threads_per_rank: int,
+    extra_metadata: Dict[str, Any],
+    out_path: Optional[Path],
+) -> Dict[str, Any]:
+    train_idx, val_idx = split_indices(data[1])
+    results = mp.get_context("spawn").SimpleQueue()
+    mp.spawn(
+        _worker,
+        args=(
+            world_size,
+            _free_port(),
+            data,
+            train_idx,
+            val_idx,
+            epochs,
+            batch_size,
+            threads_per_rank,
+            extra_metadata,
+            out_path,
+            results,
+        ),
+        nprocs=world_size,
+        join=True,
+    )
+    return results.get()
+
+
+def train_distributed(
+    world_size: int = 2,
+    samples_per_cell: int = 22,
+    generator: str = "python",
+    epochs: int = 60,
+    batch_size: int = 128,
+    threads_per_rank: int = 1,
+    out_path: Path = MODEL_OUT_PATH,
+) -> Dict[str, Any]:
+    # The dataset is built once here: the "python" generator depends on this process's hash seed.
+    data = load_training_data(samples_per_cell, generator)
+    extra = {"generator": generator, "samples_per_cell": samples_per_cell, "world_size": world_size}
+    return _run(world_size, data, epochs, batch_size, threads_per_rank, extra, out_path)
+
+
+def benchmark_scaling(
+    world_sizes: Sequence[int],
+    samples_per_cell: int = 200,
+    generator: str = "vectorized",
+    epochs: int = 3,
+    batch_size: int = 1024,
+) -> Dict[str, Any]:
+    """Epochs/sec for each world size (first epoch dropped as warm-up); no checkpoint is written."""
+    data = load_training_data(samples_per_cell, generator)
+    runs = []
+    for world_size in world_sizes:
+        seconds = _run(world_size, data, epochs, batch_size, 1, {}, None)["epoch_seconds"]
+        timed = seconds[1:] or seconds
+        runs.append({"world_size": world_size, "epochs_per_s": len(timed) / sum(timed)})
+    base = runs[0]["epochs_per_s"] / runs[0]["world_size"]
+    for run in runs:
+        run["speedup"] = run["epochs_per_s"] / runs[0]["epochs_per_s"]
+        run["efficiency"] = run["epochs_per_s"] / (base * run["world_size"])
+    return {
+        "physical_cores": physical_cores(),
+        "rows": int(len(data[0])),
+        "batch_size": batch_size,
+        "epochs": epochs,
+        "torch": torch.__version__,
+        "runs": runs,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Data-parallel CPU training of the WorkoutRecommender.")
+    parser.add_argument("--world-size", type=int, default=None, help="training processes (default: physical cores)")
+    parser.add_argument("--generator", choices=["python", "vectorized"], default="python")
+    parser.add_argument("--samples-per-cell", type=int, default=None)
+    parser.add_argument("--epochs", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=None, help="global batch size, split across ranks")
+    parser.add_argument("--threads-per-rank", type=int, default=1)
+    parser.add_argument("--scaling", action="store_true", help="run the scaling benchmark over 1..world-size")
+    args = parser.parse_args()
+
+    world_size = args.world_size or physical_cores()
+    if args.scaling:
+        sizes = sorted({1, *[2**i for i in range(1, 8) if 2**i < world_size], world_size})
+        report = benchmark_scaling(
+            sizes,
+            args.samples_per_cell or 200,
+            "vectorized" if args.generator == "python" else args.generator,
+            args.epochs or 3,
+            args.batch_size or 1024,
+        )
+        print(json.dumps(report, indent=2))
+        return
+
+    train_distributed(
+        world_size,
+        args.samples_per_cell or 22,
+        args.generator,
+        args.epochs or 60,
+        args.batch_size or 128,
+        args.threads_per_rank,
+    )
+
+
+if __name__ == "__main__":
+    main()
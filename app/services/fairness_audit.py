@@ -0,0 +1,178 @@
+"""Grouped fairness audit for WorkoutRecommender validation predictions.
+
+All subgroup metrics for an attribute (or combination of attributes) come out of one
+`np.bincount` pass over integer group codes, so the cost is a few linear passes over
+the validation rows whatever the number of groups.
+
+Confidence intervals for the gaps (max - min over subgroups) come from a stratified
+bootstrap that keeps each subgroup's size fixed. Resampling n_g rows of a 0/1
+"correct" column is exactly Binomial(n_g, acc_g), and a resampled mean of squared
+errors is drawn from its normal approximation N(mse_g, var_g / n_g). Both are drawn
+per (replicate, group), so the bootstrap is O(replicates x groups) and does not
+touch the rows again. That keeps it fast on validation sets with millions of rows.
+"""
+from typing import Any, Dict, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_ATTRIBUTES: Tuple[Tuple[str, ...], ...] = (("goal",), ("fitness",), ("age_bin",), ("goal", "age_bin"))
+BOOTSTRAP_REPLICATES = 2000
+CONFIDENCE = 0.95
+METRICS = ("accuracy", "intensity_mse", "duration_mse")
+
+
+def encode_groups(columns: Mapping[str, Sequence[Any]], attributes: Sequence[str]) -> Tuple[np.ndarray, list]:
+    """Integer code per row for the combination of `attributes`, plus the label of each code."""
+    codes = None
+    labels: list = [()]
+    for name in attributes:
+        values, inverse = np.unique(np.asarray(columns[name]), return_inverse=True)
+        inverse = inverse.reshape(-1)
+        codes = inverse if codes is None else codes * len(values) + inverse
+        labels = [label + (str(v),) for label in labels for v in values]
+    present = np.bincount(codes, minlength=len(labels)) > 0
+    # Drop combinations that never occur and renumber densely.
+    remap = np.cumsum(present) - 1
+    return remap[codes], [label for label, keep in zip(labels, present) if keep]
+
+
+def grouped_metrics(
+    codes: np.ndarray, n_groups: int, correct: np.ndarray, sq_err_i: np.ndarray, sq_err_d: np.ndarray
+) -> Dict[str, np.ndarray]:
+    """Per-group counts, means and variances of each metric in one bincount pass per column."""
+    totals = {}
+    for name, column in zip(METRICS, (correct, sq_err_i, sq_err_d)):
+        column = np.asarray(column, dtype=np.float64)
+        totals[name] = (column, column * column)
+    return grouped_metrics_from_totals(codes, n_groups, None, totals)
+
+
+def grouped_metrics_from_totals(
+    codes: np.ndarray,
+    n_groups: int,
+    counts: Optional[np.ndarray],
+    totals: Mapping[str, Tuple[np.ndarray, np.ndarray]],
+) -> Dict[str, np.ndarray]:
+    """`grouped_metrics` when each entry is already a sum over `counts` rows (None: one row each).
+
+    `totals` maps every name in METRICS to (sum, sum of squares) per entry.
+    """
+    if counts is None:
+        n = np.bincount(codes, minlength=n_groups).astype(np.float64)
+    else:
+        n = np.bincount(codes, weights=np.asarray(counts, dtype=np.float64), minlength=n_groups)
+    out: Dict[str, np.ndarray] = {"n": n}
+    for name in METRICS:
+        column_sum, column_sq = totals[name]
+        total = np.bincount(codes, weights=column_sum, minlength=n_groups)
+        total_sq = np.bincount(codes, weights=column_sq, minlength=n_groups)
+        mean = total / n
+        out[name] = mean
+        out[f"{name}_var"] = np.maximum(total_sq / n - mean * mean, 0.0)
+    return out
+
+
+def _gap(values: np.ndarray, axis: int = -1) -> np.ndarray:
+    return values.max(axis=axis) - values.min(axis=axis)
+
+
+def bootstrap_gap_intervals(
+    metrics: Dict[str, np.ndarray],
+    replicates: int = BOOTSTRAP_REPLICATES,
+    confidence: float = CONFIDENCE,
+    rng: Optional[np.random.Generator] = None,
+) -> Dict[str, Dict[str, float]]:
+    rng = rng or np.random.default_rng(0)
+    n = metrics["n"]
+    tail = (1.0 - confidence) / 2.0
+    draws = {
+        "accuracy": rng.binomial(n.astype(np.int64), metrics["accuracy"], size=(replicates, len(n))) / n,
+    }
+    for name in ("intensity_mse", "duration_mse"):
+        scale = np.sqrt(metrics[f"{name}_var"] / n)
+        draws[name] = metrics[name] + scale * rng.standard_normal((replicates, len(n)))
+
+    intervals = {}
+    for name in METRICS:
+        gaps = _gap(draws[name])
+        intervals[f"{name}_gap"] = {
+            "estimate": float(_gap(metrics[name])),
+            "low": float(np.quantile(gaps, tail)),
+            "high": float(np.quantile(gaps, 1.0 - tail)),
+        }
+    return intervals
+
+
+def subgroup_audit(
+    pred: np.ndarray,
+    y_cat: np.ndarray,
+    p_i: np.ndarray,
+    y_i: np.ndarray,
+    p_d: np.ndarray,
+    y_d: np.ndarray,
+    columns: Mapping[str, Sequence[Any]],
+    attributes: Sequence[Sequence[str]] = DEFAULT_ATTRIBUTES,
+    replicates: int = BOOTSTRAP_REPLICATES,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """Per-subgroup metrics and bootstrap gap intervals for every attribute combination."""
+    correct = np.asarray(pred).reshape(-1) == np.asarray(y_cat).reshape(-1)
+    sq_err_i = (np.asarray(p_i, dtype=np.float64) - np.asarray(y_i, dtype=np.float64)).reshape(-1) ** 2
+    sq_err_d = (np.asarray(p_d, dtype=np.float64) - np.asarray(y_d, dtype=np.float64)).reshape(-1) ** 2
+    return _audit(
+        columns,
+        attributes,
+        replicates,
+        seed,
+        lambda codes, n_groups: grouped_metrics(codes, n_groups, correct, sq_err_i, sq_err_d),
+    )
+
+
+def subgroup_audit_from_totals(
+    columns: Mapping[str, Sequence[Any]],
+    counts: np.ndarray,
+    totals: Mapping[str, Tuple[np.ndarray, np.ndarray]],
+    attributes: Sequence[Sequence[str]] = DEFAULT_ATTRIBUTES,
+    replicates: int = BOOTSTRAP_REPLICATES,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """`subgroup_audit` from running totals, e.g. per (goal, fitness, age_bin, surgery) cell.
+
+    `columns` labels each entry, `counts` is its row count and `totals` holds its
+    (sum, sum of squares) per metric (see `grouped_metrics_from_totals`).
+    """
+    keep = np.asarray(counts) > 0
+    columns = {name: np.asarray(values)[keep] for name, values in columns.items()}
+    counts = np.asarray(counts)[keep]
+    totals = {name: (np.asarray(s)[keep], np.asarray(sq)[keep]) for name, (s, sq) in totals.items()}
+    return _audit(
+        columns,
+        attributes,
+        replicates,
+        seed,
+        lambda codes, n_groups: grouped_metrics_from_totals(codes, n_groups, counts, totals),
+    )
+
+
+def _audit(columns, attributes, replicates: int, seed: int, metrics_for) -> Dict[str, Any]:
+    rng = np.random.default_rng(seed)
+    subgroups: Dict[str, Any] = {}
+    intervals: Dict[str, Any] = {}
+    for combo in attributes:
+        key = "+".join(combo)
+        codes, labels = encode_groups(columns, combo)
+        metrics = metrics_for(codes, len(labels))
+        subgroups[key] = {
+            "/".join(label): {"n": int(metrics["n"][g]), **{m: float(metrics[m][g]) for m in METRICS}}
+            for g, label in enumerate(labels)
+        }
+        intervals[key] = bootstrap_gap_intervals(metrics, replicates, rng=rng)
+    return {"subgroups": subgroups, "gap_intervals": intervals, "confidence": CONFIDENCE, "replicates": replicates}
+
+
+def accuracy_by_group(pred: np.ndarray, y: np.ndarray, group: Sequence[str]) -> Dict[str, float]:
+    """Accuracy per value of `group`, keys sorted; what `subgroup_accuracy` returns."""
+    codes, labels = encode_groups({"group": group}, ["group"])
+    hits = np.bincount(codes, weights=np.asarray(pred) == np.asarray(y), minlength=len(labels))
+    counts = np.bincount(codes, minlength=len(labels))
+    return {label[0]: float(hits[g] / counts[g]) for g, label in enumerate(labels)}
@@ -0,0 +1,337 @@
+"""The 14-feature encoding shared by training and serving.
+
+One set of constant tables, a scalar path for a single record (`encode_record`) and a
+columnar path (`encode_columns`). The columnar path takes a dict of arrays or a
+structured NumPy array. Both paths produce identical rows.
+
+Categorical columns (fitness_level, recovery_phase, goal) may hold either strings or
+integer codes into FITNESS_LEVELS / RECOVERY_PHASES / GOALS, so generators can skip
+the string round trip.
+
+`SCHEMA_HASH` fingerprints everything that determines the encoding. Training stores
+it in the checkpoint metadata, and `check_feature_schema` refuses to serve a
+checkpoint that was trained against a different schema.
+"""
+import hashlib
+import json
+import warnings
+from datetime import date
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Union
+
+import numpy as np
+
+SCHEMA_VERSION = 1
+
+FEATURE_NAMES = [
+    "age_norm",
+    "bmi_norm",
+    "fitness_norm",
+    "is_post_surgery",
+    "recovery_phase_norm",
+    "days_since_surgery_norm",
+    "pain_norm",
+    "sleep_norm",
+    "goal_weight_loss",
+    "goal_muscle_gain",
+    "goal_endurance",
+    "goal_rehabilitation",
+    "num_conditions_norm",
+    "has_cardiac",
+]
+
+FITNESS_LEVELS = ["beginner", "intermediate", "advanced"]
+RECOVERY_PHASES = ["normal", "remodeling", "subacute", "acute"]
+GOALS = [
+    "weight_loss",
+    "muscle_gain",
+    "endurance",
+    "rehabilitation",
+    "flexibility",
+    "maintenance",
+]
+
+FITNESS_LEVEL_MAP = {"beginner": 0.0, "intermediate": 0.5, "advanced": 1.0}
+RECOVERY_PHASE_MAP = {"normal": 0.0, "remodeling": 0.33, "subacute": 0.66, "acute": 1.0}
+GOAL_ONE_HOT = {
+    "weight_loss": [1.0, 0.0, 0.0, 0.0],
+    "muscle_gain": [0.0, 1.0, 0.0, 0.0],
+    "endurance": [0.0, 0.0, 1.0, 0.0],
+    "rehabilitation": [0.0, 0.0, 0.0, 1.0],
+    "flexibility": [0.0, 0.0, 0.0, 0.0],
+    "maintenance": [0.0, 0.0, 0.0, 0.0],
+}
+UNKNOWN_GOAL = [0.0, 0.0, 0.0, 0.0]
+CARDIAC_CONDITIONS = {
+    "heart_disease",
+    "hypertension",
+    "arrhythmia",
+    "coronary_artery_disease",
+    "cardiac",
+}
+
+AGE_SCALE = 100.0
+BMI_SCALE = 40.0
+PAIN_SCALE = 10.0
+SLEEP_SCALE = 9.0
+SURGERY_DECAY_DAYS = 180.0
+MAX_CONDITIONS = 5
+
+DEFAULTS = {
+    "age": 25,
+    "weight_kg": 70.0,
+    "height_cm": 170.0,
+    "fitness_level": "beginner",
+    "recovery_phase": "normal",
+    "pain_level": 0.0,
+    "goal": "maintenance",
+}
+
+
+def _schema_hash() -> str:
+    spec = {
+        "version": SCHEMA_VERSION,
+        "features": FEATURE_NAMES,
+        "fitness": FITNESS_LEVEL_MAP,
+        "recovery": RECOVERY_PHASE_MAP,
+        "goals": GOAL_ONE_HOT,
+        "cardiac": sorted(CARDIAC_CONDITIONS),
+        "scales": [AGE_SCALE, BMI_SCALE, PAIN_SCALE, SLEEP_SCALE, SURGERY_DECAY_DAYS, MAX_CONDITIONS],
+        "sleep_by_age": [[5, 11.0], [13, 9.5], [17, 8.5], [64, 7.5], [None, 7.0]],
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+
+SCHEMA_HASH = _schema_hash()
+
+
+class FeatureSchemaMismatch(RuntimeError):
+    """Raised when a checkpoint was trained on a different feature schema than this code encodes."""
+
+
+def schema_metadata() -> Dict[str, Any]:
+    return {"feature_schema_version": SCHEMA_VERSION, "feature_schema_hash": SCHEMA_HASH}
+
+
+def check_feature_schema(metadata: Optional[Mapping[str, Any]], source: str = "checkpoint") -> None:
+    """Refuse a checkpoint with a different schema hash; legacy checkpoints without one only warn."""
+    stored = (metadata or {}).get("feature_schema_hash")
+    if stored is None:
+        warnings.warn(f"{source} has no feature schema hash; assuming it matches {SCHEMA_HASH}", stacklevel=2)
+        return
+    if str(stored) != SCHEMA_HASH:
+        raise FeatureSchemaMismatch(
+            f"{source} was trained with feature schema {stored}, this server encodes {SCHEMA_HASH}"
+        )
+
+
+def _clamp(value: float, low: float, high: float) -> float:
+    return max(low, min(value, high))
+
+
+def estimate_sleep_hours(age: int) -> float:
+    """Age-based fallback when sleep_hours is not provided by client."""
+    if age <= 5:
+        return 11.0
+    if age <= 13:
+        return 9.5
+    if age <= 17:
+        return 8.5
+    if age <= 64:
+        return 7.5
+    return 7.0
+
+
+def days_since(surgery_date_value: Optional[date], today: Optional[date] = None) -> Optional[int]:
+    if surgery_date_value is None:
+        return None
+    return ((today or date.today()) - surgery_date_value).days
+
+
+def days_since_surgery_score(is_post_surgery: bool, days: Optional[float]) -> float:
+    if not is_post_surgery or days is None:
+        return 0.0
+    if days < 0:
+        return 1.0
+    # Fresh surgery near 1.0, and linearly decays to 0 by ~6 months.
+    return _clamp(1.0 - (days / SURGERY_DECAY_DAYS), 0.0, 1.0)
+
+
+def _days_from_record(record: Mapping[str, Any]) -> Optional[float]:
+    if record.get("days_since_surgery") is not None:
+        return float(record["days_since_surgery"])
+    return days_since(record.get("surgery_date"))
+
+
+def encode_record(record: Mapping[str, Any]) -> List[float]:
+    """Scalar path: one profile dict (API payload or training profile) to 14 features."""
+    age = float(record.get("age", DEFAULTS["age"]))
+    if record.get("bmi") is not None:
+        bmi = float(record["bmi"])
+    else:
+        height_m = max(float(record.get("height_cm", DEFAULTS["height_cm"])) / 100.0, 0.5)
+        bmi = float(record.get("weight_kg", DEFAULTS["weight_kg"])) / (height_m * height_m)
+
+    fitness_level = str(record.get("fitness_level", DEFAULTS["fitness_level"])).lower()
+    is_post_surgery = bool(record.get("is_post_surgery", False))
+    recovery_phase = str(record.get("recovery_phase", DEFAULTS["recovery_phase"])).lower()
+    pain_level = float(record.get("pain_level", DEFAULTS["pain_level"]))
+    sleep_hours_raw = record.get("sleep_hours", None)
+    sleep_hours = float(sleep_hours_raw) if sleep_hours_raw is not None else estimate_sleep_hours(int(age))
+    goal = str(record.get("goal", DEFAULTS["goal"])).lower()
+    medical_conditions = [str(item).lower() for item in record.get("medical_conditions", [])]
+
+    return [
+        _clamp(age / AGE_SCALE, 0.0, 1.0),
+        _clamp(bmi / BMI_SCALE, 0.0, 1.0),
+        FITNESS_LEVEL_MAP.get(fitness_level, 0.0),
+        1.0 if is_post_surgery else 0.0,
+        RECOVERY_PHASE_MAP.get(recovery_phase, 0.0),
+        days_since_surgery_score(is_post_surgery, _days_from_record(record)),
+        _clamp(pain_level / PAIN_SCALE, 0.0, 1.0),
+        _clamp(sleep_hours / SLEEP_SCALE, 0.0, 1.0),
+        *GOAL_ONE_HOT.get(goal, UNKNOWN_GOAL),
+        _clamp(min(len(medical_conditions), MAX_CONDITIONS) / MAX_CONDITIONS, 0.0, 1.0),
+        1.0 if any(cond in CARDIAC_CONDITIONS for cond in medical_conditions) else 0.0,
+    ]
+
+
+def estimate_sleep_hours_array(age: np.ndarray) -> np.ndarray:
+    age_int = np.trunc(age)
+    return np.select(
+        [age_int <= 5, age_int <= 13, age_int <= 17, age_int <= 64],
+        [11.0, 9.5, 8.5, 7.5],
+        default=7.0,
+    )
+
+
+def _categorical(values: np.ndarray, names: Sequence[str], table: np.ndarray, unknown: np.ndarray) -> np.ndarray:
+    """Look up per-row values in `table` from integer codes or (case-insensitive) strings."""
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.integer):
+        codes = values.astype(np.int64)
+    else:
+        uniques, inverse = np.unique(values.astype(str), return_inverse=True)
+        index = {name: i for i, name in enumerate(names)}
+        unique_codes = np.array([index.get(u.lower(), -1) for u in uniques], dtype=np.int64)
+        codes = unique_codes[inverse.reshape(-1)]
+    padded = np.concatenate([table, unknown[None]]) if table.ndim > 1 else np.append(table, unknown)
+    return padded[np.where((codes >= 0) & (codes < len(names)), codes, len(names))]
+
+
+def _column(columns, name: str, default: Any = None, dtype=np.float64) -> Optional[np.ndarray]:
+    names = columns.dtype.names if isinstance(columns, np.ndarray) else columns
+    if name in names:
+        return np.asarray(columns[name], dtype=dtype)
+    if default is None:
+        return None
+    return np.full(_length(columns), default, dtype=dtype)
+
+
+def _length(columns) -> int:
+    if isinstance(columns, np.ndarray):
+        return len(columns)
+    return len(next(iter(columns.values())))
+
+
+def encode_columns(columns: Union[Mapping[str, Sequence[Any]], np.ndarray]) -> np.ndarray:
+    """Columnar path: an (n, 14) float64 matrix whose rows match `encode_record`.
+
+    Recognised columns: age, bmi or weight_kg + height_cm, fitness_level,
+    is_post_surgery, recovery_phase, days_since_surgery (NaN = unknown), pain_level,
+    sleep_hours (NaN = estimate from age), goal, and either medical_conditions (a
+    list per row) or num_conditions + has_cardiac.
+    """
+    n = _length(columns)
+    age = _column(columns, "age", DEFAULTS["age"])
+    bmi = _column(columns, "bmi")
+    if bmi is None:
+        height_m = np.maximum(_column(columns, "height_cm", DEFAULTS["height_cm"]) / 100.0, 0.5)
+        bmi = _column(columns, "weight_kg", DEFAULTS["weight_kg"]) / (height_m * height_m)
+    is_post_surgery = _column(columns, "is_post_surgery", False, dtype=bool)
+    days = _column(columns, "days_since_surgery", np.nan)
+    pain_level = _column(columns, "pain_level", DEFAULTS["pain_level"])
+    sleep_hours = _column(columns, "sleep_hours", np.nan)
+    sleep_hours = np.where(np.isnan(sleep_hours), estimate_sleep_hours_array(age), sleep_hours)
+
+    fitness = _column(columns, "fitness_level", DEFAULTS["fitness_level"], dtype=None)
+    recovery = _column(columns, "recovery_phase", DEFAULTS["recovery_phase"], dtype=None)
+    goal = _column(columns, "goal", DEFAULTS["goal"], dtype=None)
+
+    names = columns.dtype.names if isinstance(columns, np.ndarray) else columns
+    if "num_conditions" in names:
+        num_conditions = _column(columns, "num_conditions")
+        has_cardiac = _column(columns, "has_cardiac", False, dtype=bool)
+    else:
+        conditions = [[str(item).lower() for item in row] for row in columns.get("medical_conditions", [[]] * n)]
+        num_conditions = np.fromiter((len(c) for c in conditions), dtype=np.float64, count=n)
+        has_cardiac = np.fromiter(
+            (any(cond in CARDIAC_CONDITIONS for cond in c) for c in conditions), dtype=bool, count=n
+        )
+
+    days_score = np.where(days < 0, 1.0, np.clip(1.0 - (days / SURGERY_DECAY_DAYS), 0.0, 1.0))
+
+    features = np.empty((n, len(FEATURE_NAMES)), dtype=np.float64)
+    features[:, 0] = np.clip(age / AGE_SCALE, 0.0, 1.0)
+    features[:, 1] = np.clip(bmi / BMI_SCALE, 0.0, 1.0)
+    features[:, 2] = _categorical(
+        fitness, FITNESS_LEVELS, np.array([FITNESS_LEVEL_MAP[f] for f in FITNESS_LEVELS]), np.array(0.0)
+    )
+    features[:, 3] = is_post_surgery
+    features[:, 4] = _categorical(
+        recovery, RECOVERY_PHASES, np.array([RECOVERY_PHASE_MAP[p] for p in RECOVERY_PHASES]), np.array(0.0)
+    )
+    features[:, 5] = np.where(is_post_surgery & ~np.isnan(days), days_score, 0.0)
+    features[:, 6] = np.clip(pain_level / PAIN_SCALE, 0.0, 1.0)
+    features[:, 7] = np.clip(sleep_hours / SLEEP_SCALE, 0.0, 1.0)
+    features[:, 8:12] = _categorical(
+        goal, GOALS, np.array([GOAL_ONE_HOT[g] for g in GOALS]), np.array(UNKNOWN_GOAL)
+    )
+    features[:, 12] = np.clip(np.minimum(num_conditions, MAX_CONDITIONS) / MAX_CONDITIONS, 0.0, 1.0)
+    features[:, 13] = has_cardiac
+    return features
+
+
+def records_to_columns(records: Sequence[Mapping[str, Any]], today: Optional[date] = None) -> Dict[str, np.ndarray]:
+    """Gather API-style dicts into the columns `encode_columns` expects (one pass per field)."""
+    n = len(records)
+    today = today or date.today()
+
+    def floats(name: str, default: Any) -> np.ndarray:
+        return np.fromiter((float(r.get(name, default)) for r in records), dtype=np.float64, count=n)
+
+    def optional_floats(values) -> np.ndarray:
+        return np.fromiter((np.nan if v is None else float(v) for v in values), dtype=np.float64, count=n)
+
+    def strings(name: str) -> np.ndarray:
+        return np.array([str(r.get(name, DEFAULTS[name])).lower() for r in records], dtype=object)
+
+    columns: Dict[str, Any] = {
+        "age": floats("age", DEFAULTS["age"]),
+        "weight_kg": floats("weight_kg", DEFAULTS["weight_kg"]),
+        "height_cm": floats("height_cm", DEFAULTS["height_cm"]),
+        "fitness_level": strings("fitness_level"),
+        "is_post_surgery": np.fromiter((bool(r.get("is_post_surgery", False)) for r in records), dtype=bool, count=n),
+        "recovery_phase": strings("recovery_phase"),
+        "days_since_surgery": optional_floats(
+            r["days_since_surgery"] if r.get("days_since_surgery") is not None else days_since(r.get("surgery_date"), today)
+            for r in records
+        ),
+        "pain_level": floats("pain_level", DEFAULTS["pain_level"]),
+        "sleep_hours": optional_floats(r.get("sleep_hours", None) for r in records),
+        "goal": strings("goal"),
+        "medical_conditions": [r.get("medical_conditions", []) for r in records],
+    }
+    if any(r.get("bmi") is not None for r in records):
+        columns["bmi"] = optional_floats(r.get("bmi") for r in records)
+        missing = np.isnan(columns["bmi"])
+        if missing.any():
+            height_m = np.maximum(columns["height_cm"] / 100.0, 0.5)
+            columns["bmi"][missing] = (columns["weight_kg"] / (height_m * height_m))[missing]
+    return columns
+
+
+def encode_records(records: Sequence[Mapping[str, Any]]) -> np.ndarray:
+    """Batch path for API-style dicts: `records_to_columns` + `encode_columns`."""
+    if len(records) == 0:
+        return np.empty((0, len(FEATURE_NAMES)), dtype=np.float64)
+    return encode_columns(records_to_columns(records))
@@ -2,6 +2,8 @@ from typing import Dict
 
 from app.Schemas.fitness_schema import FitnessInput
 from app import models
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 
@@ -106,6 +108,35 @@ def get_user_fitness_summary(db: Session, current_user_email: str) -> Dict[str,
     }
 
 
+async def update_user_fitness_analysis_async(
+    db: AsyncSession, current_user_email: str, data: FitnessInput
+) -> Dict[str, int | float | str]:
+    result = await db.execute(select(models.User).where(models.User.email == current_user_email))
+    user = result.scalars().first()
+    if not user:
+        raise ValueError("User not found")
+
+    analysis = analyze_fitness(data)
+    user.fitness_score = int(analysis["fitness_score"])
+    user.fitness_level = str(analysis["fitness_level"])
+    await db.commit()
+    await db.refresh(user)
+    return analysis
+
+
+async def get_user_fitness_summary_async(db: AsyncSession, current_user_email: str) -> Dict[str, int | str | None]:
+    result = await db.execute(select(models.User).where(models.User.email == current_user_email))
+    user = result.scalars().first()
+    if not user:
+        raise ValueError("User not found")
+
+    return {
+        "fitness_score": user.fitness_score,
+        "fitness_level": user.fitness_level,
+        "sleep_hours":user.sleep_hours,
+    }
+
+
 def generate_recommendations(level, bmi, sleep, total_minutes):
 
     recommendations = []
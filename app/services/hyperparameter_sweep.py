@@ -0,0 +1,260 @@
+"""Hyperparameter sweep / k-fold runner for the WorkoutRecommender.
+
+Every (config, fold) pair is one trial. Trials run on a process pool and each one
+is cached under a hash of its config, its fold and the training data, in
+`<cache-dir>/<trial key>/` (metrics.json + model.pt), so re-running a sweep only
+trains what is missing. From epoch `--prune-after` on, a trial whose validation
+loss is above `--prune-ratio` times the best finished loss on the same fold is
+stopped and recorded as pruned. Pruned trials are not reused from the cache: whether
+a trial gets pruned depends on the prune settings and on which trials finished
+first, so a re-run trains them again.
+
+    python -m app.services.hyperparameter_sweep --lr 8e-4 2e-3 --dropout 0.2 0.3 --folds 5
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, fields
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.train_workout_recommender import (
+    SEED,
+    TrainConfig,
+    finish_training,
+    fit,
+    load_training_data,
+    split_indices,
+)
+
+SWEEP_DIR = Path(__file__).resolve().parents[1] / "models" / "sweeps"
+METRICS_FILE = "metrics.json"
+
+# Per-worker state, set once by `_init_worker`.
+_data = None
+_best_val_loss = None
+
+
+def data_hash(data) -> str:
+    digest = hashlib.sha256()
+    for array in data[:4]:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def trial_key(config: TrainConfig, fold: int, folds: int, data_sha: str) -> str:
+    spec = {"config": asdict(config), "fold": fold, "folds": folds, "seed": SEED, "data": data_sha}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def fold_indices(y_cat: np.ndarray, folds: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """`folds=1` is the usual holdout split of `train_and_save`; otherwise stratified k-fold."""
+    if folds <= 1:
+        return [split_indices(y_cat)]
+    from sklearn.model_selection import StratifiedKFold
+
+    splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=SEED)
+    return list(splitter.split(np.zeros(len(y_cat)), y_cat))
+
+
+def read_trial(trial_dir: Path) -> Optional[Dict[str, Any]]:
+    try:
+        with open(trial_dir / METRICS_FILE) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def _init_worker(data, best_val_loss) -> None:
+    global _data, _best_val_loss
+    _data = data
+    _best_val_loss = best_val_loss
+
+
+def run_trial(
+    trial_dir: str,
+    config: Dict[str, Any],
+    fold: int,
+    folds: int,
+    prune_after: int,
+    prune_ratio: float,
+) -> Dict[str, Any]:
+    import torch
+
+    torch.manual_seed(SEED)
+    torch.set_num_threads(1)
+    trial_dir_path = Path(trial_dir)
+    trial_dir_path.mkdir(parents=True, exist_ok=True)
+    train_idx, val_idx = fold_indices(_data[1], folds)[fold]
+    pruned = {"epoch": None, "threshold": None}
+
+    def on_epoch(epoch: int, val_loss: float) -> bool:
+        if epoch < prune_after or not np.isfinite(_best_val_loss[fold]):
+            return True
+        threshold = _best_val_loss[fold] * prune_ratio
+        if val_loss > threshold:
+            pruned.update(epoch=epoch, threshold=threshold)
+            return False
+        return True
+
+    model, best = fit(TrainConfig(**config), _data, train_idx, val_idx, on_epoch)
+    result: Dict[str, Any] = {
+        "config": config,
+        "fold": fold,
+        "folds": folds,
+        "best_epoch": best["epoch"],
+        "val_loss": best["loss"],
+        "pruned": pruned["epoch"] is not None,
+    }
+    if result["pruned"]:
+        result.update(pruned_at_epoch=pruned["epoch"], prune_threshold=pruned["threshold"])
+    else:
+        extra = {"sweep_config": config, "fold": fold, "folds": folds}
+        result["audit"] = finish_training(model, best, _data, train_idx, val_idx, extra, trial_dir_path / "model.pt")
+        with _best_val_loss.get_lock():
+            _best_val_loss[fold] = min(_best_val_loss[fold], best["loss"])
+
+    tmp_path = trial_dir_path / f"{METRICS_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as fh:
+        json.dump(result, fh, indent=2)
+    os.replace(tmp_path, trial_dir_path / METRICS_FILE)
+    return result
+
+
+def leaderboard(results: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """One row per config, averaged over its finished folds, best mean validation loss first."""
+    by_config: Dict[str, List[Dict[str, Any]]] = {}
+    for result in results:
+        by_config.setdefault(json.dumps(result["config"], sort_keys=True), []).append(result)
+
+    rows = []
+    for trials in by_config.values():
+        done = [t for t in trials if not t["pruned"]]
+        row: Dict[str, Any] = {
+            "config": trials[0]["config"],
+            "folds_done": len(done),
+            "folds_pruned": len(trials) - len(done),
+        }
+        if done:
+            audits = [t["audit"] for t in done]
+            row["val_loss"] = float(np.mean([t["val_loss"] for t in done]))
+            row["val_loss_std"] = float(np.std([t["val_loss"] for t in done]))
+            for metric in ("category_acc", "intensity_mse", "duration_mse"):
+                row[metric] = float(np.mean([a["overall"][metric] for a in audits]))
+            for gap in ("goal_gap", "fitness_gap", "age_gap"):
+                row[gap] = float(np.mean([a["fairness_gaps"][gap] for a in audits]))
+        rows.append(row)
+    rows.sort(key=lambda r: (r["folds_done"] == 0, r.get("val_loss", float("inf"))))
+    return rows
+
+
+def expand_grid(grid: Dict[str, Sequence[Any]]) -> List[TrainConfig]:
+    names = list(grid)
+    return [TrainConfig(**dict(zip(names, values))) for values in itertools.product(*(grid[n] for n in names))]
+
+
+def run_sweep(
+    configs: Sequence[TrainConfig],
+    folds: int = 1,
+    samples_per_cell: int = 22,
+    generator: str = "vectorized",
+    workers: Optional[int] = None,
+    cache_dir: Path = SWEEP_DIR,
+    prune_after: int = 10,
+    prune_ratio: float = 1.5,
+) -> Dict[str, Any]:
+    data = load_training_data(samples_per_cell, generator)
+    data_sha = data_hash(data)
+    cache_dir = Path(cache_dir)
+
+    results: List[Dict[str, Any]] = []
+    pending: List[Tuple[str, Dict[str, Any], int]] = []
+    for config in configs:
+        for fold in range(folds):
+            trial_dir = cache_dir / trial_key(config, fold, folds, data_sha)
+            cached = read_trial(trial_dir)
+            if cached is not None and not cached["pruned"]:
+                results.append(cached)
+            else:
+                pending.append((str(trial_dir), asdict(config), fold))
+
+    ctx = multiprocessing.get_context("spawn")
+    # Best finished validation loss per fold, shared with the workers for pruning.
+    best_val_loss = ctx.Array("d", [float("inf")] * folds)
+    for result in results:
+        if not result["pruned"]:
+            best_val_loss[result["fold"]] = min(best_val_loss[result["fold"]], result["val_loss"])
+    print(f"trials: {len(results) + len(pending)} cached: {len(results)} to run: {len(pending)}", file=sys.stderr)
+
+    if pending:
+        with ProcessPoolExecutor(
+            max_workers=workers or os.cpu_count() or 1,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(data, best_val_loss),
+        ) as pool:
+            futures = [
+                pool.submit(run_trial, trial_dir, config, fold, folds, prune_after, prune_ratio)
+                for trial_dir, config, fold in pending
+            ]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                status = "pruned" if result["pruned"] else f"val_loss={result['val_loss']:.6f}"
+                print(f"trial fold={result['fold']} {result['config']} {status}", file=sys.stderr)
+
+    report = {
+        "data_sha256": data_sha,
+        "samples_per_cell": samples_per_cell,
+        "generator": generator,
+        "folds": folds,
+        "leaderboard": leaderboard(results),
+    }
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with open(cache_dir / "leaderboard.json", "w") as fh:
+        json.dump(report, fh, indent=2)
+    return report
+
+
+def main() -> None:
+    defaults = TrainConfig()
+    parser = argparse.ArgumentParser(description="Hyperparameter sweep / k-fold runner for the WorkoutRecommender.")
+    for field in fields(TrainConfig):
+        parser.add_argument(
+            f"--{field.name.replace('_', '-')}",
+            type=type(getattr(defaults, field.name)),
+            nargs="+",
+            default=[getattr(defaults, field.name)],
+        )
+    parser.add_argument("--folds", type=int, default=1, help="1 = the usual 80/20 holdout")
+    parser.add_argument("--samples-per-cell", type=int, default=22)
+    parser.add_argument("--generator", choices=["python", "vectorized"], default="vectorized")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache-dir", type=Path, default=SWEEP_DIR)
+    parser.add_argument("--prune-after", type=int, default=10, help="first epoch at which a trial may be pruned")
+    parser.add_argument("--prune-ratio", type=float, default=1.5, help="prune above this x best finished val loss")
+    args = parser.parse_args()
+
+    grid = {field.name: getattr(args, field.name) for field in fields(TrainConfig)}
+    report = run_sweep(
+        expand_grid(grid),
+        args.folds,
+        args.samples_per_cell,
+        args.generator,
+        args.workers,
+        args.cache_dir,
+        args.prune_after,
+        args.prune_ratio,
+    )
+    print(json.dumps(report["leaderboard"], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""Out-of-process inference workers.
+
+With ML_INFERENCE_MODE=pool the web process never runs a forward pass itself.
+Each (already micro-batched) feature matrix is sent to one of a fixed set of
+worker processes over a Unix socket pair (`multiprocessing.Pipe`). Every worker
+loads the model once per checkpoint and pins its torch intra-op threads, so
+inference no longer competes with DB work and argon2 hashing for the web
+process's threadpool and cores.
+"""
+import itertools
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# A request that was in flight on a crashed worker is retried this many times in total.
+MAX_ATTEMPTS = 2
+
+
+class InferencePoolFull(RuntimeError):
+    """Raised when the pool already has `max_pending` requests outstanding."""
+
+
+class InferenceWorkerCrashed(RuntimeError):
+    """Raised when a request keeps landing on workers that die before answering."""
+
+
+def _pin_threads(threads: int) -> None:
+    if "torch" in sys.modules:
+        torch = sys.modules["torch"]
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass  # can only be set once per process
+
+
+def _worker_main(conn, threads: int) -> None:
+    # Workers always run the model in-process, whatever the parent was configured with.
+    os.environ["ML_INFERENCE_MODE"] = "local"
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+
+    from app.services import ml_service
+
+    models: Dict[str, Any] = {}
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message is None:
+            return
+
+        request_id, checkpoint_path, x = message
+        try:
+            model = models.get(checkpoint_path)
+            if model is None:
+                # Keep at most the previous model around while a hot-swap drains.
+                while len(models) >= 2:
+                    models.pop(next(iter(models)))
+                model = models[checkpoint_path] = ml_service.load_recommender(checkpoint_path)
+                _pin_threads(threads)
+            conn.send((request_id, True, model(x)))
+        except Exception as exc:
+            conn.send((request_id, False, f"{type(exc).__name__}: {exc}"))
+
+
+class _Request:
+    __slots__ = ("request_id", "checkpoint_path", "x", "future", "attempts")
+
+    def __init__(self, request_id: int, checkpoint_path: str, x: np.ndarray) -> None:
+        self.request_id = request_id
+        self.checkpoint_path = checkpoint_path
+        self.x = x
+        self.future: Future = Future()
+        self.attempts = 0
+
+
+class _Worker:
+    def __init__(self, index: int) -> None:
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.send_lock = threading.Lock()
+        self.in_flight: Dict[int, _Request] = {}
+        self.served = 0
+        self.restarts = 0
+
+
+class InferencePool:
+    def __init__(self, processes: int = 2, threads_per_worker: int = 1, max_pending: int = 256) -> None:
+        if processes < 1:
+            raise ValueError("processes must be >= 1")
+        self.processes = processes
+        self.threads_per_worker = threads_per_worker
+        self.max_pending = max_pending
+
+        self._ctx = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._pending = 0
+        self._rejected = 0
+        self._crashes = 0
+        self._closed = False
+        self._workers: List[_Worker] = []
+        for index in range(processes):
+            worker = _Worker(index)
+            worker.process, worker.conn = self._start_process(index)
+            self._workers.append(worker)
+            self._start_receiver(worker, worker.conn)
+
+    def _start_process(self, index: int) -> Tuple[Any, Any]:
+        parent_conn, child_conn = self._ctx.Pipe(duplex=True)
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.threads_per_worker),
+            name=f"inference-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        # Only the child holds its end now, so the parent sees EOF as soon as the child dies.
+        child_conn.close()
+        return process, parent_conn
+
+    def _start_receiver(self, worker: _Worker, conn) -> None:
+        threading.Thread(
+            target=self._receive, args=(worker, conn), name=f"inference-receiver-{worker.index}", daemon=True
+        ).start()
+
+    def submit(self, checkpoint_path: str, x: np.ndarray) -> Future:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("InferencePool is closed")
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise InferencePoolFull(f"Inference queue is full ({self.max_pending} requests pending)")
+            self._pending += 1
+        request = _Request(next(self._ids), checkpoint_path, np.ascontiguousarray(x, dtype=np.float32))
+        self._dispatch(request)
+        return request.future
+
+    def run(self, checkpoint_path: str, x: np.ndarray, timeout: Optional[float] = None):
+        return self.submit(checkpoint_path, x).result(timeout)
+
+    def _dispatch(self, request: _Request) -> None:
+        with self._lock:
+            worker = min(self._workers, key=lambda w: len(w.in_flight))
+            request.attempts += 1
+            worker.in_flight[request.request_id] = request
+            conn = worker.conn
+        try:
+            with worker.send_lock:
+                conn.send((request.request_id, request.checkpoint_path, request.x))
+        except (OSError, EOFError):
+            pass  # the receiver sees the dead worker and re-dispatches everything it held
+
+    def _finish(self, request: _Request, ok: bool, payload: Any) -> None:
+        with self._lock:
+            self._pending -= 1
+        if ok:
+            request.future.set_result(payload)
+        elif isinstance(payload, BaseException):
+            request.future.set_exception(payload)
+        else:
+            request.future.set_exception(RuntimeError(payload))
+
+    def _receive(self, worker: _Worker, conn) -> None:
+        while True:
+            try:
+                request_id, ok, payload = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                request = worker.in_flight.pop(request_id, None)
+                if request is not None:
+                    worker.served += 1
+            if request is not None:
+                self._finish(request, ok, payload)
+        self._recover(worker, conn)
+
+    def _recover(self, worker: _Worker, dead_conn) -> None:
+        with self._lock:
+            closed = self._closed
+        if closed:
+            new_process, new_conn = None, None
+        else:
+            new_process, new_conn = self._start_process(worker.index)
+
+        with self._lock:
+            orphans = list(worker.in_flight.values())
+            worker.in_flight.clear()
+            old_process = worker.process
+            if new_conn is not None:
+                worker.process, worker.conn = new_process, new_conn
+                worker.restarts += 1
+                self._crashes += 1
+        dead_conn.close()
+        if old_process is not None:
+            old_process.join(timeout=1)
+
+        if new_conn is not None:
+            self._start_receiver(worker, new_conn)
+        for request in orphans:
+            if new_conn is not None and request.attempts < MAX_ATTEMPTS:
+                self._dispatch(request)
+            else:
+                self._finish(request, False, InferenceWorkerCrashed("Inference worker exited before answering"))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "processes": self.processes,
+                "threads_per_worker": self.threads_per_worker,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "rejected": self._rejected,
+                "crashes": self._crashes,
+                "workers": [
+                    {
+                        "pid": worker.process.pid if worker.process is not None else None,
+                        "alive": worker.process is not None and worker.process.is_alive(),
+                        "in_flight": len(worker.in_flight),
+                        "served": worker.served,
+                        "restarts": worker.restarts,
+                    }
+                    for worker in self._workers
+                ],
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers = list(self._workers)
+        for worker in workers:
+            try:
+                with worker.send_lock:
+                    worker.conn.send(None)
+            except (OSError, EOFError):
+                pass
+        for worker in workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+
+class PooledRecommender:
+    """Recommender facade that forwards every batch to the worker pool."""
+
+    def __init__(self, pool: InferencePool, checkpoint_path: str, backend: str, timeout: Optional[float]) -> None:
+        self.pool = pool
+        self.checkpoint_path = checkpoint_path
+        self.backend = f"pool:{backend}"
+        self.timeout = timeout
+
+    def __call__(self, x: np.ndarray):
+        return self.pool.run(self.checkpoint_path, x, self.timeout)
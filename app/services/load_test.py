@@ -0,0 +1,228 @@
+"""Load test: threadpool (sync `def`) vs async (`async def`) request handling.
+
+Starts one uvicorn worker serving the same keyset page of /users two ways:
+`/threadpool/users` (Session from `make_engine`, `crud.get_users`, run on the AnyIO
+threadpool) and `/async/users` (AsyncSession from `make_async_engine`,
+`crud.get_users_async`, on the event loop). Every request first waits
+`--query-delay-ms` inside the database (`pg_sleep` on Postgres, a registered
+`sleep_ms()` function on SQLite) to stand in for a real query's latency. Both pools
+get `--pool-size` connections, so the database is not what limits concurrency.
+
+For each concurrency level the client keeps that many requests in flight for
+`--seconds` and records throughput, p50 and p99. The "sustained concurrency" of a
+mode is the highest level whose p99 stays under `--p99-ms`.
+
+    python -m app.services.load_test --url sqlite:////tmp/loadtest.db
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import time
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+DEFAULT_CONCURRENCY = (8, 16, 32, 64, 128, 256)
+SEED_USERS = 200
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _sqlite_sleep(ms: float) -> int:
+    time.sleep(ms / 1000.0)
+    return 0
+
+
+def _delay_sql(url: str) -> str:
+    return "SELECT pg_sleep(:ms / 1000.0)" if url.startswith("postgresql") else "SELECT sleep_ms(:ms)"
+
+
+def seed_users(url: str, n: int = SEED_USERS) -> None:
+    from datetime import date
+
+    from sqlalchemy import func, select
+    from sqlalchemy.orm import Session
+
+    from app import models
+    from app.database import make_engine
+
+    engine = make_engine(url)
+    models.Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        have = db.scalar(select(func.count()).select_from(models.User))
+        for i in range(have, n):
+            db.add(
+                models.User(
+                    firstName=f"load{i}", lastName="test", email=f"load{i}@example.com", phone="0",
+                    dateOfBirth=date(1990, 1, 1), age=35, gender="other", bloodGroup="O+", address="-",
+                    city="-", state="-", zipCode="-", emergencyContactName="-", emergencyContactPhone="-",
+                    medical_conditions=[], password="-",
+                )
+            )
+        db.commit()
+    engine.dispose()
+
+
+def build_app(url: str, pool_size: int, delay_ms: float):
+    from fastapi import FastAPI
+    from sqlalchemy import event, text
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from sqlalchemy.orm import sessionmaker
+
+    from app import crud
+    from app.database import async_url, make_async_engine, make_engine
+
+    pool = dict(pool_size=pool_size, max_overflow=0)
+    sync_engine = make_engine(url, **pool)
+    async_engine = make_async_engine(async_url(url), **pool)
+    if not url.startswith("postgresql"):
+        for target in (sync_engine, async_engine.sync_engine):
+            event.listen(target, "connect", lambda conn, _: conn.create_function("sleep_ms", 1, _sqlite_sleep))
+    sync_sessions = sessionmaker(bind=sync_engine)
+    async_sessions = async_sessionmaker(async_engine)
+    delay = text(_delay_sql(url))
+
+    app = FastAPI()
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.get("/threadpool/users")
+    def threadpool_users(after_id: int = 0):
+        with sync_sessions() as db:
+            db.execute(delay, {"ms": delay_ms})
+            return [user.id for user in crud.get_users(db, after_id, 20)]
+
+    @app.get("/async/users")
+    async def async_users(after_id: int = 0):
+        async with async_sessions() as db:
+            await db.execute(delay, {"ms": delay_ms})
+            return [user.id for user in await crud.get_users_async(db, after_id, 20)]
+
+    return app
+
+
+def _serve(url: str, pool_size: int, delay_ms: float, port: int) -> None:
+    import uvicorn
+
+    uvicorn.run(build_app(url, pool_size, delay_ms), host="127.0.0.1", port=port, log_level="warning")
+
+
+async def _wait_ready(client, base: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get(f"{base}/health")).status_code == 200:
+                return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+        await asyncio.sleep(0.2)
+
+
+async def _drive(client, url: str, concurrency: int, seconds: float) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.monotonic() + seconds
+
+    async def worker(i: int) -> None:
+        nonlocal errors
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await client.get(url, params={"after_id": i % SEED_USERS})
+                ok = response.status_code == 200
+            except Exception:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.monotonic() - started
+    ms = np.asarray(latencies) * 1000 if latencies else np.asarray([np.inf])
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+async def _run_client(port: int, levels: Sequence[int], seconds: float) -> Dict[str, List[Dict[str, Any]]]:
+    import httpx
+
+    base = f"http://127.0.0.1:{port}"
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(limits=limits, timeout=60.0) as client:
+        await _wait_ready(client, base)
+        results: Dict[str, List[Dict[str, Any]]] = {}
+        for mode in ("threadpool", "async"):
+            await _drive(client, f"{base}/{mode}/users", min(levels), 1.0)  # warm-up
+            results[mode] = [await _drive(client, f"{base}/{mode}/users", c, seconds) for c in levels]
+        return results
+
+
+def run(
+    url: str,
+    levels: Sequence[int] = DEFAULT_CONCURRENCY,
+    seconds: float = 5.0,
+    delay_ms: float = 20.0,
+    pool_size: int = 300,
+    p99_ms: float = 200.0,
+) -> Dict[str, Any]:
+    # app.database builds its default engine from DATABASE_URL on import; the server process inherits this.
+    os.environ.setdefault("DATABASE_URL", url)
+    seed_users(url)
+    port = _free_port()
+    server = multiprocessing.get_context("spawn").Process(target=_serve, args=(url, pool_size, delay_ms, port))
+    server.start()
+    try:
+        results = asyncio.run(_run_client(port, sorted(levels), seconds))
+    finally:
+        server.terminate()
+        server.join()
+
+    sustained = {
+        mode: max((r["concurrency"] for r in rows if r["p99_ms"] <= p99_ms and not r["errors"]), default=0)
+        for mode, rows in results.items()
+    }
+    return {
+        "database": url.split("://")[0],
+        "query_delay_ms": delay_ms,
+        "pool_size": pool_size,
+        "p99_target_ms": p99_ms,
+        "seconds_per_level": seconds,
+        "sustained_concurrency": sustained,
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Threadpool vs async load test of the /users read path.")
+    parser.add_argument("--url", default="sqlite:////tmp/loadtest.db", help="sync SQLAlchemy URL of a scratch database")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=list(DEFAULT_CONCURRENCY))
+    parser.add_argument("--seconds", type=float, default=5.0, help="per concurrency level and mode")
+    parser.add_argument("--query-delay-ms", type=float, default=20.0, help="database-side latency per request")
+    parser.add_argument("--pool-size", type=int, default=300)
+    parser.add_argument("--p99-ms", type=float, default=200.0)
+    args = parser.parse_args()
+
+    report = run(args.url, args.concurrency, args.seconds, args.query_delay_ms, args.pool_size, args.p99_ms)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+
+class _PendingPrediction:
+    __slots__ = ("features", "enqueued_at", "done", "result", "error")
+
+    def __init__(self, features: List[float]) -> None:
+        self.features = features
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class MicroBatcher:
+    """Collects concurrent predictions and runs them as one batched forward pass.
+
+    Callers block in `submit` while a background thread drains the queue. A batch
+    is dispatched as soon as `max_batch_size` requests are waiting or the oldest
+    request has waited `max_wait_us` microseconds, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[List[float]]], List[Any]],
+        max_batch_size: int = 32,
+        max_wait_us: int = 2000,
+    ) -> None:
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        if max_wait_us < 0:
+            raise ValueError("max_wait_us must be >= 0")
+
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_us / 1_000_000.0
+
+        self._queue: Deque[_PendingPrediction] = deque()
+        self._cond = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        self._closed = False
+
+        self._batches = 0
+        self._requests = 0
+        self._errors = 0
+        self._max_queue_depth = 0
+        self._batch_size_counts: Dict[int, int] = {}
+        self._total_queue_wait_s = 0.0
+        self._max_queue_wait_s = 0.0
+        self._total_batch_run_s = 0.0
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="predict-micro-batcher", daemon=True)
+            self._worker.start()
+
+    def submit(self, features: List[float], timeout: Optional[float] = None) -> Any:
+        pending = _PendingPrediction(features)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            self._ensure_worker()
+            self._queue.append(pending)
+            self._max_queue_depth = max(self._max_queue_depth, len(self._queue))
+            self._cond.notify()
+
+        if not pending.done.wait(timeout):
+            raise TimeoutError("Prediction was not completed in time")
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _next_batch(self) -> List[_PendingPrediction]:
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return []
+
+            deadline = self._queue[0].enqueued_at + self.max_wait_s
+            while len(self._queue) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            size = min(len(self._queue), self.max_batch_size)
+            return [self._queue.popleft() for _ in range(size)]
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+
+            started = time.perf_counter()
+            try:
+                results = self.run_batch([item.features for item in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"run_batch returned {len(results)} results for {len(batch)} inputs")
+                for item, result in zip(batch, results):
+                    item.result = result
+            except BaseException as exc:  # deliver the failure to every waiting caller
+                for item in batch:
+                    item.error = exc
+            finished = time.perf_counter()
+
+            with self._cond:
+                self._batches += 1
+                self._requests += len(batch)
+                if batch[0].error is not None:
+                    self._errors += len(batch)
+                self._batch_size_counts[len(batch)] = self._batch_size_counts.get(len(batch), 0) + 1
+                for item in batch:
+                    waited = started - item.enqueued_at
+                    self._total_queue_wait_s += waited
+                    self._max_queue_wait_s = max(self._max_queue_wait_s, waited)
+                self._total_batch_run_s += finished - started
+
+            for item in batch:
+                item.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            requests = self._requests
+            batches = self._batches
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_us": int(self.max_wait_s * 1_000_000),
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self._max_queue_depth,
+                "batches": batches,
+                "requests": requests,
+                "errors": self._errors,
+                "mean_batch_size": requests / batches if batches else 0.0,
+                "batch_size_counts": dict(sorted(self._batch_size_counts.items())),
+                "mean_queue_wait_us": (self._total_queue_wait_s / requests) * 1_000_000 if requests else 0.0,
+                "max_queue_wait_us": self._max_queue_wait_s * 1_000_000,
+                "mean_batch_run_us": (self._total_batch_run_s / batches) * 1_000_000 if batches else 0.0,
+            }
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._worker is not None:
+            self._worker.join()
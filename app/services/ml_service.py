@@ -1,84 +1,49 @@
 import os
-from datetime import date
-from typing import Any, Dict, List, Union
-
-import torch
-import torch.nn as nn
-
-
-class WorkoutRecommender(nn.Module):
-    """Inference architecture that matches workout_recommender.pt."""
-
-    def __init__(self) -> None:
-        super().__init__()
-        self.encoder = nn.Sequential(
-            nn.Linear(14, 128),
-            nn.BatchNorm1d(128),
-            nn.ReLU(),
-            nn.Dropout(0.3),
-            nn.Linear(128, 128),
-            nn.BatchNorm1d(128),
-            nn.ReLU(),
-            nn.Dropout(0.3),
-            nn.Linear(128, 64),
-        )
-
-        self.category_head = nn.Sequential(
-            nn.Linear(64, 32),
-            nn.ReLU(),
-            nn.Linear(32, 7),
-        )
-        self.intensity_head = nn.Sequential(
-            nn.Linear(64, 16),
-            nn.ReLU(),
-            nn.Linear(16, 1),
-        )
-        self.duration_head = nn.Sequential(
-            nn.Linear(64, 16),
-            nn.ReLU(),
-            nn.Linear(16, 1),
-        )
-
-    def forward(self, x: torch.Tensor):
-        shared = self.encoder(x)
-        category_logits = self.category_head(shared)
-        intensity = self.intensity_head(shared)
-        duration = self.duration_head(shared)
-        return category_logits, intensity, duration
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from app.services import model_registry
+# The encoding tables live in feature_pipeline and are re-exported here for existing callers.
+from app.services.feature_pipeline import (
+    CARDIAC_CONDITIONS,
+    FITNESS_LEVEL_MAP,
+    GOAL_ONE_HOT,
+    RECOVERY_PHASE_MAP,
+    encode_record,
+    encode_records,
+    estimate_sleep_hours,
+)
+from app.services.micro_batcher import MicroBatcher
+from app.services.numpy_inference import NumpyRecommender, ensure_npz
+from app.services.prediction_cache import PredictionCache
 
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 MODEL_PATH = os.path.join(BASE_DIR, "models", "workout_recommender.pt")
+NUMPY_WEIGHTS_PATH = os.getenv("ML_NUMPY_WEIGHTS_PATH", os.path.join(BASE_DIR, "models", "workout_recommender.npz"))
+SHARED_WEIGHTS_PATH = os.getenv(
+    "ML_SHARED_WEIGHTS_PATH", os.path.join(BASE_DIR, "models", "workout_recommender.weights")
+)
+
+# "torch" runs the checkpoint as-is; "numpy" serves folded weights without importing torch;
+# "int8" serves a dynamically quantized copy if it passes the accuracy gate;
+# "mmap" is "numpy" over a read-only weight file that all workers on a node share.
+ML_BACKEND = os.getenv("ML_BACKEND", "torch").strip().lower()
+# "local" runs forward passes in this process; "pool" sends them to dedicated worker
+# processes (see inference_pool.py), sized by ML_POOL_PROCESSES, ML_POOL_TORCH_THREADS
+# and ML_POOL_MAX_PENDING.
+ML_INFERENCE_MODE = os.getenv("ML_INFERENCE_MODE", "local").strip().lower()
+ML_POOL_PROCESSES = int(os.getenv("ML_POOL_PROCESSES", "2"))
+ML_POOL_TORCH_THREADS = int(os.getenv("ML_POOL_TORCH_THREADS", "1"))
+ML_POOL_MAX_PENDING = int(os.getenv("ML_POOL_MAX_PENDING", "256"))
+ML_POOL_TIMEOUT_SECONDS = float(os.getenv("ML_POOL_TIMEOUT_SECONDS", "30"))
+# Seconds between checks of the registry's ACTIVE file; 0 disables the watcher.
+ML_MODEL_WATCH_INTERVAL = float(os.getenv("ML_MODEL_WATCH_INTERVAL", "5"))
 
 
-FITNESS_LEVEL_MAP = {
-    "beginner": 0.0,
-    "intermediate": 0.5,
-    "advanced": 1.0,
-}
-
-RECOVERY_PHASE_MAP = {
-    "normal": 0.0,
-    "remodeling": 0.33,
-    "subacute": 0.66,
-    "acute": 1.0,
-}
-
-GOAL_ONE_HOT = {
-    "weight_loss": [1.0, 0.0, 0.0, 0.0],
-    "muscle_gain": [0.0, 1.0, 0.0, 0.0],
-    "endurance": [0.0, 0.0, 1.0, 0.0],
-    "rehabilitation": [0.0, 0.0, 0.0, 1.0],
-}
-
-CARDIAC_CONDITIONS = {
-    "heart_disease",
-    "hypertension",
-    "arrhythmia",
-    "coronary_artery_disease",
-    "cardiac",
-}
-
 CATEGORY_NAMES = {
     0: "bodyweight",
     1: "strength",
@@ -100,105 +65,127 @@ CATEGORY_EXERCISES = {
 }
 
 
-def _clamp(value: float, low: float, high: float) -> float:
-    return max(low, min(value, high))
+def encode_user_profile(user: Dict[str, Any]) -> List[float]:
+    return encode_record(user)
 
 
-def estimate_sleep_hours(age: int) -> float:
-    """Age-based fallback when sleep_hours is not provided by client."""
-    if age <= 5:
-        return 11.0
-    if age <= 13:
-        return 9.5
-    if age <= 17:
-        return 8.5
-    if age <= 64:
-        return 7.5
-    return 7.0
+def encode_user_profiles(users: Sequence[Dict[str, Any]]) -> np.ndarray:
+    """Vectorized `encode_user_profile`: returns an (n, 14) float64 feature matrix."""
+    return encode_records(users)
 
 
-def _days_since_surgery_score(is_post_surgery: bool, surgery_date_value: Union[date, None]) -> float:
-    if not is_post_surgery or surgery_date_value is None:
-        return 0.0
+def load_recommender(checkpoint_path: str = MODEL_PATH):
+    """Build the configured backend for `checkpoint_path` inside this process."""
+    if ML_BACKEND == "numpy":
+        # torch is only needed here when the .npz is missing or older than the checkpoint.
+        npz_path = NUMPY_WEIGHTS_PATH if checkpoint_path == MODEL_PATH else os.path.splitext(checkpoint_path)[0] + ".npz"
+        return NumpyRecommender.from_npz(ensure_npz(checkpoint_path, npz_path))
+    if ML_BACKEND == "mmap":
+        from app.services.shared_weights import ensure_weights, load_shared
 
-    days = (date.today() - surgery_date_value).days
-    if days < 0:
-        return 1.0
-    # Fresh surgery near 1.0, and linearly decays to 0 by ~6 months.
-    return _clamp(1.0 - (days / 180.0), 0.0, 1.0)
+        weights_path = (
+            SHARED_WEIGHTS_PATH if checkpoint_path == MODEL_PATH else os.path.splitext(checkpoint_path)[0] + ".weights"
+        )
+        return load_shared(ensure_weights(checkpoint_path, weights_path))
+    if ML_BACKEND == "torch":
+        from app.services.torch_inference import TorchRecommender
 
+        return TorchRecommender.from_checkpoint(checkpoint_path)
+    if ML_BACKEND == "int8":
+        from app.services.quantized_inference import QuantizationRejected, build_quantized_recommender
+        from app.services.torch_inference import TorchRecommender
 
-def encode_user_profile(user: Dict[str, Any]) -> List[float]:
-    age = float(user.get("age", 25))
-    weight_kg = float(user.get("weight_kg", 70.0))
-    height_cm = float(user.get("height_cm", 170.0))
+        try:
+            return build_quantized_recommender(checkpoint_path)[0]
+        except QuantizationRejected as exc:
+            # The int8 model is never served if it fails the gate; the float model is.
+            recommender = TorchRecommender.from_checkpoint(checkpoint_path)
+            recommender.quantization_report = exc.report
+            return recommender
+    raise ValueError(f"Unknown ML_BACKEND: {ML_BACKEND!r} (expected 'torch', 'numpy', 'int8' or 'mmap')")
 
-    height_m = max(height_cm / 100.0, 0.5)
-    bmi = weight_kg / (height_m * height_m)
 
-    fitness_level = str(user.get("fitness_level", "beginner")).lower()
-    is_post_surgery = bool(user.get("is_post_surgery", False))
-    recovery_phase = str(user.get("recovery_phase", "normal")).lower()
+_pool = None
+_pool_lock = threading.Lock()
 
-    pain_level = float(user.get("pain_level", 0.0))
-    sleep_hours_raw = user.get("sleep_hours", None)
-    sleep_hours = float(sleep_hours_raw) if sleep_hours_raw is not None else estimate_sleep_hours(int(age))
 
-    goal = str(user.get("goal", "maintenance")).lower()
-    medical_conditions = [str(item).lower() for item in user.get("medical_conditions", [])]
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from app.services.inference_pool import InferencePool
 
-    age_norm = _clamp(age / 100.0, 0.0, 1.0)
-    bmi_norm = _clamp(bmi / 40.0, 0.0, 1.0)
-    fitness_norm = FITNESS_LEVEL_MAP.get(fitness_level, 0.0)
-    recovery_norm = RECOVERY_PHASE_MAP.get(recovery_phase, 0.0)
-    days_since_surgery_norm = _days_since_surgery_score(is_post_surgery, user.get("surgery_date"))
-    pain_norm = _clamp(pain_level / 10.0, 0.0, 1.0)
-    sleep_norm = _clamp(sleep_hours / 9.0, 0.0, 1.0)
+                _pool = InferencePool(ML_POOL_PROCESSES, ML_POOL_TORCH_THREADS, ML_POOL_MAX_PENDING)
+    return _pool
 
-    goal_one_hot = GOAL_ONE_HOT.get(goal, [0.0, 0.0, 0.0, 0.0])
 
-    num_conditions_norm = _clamp(min(len(medical_conditions), 5) / 5.0, 0.0, 1.0)
-    has_cardiac = 1.0 if any(cond in CARDIAC_CONDITIONS for cond in medical_conditions) else 0.0
+def _load_model(checkpoint_path: str = MODEL_PATH):
+    if ML_INFERENCE_MODE == "pool":
+        from app.services.inference_pool import PooledRecommender
 
-    return [
-        age_norm,
-        bmi_norm,
-        fitness_norm,
-        1.0 if is_post_surgery else 0.0,
-        recovery_norm,
-        days_since_surgery_norm,
-        pain_norm,
-        sleep_norm,
-        *goal_one_hot,
-        num_conditions_norm,
-        has_cardiac,
-    ]
+        return PooledRecommender(get_pool(), checkpoint_path, ML_BACKEND, ML_POOL_TIMEOUT_SECONDS)
+    if ML_INFERENCE_MODE == "local":
+        return load_recommender(checkpoint_path)
+    raise ValueError(f"Unknown ML_INFERENCE_MODE: {ML_INFERENCE_MODE!r} (expected 'local' or 'pool')")
 
 
-def _load_model() -> WorkoutRecommender:
-    if not os.path.exists(MODEL_PATH):
-        raise FileNotFoundError(f"Model file not found: {MODEL_PATH}")
+def pool_stats() -> Optional[Dict[str, Any]]:
+    return _pool.stats() if _pool is not None else None
 
-    checkpoint = torch.load(MODEL_PATH, map_location="cpu")
-    state_dict = (
-        checkpoint["model_state_dict"]
-        if isinstance(checkpoint, dict) and "model_state_dict" in checkpoint
-        else checkpoint
-    )
 
-    model = WorkoutRecommender()
-    missing_keys, unexpected_keys = model.load_state_dict(state_dict, strict=False)
-    if missing_keys or unexpected_keys:
-        raise RuntimeError(
-            "Checkpoint architecture mismatch. "
-            f"Missing keys: {missing_keys}; Unexpected keys: {unexpected_keys}"
-        )
+def shutdown() -> None:
+    if _pool is not None:
+        _pool.close()
+
+
+class ModelNotReady(RuntimeError):
+    """Raised when the model has not finished loading and warming up."""
+
+
+class LoadedModel:
+    """A recommender together with the registry version it was loaded from."""
+
+    def __init__(self, version: str, recommender, checkpoint_path: str, metadata: Dict[str, Any]) -> None:
+        self.version = version
+        self.recommender = recommender
+        self.checkpoint_path = checkpoint_path
+        self.metadata = metadata
+
+
+def _load_version(version: Optional[str]) -> LoadedModel:
+    """Load a registered version, or the bundled MODEL_PATH when the registry has none active."""
+    if version is None:
+        return LoadedModel(model_registry.version_of(MODEL_PATH), _load_model(MODEL_PATH), MODEL_PATH, {})
+    path = model_registry.checkpoint_path(version)
+    return LoadedModel(version, _load_model(path), path, model_registry.read_metadata(version))
+
+
+# The model is loaded on first use or by `start_warm_up`, never at import time,
+# so importing this module stays cheap for every worker. `_active` is only ever
+# replaced as a whole, so a batch that already holds a reference keeps running on
+# the weights it started with while new batches pick up a freshly activated model.
+_active: Optional[LoadedModel] = None
+_model_lock = threading.Lock()
+_swap_lock = threading.Lock()
+_warm = threading.Event()
+_warm_up_thread: Optional[threading.Thread] = None
+_warm_up_error: Optional[str] = None
+_warm_up_seconds: Optional[float] = None
+_watcher_thread: Optional[threading.Thread] = None
 
-    model.eval()
-    return model
 
+def get_model() -> LoadedModel:
+    global _active
+    if _active is None:
+        with _model_lock:
+            if _active is None:
+                _active = _load_version(model_registry.get_active_version())
+    return _active
 
-model = _load_model()
+
+def model_version() -> str:
+    return get_model().version
 
 
 def _safe_category_from_features(predicted_category: int, features: List[float]) -> int:
@@ -236,22 +223,207 @@ def _safe_category_from_features(predicted_category: int, features: List[float])
     return predicted_category
 
 
-def predict(features: List[float]) -> Dict[str, Union[int, float, str, List[str]]]:
-    if len(features) != 14:
-        raise ValueError(f"Expected 14 input features, got {len(features)}")
+RECOVERY_PHASE_CANDIDATES = np.array([0.0, 0.33, 0.66, 1.0])
+
 
-    x = torch.tensor(features, dtype=torch.float32).unsqueeze(0)
+def _safe_categories_from_features(predicted: np.ndarray, features: np.ndarray) -> np.ndarray:
+    """Array-mask version of `_safe_category_from_features` for a whole batch.
 
-    with torch.no_grad():
-        category_logits, intensity_pred, duration_pred = model(x)
+    `features` should be float64 so thresholds compare exactly as the scalar path does.
+    """
+    is_post_surgery = features[:, 3] >= 0.5
+    pain_level = features[:, 6] * 10.0
+    sleep_hours = features[:, 7] * 9.0
+    has_cardiac = features[:, 13] >= 0.5
 
-    category_id = int(torch.argmax(category_logits, dim=1).item())
-    category_id = _safe_category_from_features(category_id, features)
+    phase_distance = np.abs(features[:, 4:5] - RECOVERY_PHASE_CANDIDATES)
+    closest_phase = RECOVERY_PHASE_CANDIDATES[np.argmin(phase_distance, axis=1)]
 
+    acute = is_post_surgery & (closest_phase >= 0.95)
+    restricted = (pain_level >= 7.0) | (is_post_surgery & (np.abs(closest_phase - 0.66) < 0.05))
+    strength_disallowed = pain_level >= 4.0
+    hiit_disallowed = strength_disallowed | has_cardiac | (sleep_hours < 5.0)
+    disallowed = ((predicted == 1) & strength_disallowed) | ((predicted == 2) & hiit_disallowed)
+
+    # Only strength and hiit are ever disallowed, so cardio (4) is always the fallback.
+    safe = np.where(disallowed, 4, predicted)
+    safe = np.where(restricted, np.where(predicted == 5, 5, 6), safe)
+    return np.where(acute, 6, safe)
+
+
+def _build_result(
+    category_id: int, intensity: float, duration: float, version: str
+) -> Dict[str, Union[int, float, str, List[str]]]:
     return {
         "category_id": category_id,
         "category_name": CATEGORY_NAMES.get(category_id, "unknown"),
         "exercises": CATEGORY_EXERCISES.get(category_id, []),
-        "intensity": float(intensity_pred.squeeze(1).item()),
-        "duration": float(duration_pred.squeeze(1).item()),
+        "intensity": intensity,
+        "duration": duration,
+        "model_version": version,
     }
+
+
+def _forward(
+    features: np.ndarray, loaded: Optional[LoadedModel] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, str]:
+    """Raw argmax categories (before safety rules), intensities, durations and model version."""
+    if features.ndim != 2 or features.shape[1] != 14:
+        raise ValueError(f"Expected 14 input features, got {features.shape[-1]}")
+    loaded = loaded or get_model()
+    category_logits, intensity_pred, duration_pred = loaded.recommender(features.astype(np.float32))
+    return np.argmax(category_logits, axis=1), intensity_pred[:, 0], duration_pred[:, 0], loaded.version
+
+
+def _predict_raw_batch(features_batch: List[List[float]]) -> List[Tuple[int, float, float, str]]:
+    categories, intensities, durations, version = _forward(np.asarray(features_batch, dtype=np.float64))
+    return [
+        (category, intensity, duration, version)
+        for category, intensity, duration in zip(categories.tolist(), intensities.tolist(), durations.tolist())
+    ]
+
+
+def predict_batch(
+    features_batch: Union[Sequence[Sequence[float]], np.ndarray]
+) -> List[Dict[str, Union[int, float, str, List[str]]]]:
+    """Run one forward pass over several feature rows and apply safety rules as array masks."""
+    features = np.asarray(features_batch, dtype=np.float64)
+    if len(features) == 0:
+        return []
+
+    raw_categories, intensities, durations, version = _forward(features)
+    category_ids = _safe_categories_from_features(raw_categories, features).tolist()
+
+    return [
+        _build_result(int(category_id), float(intensity), float(duration), version)
+        for category_id, intensity, duration in zip(category_ids, intensities.tolist(), durations.tolist())
+    ]
+
+
+def predict(features: List[float]) -> Dict[str, Union[int, float, str, List[str]]]:
+    return predict_batch([features])[0]
+
+
+# Concurrent /predict calls are coalesced into one forward pass. Tune with
+# PREDICT_MAX_BATCH_SIZE (rows per pass) and PREDICT_MAX_WAIT_US (how long the
+# first request in a batch may wait for company).
+batcher = MicroBatcher(
+    _predict_raw_batch,
+    max_batch_size=int(os.getenv("PREDICT_MAX_BATCH_SIZE", "32")),
+    max_wait_us=int(os.getenv("PREDICT_MAX_WAIT_US", "2000")),
+)
+
+# Raw model outputs are cached; safety rules are re-applied to the exact features
+# on every hit, so quantizing the key can never loosen them.
+# PREDICT_CACHE_MAX_ENTRIES=0 disables the cache.
+prediction_cache = PredictionCache(
+    max_entries=int(os.getenv("PREDICT_CACHE_MAX_ENTRIES", "10000")),
+    ttl_seconds=float(os.getenv("PREDICT_CACHE_TTL_SECONDS", "300")),
+    precision=int(os.getenv("PREDICT_CACHE_PRECISION", "4")),
+)
+
+
+def predict_batched(features: List[float]) -> Dict[str, Union[int, float, str, List[str]]]:
+    if len(features) != 14:
+        raise ValueError(f"Expected 14 input features, got {len(features)}")
+    category_id, intensity, duration, version = prediction_cache.get_or_compute(
+        features, model_version(), lambda: batcher.submit(features)
+    )
+    return _build_result(_safe_category_from_features(category_id, features), intensity, duration, version)
+
+
+def warm_up() -> None:
+    """Load the model and push dummy batches through it so real requests skip first-call allocations."""
+    global _warm_up_error, _warm_up_seconds
+    started = time.perf_counter()
+    try:
+        get_model()
+        dummy = encode_user_profiles([{}])
+        for batch_size in sorted({1, batcher.max_batch_size}):
+            predict_batch(np.repeat(dummy, batch_size, axis=0))
+        batcher.submit(dummy[0].tolist())
+    except Exception as exc:
+        _warm_up_error = f"{type(exc).__name__}: {exc}"
+        raise
+    _warm_up_error = None
+    _warm_up_seconds = time.perf_counter() - started
+    _warm.set()
+
+
+def _warm_up_in_background() -> None:
+    try:
+        warm_up()
+    except Exception:
+        pass  # recorded in _warm_up_error and reported by readiness()
+
+
+def start_warm_up() -> None:
+    """Start warming up in a background thread unless it is already running or done."""
+    global _warm_up_thread
+    with _model_lock:
+        if _warm.is_set() or (_warm_up_thread is not None and _warm_up_thread.is_alive()):
+            return
+        _warm_up_thread = threading.Thread(target=_warm_up_in_background, name="ml-warm-up", daemon=True)
+        _warm_up_thread.start()
+
+
+def is_ready() -> bool:
+    return _warm.is_set()
+
+
+def ensure_ready() -> None:
+    """Raise ModelNotReady (and kick off warm-up) unless the model is warm."""
+    if not _warm.is_set():
+        start_warm_up()
+        raise ModelNotReady(_warm_up_error or "Model is warming up")
+
+
+def readiness() -> Dict[str, Any]:
+    return {
+        "backend": ML_BACKEND,
+        "model_loaded": _active is not None,
+        "model_version": _active.version if _active is not None else None,
+        "serving_backend": _active.recommender.backend if _active is not None else None,
+        "quantization": getattr(_active.recommender, "quantization_report", None) if _active is not None else None,
+        "model_warm": _warm.is_set(),
+        "warming_up": _warm_up_thread is not None and _warm_up_thread.is_alive(),
+        "warm_up_seconds": _warm_up_seconds,
+        "error": _warm_up_error,
+    }
+
+
+def activate_model(version: str) -> Dict[str, Any]:
+    """Load and warm `version`, then swap it in atomically and record it as ACTIVE.
+
+    In-flight batches finish on the model they started with; requests that arrive
+    after the swap use the new one. Nothing is dropped.
+    """
+    global _active
+    with _swap_lock:
+        loaded = _load_version(version)
+        _forward(encode_user_profiles([{}]), loaded)
+        previous = _active
+        _active = loaded
+        if model_registry.get_active_version() != version:
+            model_registry.set_active_version(version)
+    return {"previous_version": previous.version if previous else None, "active_version": version}
+
+
+def _watch_active_version(interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        try:
+            version = model_registry.get_active_version()
+            if version is not None and _active is not None and version != _active.version:
+                activate_model(version)
+        except Exception:
+            pass  # a half-registered or bad version leaves the current model serving
+
+
+def start_model_watcher(interval: float = ML_MODEL_WATCH_INTERVAL) -> None:
+    """Poll the registry's ACTIVE file so every worker follows an activation made by any of them."""
+    global _watcher_thread
+    if interval <= 0 or (_watcher_thread is not None and _watcher_thread.is_alive()):
+        return
+    _watcher_thread = threading.Thread(target=_watch_active_version, args=(interval,), name="ml-model-watcher", daemon=True)
+    _watcher_thread.start()
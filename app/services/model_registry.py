@@ -0,0 +1,152 @@
+"""Content-addressed registry of WorkoutRecommender checkpoints.
+
+Layout:
+
+    <registry>/<version>/model.pt        the checkpoint, byte-for-byte
+    <registry>/<version>/metadata.json   epoch, val_loss and the training `metadata`
+    <registry>/ACTIVE                    version that workers should serve
+
+`version` is the first 12 hex digits of the checkpoint's sha256, so registering
+the same file twice is a no-op. ACTIVE is replaced atomically; every worker
+watching it switches to the new version on its next poll.
+"""
+import argparse
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.services.numpy_inference import file_sha256
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REGISTRY_DIR = os.getenv("ML_MODEL_REGISTRY_DIR", os.path.join(BASE_DIR, "models", "registry"))
+ACTIVE_FILE = "ACTIVE"
+CHECKPOINT_FILE = "model.pt"
+METADATA_FILE = "metadata.json"
+
+
+class UnknownModelVersion(LookupError):
+    """Raised when a version is not present in the registry."""
+
+
+def version_of(checkpoint_path: str) -> str:
+    return file_sha256(checkpoint_path)[:12]
+
+
+def _version_dir(version: str, registry_dir: str = REGISTRY_DIR) -> str:
+    if not version or os.sep in version or version.startswith("."):
+        raise UnknownModelVersion(f"Invalid model version: {version!r}")
+    return os.path.join(registry_dir, version)
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as fh:
+        fh.write(data)
+    os.replace(tmp_path, path)
+
+
+def checkpoint_path(version: str, registry_dir: str = REGISTRY_DIR) -> str:
+    path = os.path.join(_version_dir(version, registry_dir), CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        raise UnknownModelVersion(f"Model version not registered: {version}")
+    return path
+
+
+def read_metadata(version: str, registry_dir: str = REGISTRY_DIR) -> Dict[str, Any]:
+    path = os.path.join(_version_dir(version, registry_dir), METADATA_FILE)
+    if not os.path.exists(path):
+        raise UnknownModelVersion(f"Model version not registered: {version}")
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def register(source_path: str, registry_dir: str = REGISTRY_DIR) -> str:
+    """Copy a checkpoint into the registry and return its version. Needs torch to read metadata."""
+    from app.services.torch_inference import load_checkpoint
+
+    version = version_of(source_path)
+    target_dir = _version_dir(version, registry_dir)
+    if os.path.exists(os.path.join(target_dir, METADATA_FILE)):
+        return version
+
+    checkpoint = load_checkpoint(source_path)
+    metadata = {
+        "version": version,
+        "sha256": file_sha256(source_path),
+        "source": os.path.abspath(source_path),
+        "registered_at": datetime.utcnow().isoformat(),
+        "epoch": checkpoint.get("epoch"),
+        "val_loss": checkpoint.get("val_loss"),
+        "metadata": checkpoint.get("metadata", {}),
+    }
+
+    os.makedirs(target_dir, exist_ok=True)
+    tmp_path = os.path.join(target_dir, f"{CHECKPOINT_FILE}.{os.getpid()}.tmp")
+    shutil.copyfile(source_path, tmp_path)
+    os.replace(tmp_path, os.path.join(target_dir, CHECKPOINT_FILE))
+    # metadata.json is written last: its presence marks the version as complete.
+    _write_atomic(os.path.join(target_dir, METADATA_FILE), json.dumps(metadata, indent=2, default=str).encode())
+    return version
+
+
+def list_versions(registry_dir: str = REGISTRY_DIR) -> List[Dict[str, Any]]:
+    if not os.path.isdir(registry_dir):
+        return []
+    versions = []
+    for name in os.listdir(registry_dir):
+        if os.path.exists(os.path.join(registry_dir, name, METADATA_FILE)):
+            metadata = read_metadata(name, registry_dir)
+            versions.append(
+                {
+                    "version": name,
+                    "registered_at": metadata.get("registered_at"),
+                    "epoch": metadata.get("epoch"),
+                    "val_loss": metadata.get("val_loss"),
+                }
+            )
+    return sorted(versions, key=lambda item: item["registered_at"] or "")
+
+
+def get_active_version(registry_dir: str = REGISTRY_DIR) -> Optional[str]:
+    try:
+        with open(os.path.join(registry_dir, ACTIVE_FILE)) as fh:
+            return fh.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def set_active_version(version: str, registry_dir: str = REGISTRY_DIR) -> None:
+    checkpoint_path(version, registry_dir)
+    _write_atomic(os.path.join(registry_dir, ACTIVE_FILE), f"{version}\n".encode())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage the WorkoutRecommender model registry.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    register_cmd = sub.add_parser("register", help="add a checkpoint to the registry")
+    register_cmd.add_argument("checkpoint")
+    register_cmd.add_argument("--activate", action="store_true")
+    activate_cmd = sub.add_parser("activate", help="mark a registered version as active")
+    activate_cmd.add_argument("version")
+    sub.add_parser("list", help="list registered versions")
+    args = parser.parse_args()
+
+    if args.command == "register":
+        version = register(args.checkpoint)
+        if args.activate:
+            set_active_version(version)
+        print(version)
+    elif args.command == "activate":
+        set_active_version(args.version)
+        print(args.version)
+    else:
+        active = get_active_version()
+        for item in list_versions():
+            marker = "*" if item["version"] == active else " "
+            print(f"{marker} {item['version']}  epoch={item['epoch']}  val_loss={item['val_loss']}  {item['registered_at']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Torch-free inference for WorkoutRecommender.
+
+The float checkpoint is converted once into a plain `.npz` file. Each BatchNorm1d
+is folded into the Linear layer before it and Dropout is dropped, so serving is
+just a stack of `x @ W + b` with ReLU between layers.
+"""
+import argparse
+import hashlib
+import os
+from typing import Dict, List, Mapping, Tuple
+
+import numpy as np
+
+from app.services.feature_pipeline import check_feature_schema
+
+NPZ_FORMAT_VERSION = 1
+STACKS = ("encoder", "category_head", "intensity_head", "duration_head")
+BATCH_NORM_EPS = 1e-5
+
+Layer = Tuple[np.ndarray, np.ndarray]
+
+
+def _to_numpy(value) -> np.ndarray:
+    if hasattr(value, "detach"):
+        value = value.detach().cpu().numpy()
+    return np.asarray(value, dtype=np.float64)
+
+
+def fold_stack(state_dict: Mapping[str, object], prefix: str, bn_eps: float = BATCH_NORM_EPS) -> List[Layer]:
+    """Return the Linear layers of one nn.Sequential with any following BatchNorm folded in."""
+    indices = sorted({int(key.split(".")[1]) for key in state_dict if key.startswith(prefix + ".")})
+    layers: List[Layer] = []
+    for idx in indices:
+        key = f"{prefix}.{idx}"
+        weight = _to_numpy(state_dict[f"{key}.weight"])
+        bias = _to_numpy(state_dict[f"{key}.bias"])
+        if f"{key}.running_mean" in state_dict:
+            if not layers:
+                raise ValueError(f"{key} is a BatchNorm layer without a preceding Linear layer")
+            mean = _to_numpy(state_dict[f"{key}.running_mean"])
+            var = _to_numpy(state_dict[f"{key}.running_var"])
+            scale = weight / np.sqrt(var + bn_eps)
+            prev_weight, prev_bias = layers[-1]
+            layers[-1] = (prev_weight * scale[:, None], (prev_bias - mean) * scale + bias)
+        else:
+            layers.append((weight, bias))
+    if not layers:
+        raise ValueError(f"No layers found for {prefix}")
+    return layers
+
+
+def fold_state_dict(state_dict: Mapping[str, object]) -> Dict[str, np.ndarray]:
+    """Flatten a WorkoutRecommender state_dict into folded float32 arrays keyed for `.npz`."""
+    arrays: Dict[str, np.ndarray] = {"format_version": np.asarray(NPZ_FORMAT_VERSION)}
+    for prefix in STACKS:
+        for i, (weight, bias) in enumerate(fold_stack(state_dict, prefix)):
+            # Stored as (in, out) so the forward pass is a plain `x @ W`.
+            arrays[f"{prefix}.{i}.weight"] = np.ascontiguousarray(weight.T, dtype=np.float32)
+            arrays[f"{prefix}.{i}.bias"] = bias.astype(np.float32)
+    return arrays
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def export_npz(model_path: str, npz_path: str) -> str:
+    """Fold `model_path` and write it to `npz_path`. This is the only step that needs torch."""
+    from app.services.torch_inference import load_checkpoint
+
+    checkpoint = load_checkpoint(model_path)
+    arrays = fold_state_dict(checkpoint["model_state_dict"])
+    arrays["source_sha256"] = np.asarray(file_sha256(model_path))
+    schema_hash = (checkpoint.get("metadata") or {}).get("feature_schema_hash")
+    if schema_hash is not None:
+        arrays["feature_schema_hash"] = np.asarray(schema_hash)
+    tmp_path = f"{npz_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as fh:
+        np.savez(fh, **arrays)
+    os.replace(tmp_path, npz_path)
+    return npz_path
+
+
+def ensure_npz(model_path: str, npz_path: str) -> str:
+    """Export the checkpoint unless `npz_path` was already built from this exact checkpoint."""
+    if os.path.exists(npz_path):
+        if not os.path.exists(model_path):
+            return npz_path
+        with np.load(npz_path) as data:
+            source = str(data["source_sha256"]) if "source_sha256" in data.files else ""
+        if source == file_sha256(model_path):
+            return npz_path
+    return export_npz(model_path, npz_path)
+
+
+class NumpyRecommender:
+    """Pure NumPy forward pass over folded weights."""
+
+    backend = "numpy"
+
+    def __init__(self, arrays: Mapping[str, np.ndarray]) -> None:
+        version = int(arrays.get("format_version", -1))
+        if version != NPZ_FORMAT_VERSION:
+            raise RuntimeError(f"Unsupported weight file format version: {version}")
+
+        self.stacks: Dict[str, List[Layer]] = {}
+        for prefix in STACKS:
+            layers: List[Layer] = []
+            while f"{prefix}.{len(layers)}.weight" in arrays:
+                i = len(layers)
+                layers.append((arrays[f"{prefix}.{i}.weight"], arrays[f"{prefix}.{i}.bias"]))
+            if not layers:
+                raise RuntimeError(f"Weight file has no layers for {prefix}")
+            self.stacks[prefix] = layers
+
+    @classmethod
+    def from_npz(cls, npz_path: str) -> "NumpyRecommender":
+        with np.load(npz_path) as data:
+            arrays = {key: data[key] for key in data.files}
+        schema_hash = arrays.get("feature_schema_hash")
+        check_feature_schema(None if schema_hash is None else {"feature_schema_hash": str(schema_hash)}, npz_path)
+        return cls(arrays)
+
+    @staticmethod
+    def _run_stack(x: np.ndarray, layers: List[Layer]) -> np.ndarray:
+        last = len(layers) - 1
+        for i, (weight, bias) in enumerate(layers):
+            x = x @ weight
+            x += bias
+            if i < last:
+                np.maximum(x, 0.0, out=x)
+        return x
+
+    def __call__(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        x = np.asarray(x, dtype=np.float32)
+        if x.ndim == 1:
+            x = x[None, :]
+        shared = self._run_stack(x, self.stacks["encoder"])
+        return (
+            self._run_stack(shared, self.stacks["category_head"]),
+            self._run_stack(shared, self.stacks["intensity_head"]),
+            self._run_stack(shared, self.stacks["duration_head"]),
+        )
+
+
+def max_abs_difference(model_path: str, npz_path: str, n_samples: int = 4096, seed: int = 0) -> float:
+    """Largest absolute output difference between the torch and NumPy paths on random inputs."""
+    from app.services.torch_inference import TorchRecommender
+
+    x = np.random.default_rng(seed).random((n_samples, 14), dtype=np.float32)
+    reference = TorchRecommender.from_checkpoint(model_path)(x)
+    candidate = NumpyRecommender.from_npz(npz_path)(x)
+    return max(float(np.max(np.abs(a - b))) for a, b in zip(reference, candidate))
+
+
+def main() -> None:
+    from app.services.ml_service import MODEL_PATH, NUMPY_WEIGHTS_PATH
+
+    parser = argparse.ArgumentParser(description="Export workout_recommender.pt to folded NumPy weights.")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--out", default=NUMPY_WEIGHTS_PATH)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    export_npz(args.model, args.out)
+    diff = max_abs_difference(args.model, args.out)
+    print(f"saved: {args.out} (max |torch - numpy| = {diff:.3e})")
+    if diff > args.atol:
+        raise SystemExit(f"NumPy outputs differ from torch by more than {args.atol}")
+
+
+if __name__ == "__main__":
+    main()
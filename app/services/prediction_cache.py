@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Callable, Dict, Hashable, Optional, Sequence, Tuple
+
+
+class _CacheEntry:
+    __slots__ = ("value", "expires_at", "valid_on")
+
+    def __init__(self, value: Any, expires_at: float, valid_on: Optional[int]) -> None:
+        self.value = value
+        self.expires_at = expires_at
+        # Ordinal of the day the entry was computed on, for date-dependent features.
+        self.valid_on = valid_on
+
+
+class _InFlight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class PredictionCache:
+    """Bounded LRU + TTL cache for model outputs keyed on quantized feature vectors.
+
+    Entries for post-surgery profiles also expire at the next day boundary, because
+    `days_since_surgery_norm` is derived from `date.today()`. Concurrent misses for
+    the same key are coalesced so only one caller computes the value.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 300.0, precision: int = 4) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.precision = precision
+        self._scale = 10 ** precision
+
+        self._entries: "OrderedDict[Hashable, _CacheEntry]" = OrderedDict()
+        self._in_flight: Dict[Hashable, _InFlight] = {}
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def key(self, features: Sequence[float], model_version: str) -> Tuple[str, Tuple[int, ...]]:
+        return model_version, tuple(int(round(value * self._scale)) for value in features)
+
+    @staticmethod
+    def _is_date_dependent(features: Sequence[float]) -> bool:
+        return features[3] >= 0.5  # is_post_surgery
+
+    def _lookup(self, key: Hashable, now: float, today: int) -> Tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        if entry.expires_at <= now or (entry.valid_on is not None and entry.valid_on != today):
+            del self._entries[key]
+            self._expirations += 1
+            return False, None
+        self._entries.move_to_end(key)
+        return True, entry.value
+
+    def _store(self, key: Hashable, value: Any, features: Sequence[float], today: int) -> None:
+        valid_on = today if self._is_date_dependent(features) else None
+        self._entries[key] = _CacheEntry(value, time.monotonic() + self.ttl_seconds, valid_on)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def get_or_compute(self, features: Sequence[float], model_version: str, compute: Callable[[], Any]) -> Any:
+        if not self.enabled:
+            return compute()
+
+        key = self.key(features, model_version)
+        today = date.today().toordinal()
+        with self._lock:
+            found, value = self._lookup(key, time.monotonic(), today)
+            if found:
+                self._hits += 1
+                return value
+            flight = self._in_flight.get(key)
+            if flight is not None:
+                self._coalesced += 1
+                leader = False
+            else:
+                self._misses += 1
+                flight = self._in_flight[key] = _InFlight()
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                if flight.error is None:
+                    self._store(key, flight.value, features, today)
+                del self._in_flight[key]
+            flight.done.set()
+        return flight.value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses + self._coalesced
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "precision": self.precision,
+                "hits": self._hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+            }
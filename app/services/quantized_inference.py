@@ -0,0 +1,181 @@
+"""Dynamic int8 quantization for WorkoutRecommender.
+
+The quantized model is built at load time from the float checkpoint. Each
+BatchNorm1d is fused into the Linear before it, then every Linear becomes a
+dynamically quantized int8 Linear. Before it is served, the quantized model must
+pass an accuracy gate against the float model on the validation split that
+`train_and_save` uses.
+"""
+import argparse
+import io
+import json
+import os
+import time
+from typing import Any, Dict, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from app.services.torch_inference import TorchRecommender, WorkoutRecommender, load_model
+
+# Minimum fraction of validation rows whose category matches the float model.
+ML_QUANT_MIN_AGREEMENT = float(os.getenv("ML_QUANT_MIN_AGREEMENT", "0.99"))
+# Maximum mean absolute intensity/duration difference from the float model.
+ML_QUANT_MAX_DRIFT = float(os.getenv("ML_QUANT_MAX_DRIFT", "0.01"))
+
+BENCHMARK_BATCH_SIZES = (1, 32, 512)
+
+
+class QuantizationRejected(RuntimeError):
+    """Raised when the int8 model does not pass the accuracy gate."""
+
+    def __init__(self, report: Dict[str, Any]) -> None:
+        super().__init__(
+            f"int8 model rejected: category agreement {report['category_agreement']:.4f}, "
+            f"intensity drift {report['intensity_mean_abs_drift']:.4f}, "
+            f"duration drift {report['duration_mean_abs_drift']:.4f}"
+        )
+        self.report = report
+
+
+def quantize_model(model: WorkoutRecommender) -> nn.Module:
+    """Return an int8 copy of `model`; the float model is left untouched."""
+    # Each hidden block of the encoder is Linear, BatchNorm1d, ReLU, Dropout.
+    pairs = [[f"encoder.{4 * i}", f"encoder.{4 * i + 1}"] for i in range(len(model.architecture["hidden"]))]
+    fused = torch.ao.quantization.fuse_modules(model.eval(), pairs)
+    return torch.ao.quantization.quantize_dynamic(fused, {nn.Linear}, dtype=torch.qint8)
+
+
+def validation_features() -> np.ndarray:
+    """The validation split of `train_and_save` over the vectorized generator's dataset.
+
+    The vectorized generator draws from its own seeded Generator, so the gate sees the
+    same rows in every process and the global RNGs of the serving process are left alone.
+    """
+    from app.services import train_workout_recommender as training
+
+    x, y_cat, _, _, _ = training.generate_dataset_vectorized(samples_per_cell=22, seed=training.SEED)
+    _, val_idx = training.split_indices(y_cat)
+    return x[val_idx]
+
+
+def compare_models(float_model: nn.Module, quant_model: nn.Module, x: np.ndarray) -> Dict[str, Any]:
+    with torch.no_grad():
+        xt = torch.from_numpy(np.ascontiguousarray(x, dtype=np.float32))
+        f_cat, f_int, f_dur = float_model(xt)
+        q_cat, q_int, q_dur = quant_model(xt)
+    intensity_drift = torch.abs(f_int - q_int)
+    duration_drift = torch.abs(f_dur - q_dur)
+    return {
+        "rows": int(x.shape[0]),
+        "category_agreement": float((f_cat.argmax(dim=1) == q_cat.argmax(dim=1)).float().mean().item()),
+        "intensity_mean_abs_drift": float(intensity_drift.mean().item()),
+        "intensity_max_abs_drift": float(intensity_drift.max().item()),
+        "duration_mean_abs_drift": float(duration_drift.mean().item()),
+        "duration_max_abs_drift": float(duration_drift.max().item()),
+    }
+
+
+def passes_gate(report: Dict[str, Any], min_agreement: float, max_drift: float) -> bool:
+    return (
+        report["category_agreement"] >= min_agreement
+        and report["intensity_mean_abs_drift"] <= max_drift
+        and report["duration_mean_abs_drift"] <= max_drift
+    )
+
+
+def build_quantized_recommender(
+    checkpoint_path: str,
+    min_agreement: float = ML_QUANT_MIN_AGREEMENT,
+    max_drift: float = ML_QUANT_MAX_DRIFT,
+) -> Tuple[TorchRecommender, Dict[str, Any]]:
+    """Quantize the checkpoint and gate it; raises QuantizationRejected if it drifts too far."""
+    float_model = load_model(checkpoint_path)
+    quant_model = quantize_model(float_model)
+    report = compare_models(float_model, quant_model, validation_features())
+    report.update({"min_agreement": min_agreement, "max_drift": max_drift})
+    report["passed"] = passes_gate(report, min_agreement, max_drift)
+    if not report["passed"]:
+        raise QuantizationRejected(report)
+
+    recommender = TorchRecommender(quant_model)
+    recommender.backend = "int8"
+    recommender.quantization_report = report
+    return recommender, report
+
+
+def _serialized_bytes(model: nn.Module) -> int:
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def _storage_bytes(model: nn.Module) -> int:
+    """Bytes held by the model's weights in memory, including int8 packed weights and their scales."""
+    total = 0
+    for module in model.modules():
+        tensors = list(module.parameters(recurse=False)) + list(module.buffers(recurse=False))
+        if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+            weight, bias = module._weight_bias()
+            tensors += [weight] + ([bias] if bias is not None else [])
+            if weight.qscheme() in (torch.per_channel_affine, torch.per_channel_symmetric):
+                tensors += [weight.q_per_channel_scales(), weight.q_per_channel_zero_points()]
+        total += sum(t.numel() * t.element_size() for t in tensors)
+    return total
+
+
+def _median_latency_us(model: nn.Module, x: torch.Tensor, repeats: int) -> float:
+    timings = []
+    with torch.no_grad():
+        for _ in range(10):
+            model(x)
+        for _ in range(repeats):
+            started = time.perf_counter()
+            model(x)
+            timings.append(time.perf_counter() - started)
+    return float(np.median(timings) * 1_000_000)
+
+
+def benchmark(
+    checkpoint_path: str, batch_sizes: Sequence[int] = BENCHMARK_BATCH_SIZES, repeats: int = 200
+) -> Dict[str, Any]:
+    float_model = load_model(checkpoint_path)
+    quant_model = quantize_model(float_model)
+    rng = np.random.default_rng(0)
+
+    latency = {}
+    for batch_size in batch_sizes:
+        x = torch.from_numpy(rng.random((batch_size, 14), dtype=np.float32))
+        float_us = _median_latency_us(float_model, x, repeats)
+        int8_us = _median_latency_us(quant_model, x, repeats)
+        latency[str(batch_size)] = {"float_us": float_us, "int8_us": int8_us, "speedup": float_us / int8_us}
+
+    return {
+        "torch_version": torch.__version__,
+        "threads": torch.get_num_threads(),
+        "quantized_engine": torch.backends.quantized.engine,
+        # In-memory weight storage, and the size of the saved state_dict.
+        "memory_bytes": {"float": _storage_bytes(float_model), "int8": _storage_bytes(quant_model)},
+        "serialized_bytes": {"float": _serialized_bytes(float_model), "int8": _serialized_bytes(quant_model)},
+        "median_latency": latency,
+        "gate": compare_models(float_model, quant_model, validation_features()),
+    }
+
+
+def main() -> None:
+    from app.services.ml_service import MODEL_PATH
+
+    parser = argparse.ArgumentParser(description="Benchmark float vs dynamic int8 WorkoutRecommender.")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=list(BENCHMARK_BATCH_SIZES))
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    report = benchmark(args.model, args.batch_sizes, args.repeats)
+    report["gate"]["passed"] = passes_gate(report["gate"], ML_QUANT_MIN_AGREEMENT, ML_QUANT_MAX_DRIFT)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Read-only, memory-mapped recommender weights shared by every worker on a node.
+
+The checkpoint is folded once (see numpy_inference.py) into a single flat file of
+64-byte aligned float32 arrays, behind a header naming the source checkpoint, plus a
+small JSON index. Workers `mmap` the file
+read-only and build their layers as zero-copy views into it, so N uvicorn workers
+share one physical copy of the weights through the page cache instead of holding
+N private copies.
+"""
+import argparse
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.services.feature_pipeline import check_feature_schema
+from app.services.numpy_inference import NumpyRecommender, file_sha256, fold_state_dict
+
+ALIGNMENT = 64
+INDEX_SUFFIX = ".json"
+# The file starts with MAGIC and the sha256 of the checkpoint it was folded from. The
+# index records the same sha, so a reader can tell a weights file and an index from
+# two different exports apart (the two files are replaced one after the other).
+MAGIC = b"HEALWTS1"
+HEADER_BYTES = len(MAGIC) + 64
+MAP_ATTEMPTS = 20
+
+
+class WeightsIndexMismatch(RuntimeError):
+    """Raised when the weights file and its index keep coming from different exports."""
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def export_weights(model_path: str, weights_path: str) -> str:
+    """Fold `model_path` into `weights_path` (+ `.json` index). This is the only step that needs torch."""
+    from app.services.torch_inference import load_checkpoint
+
+    checkpoint = load_checkpoint(model_path)
+    arrays = fold_state_dict(checkpoint["model_state_dict"])
+    format_version = int(arrays.pop("format_version"))
+
+    index: Dict[str, Any] = {"format_version": format_version, "source_sha256": file_sha256(model_path), "arrays": {}}
+    schema_hash = (checkpoint.get("metadata") or {}).get("feature_schema_hash")
+    if schema_hash is not None:
+        index["feature_schema_hash"] = schema_hash
+    tmp_path = f"{weights_path}.{os.getpid()}.tmp"
+    offset = HEADER_BYTES
+    with open(tmp_path, "wb") as fh:
+        fh.write(MAGIC + index["source_sha256"].encode("ascii"))
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array, dtype=np.float32)
+            offset = _align(offset)
+            fh.seek(offset)
+            fh.write(array.tobytes())
+            index["arrays"][name] = {"offset": offset, "shape": list(array.shape), "dtype": "float32"}
+            offset += array.nbytes
+    # Readers check the header against the index (see load_shared), so the order of
+    # these two replaces only decides which mismatch a reader may briefly see.
+    os.replace(tmp_path, weights_path)
+    index_tmp = f"{weights_path}{INDEX_SUFFIX}.{os.getpid()}.tmp"
+    with open(index_tmp, "w") as fh:
+        json.dump(index, fh, indent=2)
+    os.replace(index_tmp, weights_path + INDEX_SUFFIX)
+    return weights_path
+
+
+def _read_index(weights_path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(weights_path + INDEX_SUFFIX) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def _header_sha(weights_path: str) -> Optional[str]:
+    try:
+        with open(weights_path, "rb") as fh:
+            header = fh.read(HEADER_BYTES)
+    except FileNotFoundError:
+        return None
+    if len(header) < HEADER_BYTES or not header.startswith(MAGIC):
+        return None
+    return header[len(MAGIC) :].decode("ascii")
+
+
+def ensure_weights(model_path: str, weights_path: str) -> str:
+    """Export the checkpoint unless `weights_path` was already built from this exact checkpoint."""
+    index = _read_index(weights_path)
+    if index is not None and _header_sha(weights_path) == index.get("source_sha256"):
+        if not os.path.exists(model_path) or index.get("source_sha256") == file_sha256(model_path):
+            return weights_path
+    return export_weights(model_path, weights_path)
+
+
+def load_shared(weights_path: str) -> NumpyRecommender:
+    """Map `weights_path` read-only and return a recommender whose layers are views into it."""
+    for _ in range(MAP_ATTEMPTS):
+        index = _read_index(weights_path)
+        if index is None:
+            raise FileNotFoundError(f"Weight index not found: {weights_path}{INDEX_SUFFIX}")
+        mapped = np.memmap(weights_path, dtype=np.uint8, mode="r")
+        header = bytes(mapped[:HEADER_BYTES])
+        if header == MAGIC + str(index.get("source_sha256")).encode("ascii"):
+            break
+        # An export is between its two replaces; the index catches up right away.
+        del mapped
+        time.sleep(0.05)
+    else:
+        raise WeightsIndexMismatch(f"{weights_path} does not match {weights_path}{INDEX_SUFFIX}")
+    check_feature_schema(index if "feature_schema_hash" in index else None, weights_path)
+
+    arrays: Dict[str, np.ndarray] = {"format_version": np.asarray(index["format_version"])}
+    for name, spec in index["arrays"].items():
+        arrays[name] = np.ndarray(
+            tuple(spec["shape"]), dtype=np.dtype(spec["dtype"]), buffer=mapped, offset=spec["offset"]
+        )
+    recommender = NumpyRecommender(arrays)
+    recommender.backend = "mmap"
+    recommender.weights_path = os.path.abspath(weights_path)
+    return recommender
+
+
+def _read_kib_fields(path: str) -> Dict[str, int]:
+    fields: Dict[str, int] = {}
+    try:
+        with open(path) as fh:
+            for line in fh:
+                match = re.match(r"^(\w+):\s+(\d+) kB", line)
+                if match:
+                    fields[match.group(1)] = fields.get(match.group(1), 0) + int(match.group(2))
+    except (FileNotFoundError, PermissionError, ProcessLookupError):
+        pass
+    return fields
+
+
+def _mapping_fields(pid: int, mapped_path: str) -> Dict[str, int]:
+    """Sum smaps fields over the mappings of `mapped_path` in process `pid`."""
+    fields: Dict[str, int] = {}
+    in_mapping = False
+    try:
+        with open(f"/proc/{pid}/smaps") as fh:
+            for line in fh:
+                if re.match(r"^[0-9a-f]+-[0-9a-f]+ ", line):
+                    in_mapping = line.rstrip().endswith(mapped_path)
+                    continue
+                if in_mapping:
+                    match = re.match(r"^(\w+):\s+(\d+) kB", line)
+                    if match:
+                        fields[match.group(1)] = fields.get(match.group(1), 0) + int(match.group(2))
+    except (FileNotFoundError, PermissionError, ProcessLookupError):
+        pass
+    return fields
+
+
+def process_memory(pid: int, weights_path: Optional[str] = None) -> Dict[str, Any]:
+    """RSS/PSS of one process (Linux /proc), plus how much of it is the shared weight mapping."""
+    rollup = _read_kib_fields(f"/proc/{pid}/smaps_rollup")
+    report: Dict[str, Any] = {
+        "pid": pid,
+        "rss_kib": rollup.get("Rss"),
+        "pss_kib": rollup.get("Pss"),
+        "shared_clean_kib": rollup.get("Shared_Clean"),
+        "private_kib": (rollup.get("Private_Clean", 0) + rollup.get("Private_Dirty", 0)) if rollup else None,
+    }
+    if weights_path:
+        mapping = _mapping_fields(pid, os.path.abspath(weights_path))
+        report["weights_rss_kib"] = mapping.get("Rss", 0)
+        report["weights_pss_kib"] = mapping.get("Pss", 0)
+    return report
+
+
+def find_processes(pattern: str) -> List[int]:
+    pids = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit() or int(name) == os.getpid():
+            continue
+        try:
+            with open(f"/proc/{name}/cmdline", "rb") as fh:
+                cmdline = fh.read().replace(b"\0", b" ").decode(errors="replace")
+        except (FileNotFoundError, PermissionError, ProcessLookupError):
+            continue
+        if pattern in cmdline:
+            pids.append(int(name))
+    return sorted(pids)
+
+
+def main() -> None:
+    from app.services.ml_service import MODEL_PATH, SHARED_WEIGHTS_PATH
+
+    parser = argparse.ArgumentParser(description="Shared memory-mapped recommender weights.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_cmd = sub.add_parser("export", help="fold the checkpoint into the shared weight file")
+    export_cmd.add_argument("--model", default=MODEL_PATH)
+    export_cmd.add_argument("--out", default=SHARED_WEIGHTS_PATH)
+    rss_cmd = sub.add_parser("rss", help="per-worker memory report")
+    rss_cmd.add_argument("--match", default="uvicorn", help="substring of the worker command line")
+    rss_cmd.add_argument("--weights", default=SHARED_WEIGHTS_PATH)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(f"saved: {export_weights(args.model, args.out)}")
+        return
+
+    reports = [process_memory(pid, args.weights) for pid in find_processes(args.match)]
+    total_pss = sum(report["pss_kib"] or 0 for report in reports)
+    print(json.dumps({"workers": reports, "total_pss_kib": total_pss}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""Out-of-core training on the memory-mapped dataset shards.
+
+`train_and_save` holds the whole dataset in tensors. This path instead reads the
+`.npy` shards written by `ensure_shards` with `mmap_mode="r"` in fixed-size
+chunks, shuffles them through a bounded buffer and hands ready-made batches to
+the training loop from a background thread. Resident memory therefore depends on
+the buffer and the prefetch depth, not on the size of the dataset. Validation is
+streamed as well, and the audit in the checkpoint is built from running counts.
+
+    python -m app.services.train_workout_recommender --shards-only --samples-per-cell 200000
+    python -m app.services.streaming_training --samples-per-cell 200000
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from app.services.fairness_audit import subgroup_audit_from_totals
+from app.services.train_workout_recommender import (
+    AGE_BINS,
+    FITNESS_LEVELS,
+    GOALS,
+    MODEL_OUT_PATH,
+    SEED,
+    SHARD_DIR,
+    SURGERY_MODES,
+    WorkoutRecommender,
+    build_audit,
+    ensure_shards,
+    load_shard,
+    save_checkpoint,
+)
+
+VAL_FRACTION = 0.2
+CHUNK_ROWS = 8192
+GRID_SHAPE = (len(GOALS), len(FITNESS_LEVELS), len(AGE_BINS), len(SURGERY_MODES))
+
+Batch = Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, np.ndarray]
+
+
+def is_validation_row(shard_index: int, rows: np.ndarray, val_fraction: float = VAL_FRACTION) -> np.ndarray:
+    """Stateless train/val assignment: a 64-bit mix of (shard, row), so any chunk can be split on its own."""
+    keys = rows.astype(np.uint64) + np.uint64(shard_index) * np.uint64(1 << 40) + np.uint64(SEED)
+    keys = (keys ^ (keys >> np.uint64(33))) * np.uint64(0xFF51AFD7ED558CCD)
+    keys = (keys ^ (keys >> np.uint64(33))) * np.uint64(0xC4CEB9FE1A85EC53)
+    keys ^= keys >> np.uint64(33)
+    return (keys >> np.uint64(11)).astype(np.float64) / float(1 << 53) < val_fraction
+
+
+def _rss_mib() -> Optional[float]:
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return None
+
+
+class ShardStream:
+    """Iterates (x, y_cat, y_intensity, y_duration, cells) batches from one split of the shards."""
+
+    def __init__(
+        self,
+        shard_dir: Path,
+        manifest: Dict[str, Any],
+        split: str,
+        batch_size: int = 128,
+        buffer_rows: int = 65536,
+        chunk_rows: int = CHUNK_ROWS,
+        shuffle: bool = True,
+        val_fraction: float = VAL_FRACTION,
+    ) -> None:
+        if split not in ("train", "val"):
+            raise ValueError("split must be 'train' or 'val'")
+        self.shard_dir = Path(shard_dir)
+        self.shards = [shard["index"] for shard in manifest["shards"]]
+        self.rows = {shard["index"]: shard["rows"] for shard in manifest["shards"]}
+        self.split = split
+        self.batch_size = batch_size
+        self.buffer_rows = max(buffer_rows, batch_size)
+        self.chunk_rows = chunk_rows
+        self.shuffle = shuffle
+        self.val_fraction = val_fraction
+
+    def _chunks(self, rng: np.random.Generator) -> Iterator[Dict[str, np.ndarray]]:
+        """Chunks of this split. Shuffled, each chunk comes from a shard drawn in proportion to its
+        remaining rows, so the buffer mixes shards (each is one (goal, fitness) cell) instead of
+        holding one at a time. Unshuffled, shards are read in order."""
+        # Mapping a shard is cheap, so all of them stay open for the epoch.
+        arrays = {shard_index: load_shard(self.shard_dir, shard_index, mmap_mode="r") for shard_index in self.shards}
+        pending: Dict[int, List[int]] = {}  # chunk starts still to read, next one last
+        remaining: Dict[int, int] = {}
+        for shard_index in self.shards:
+            starts = np.arange(0, self.rows[shard_index], self.chunk_rows)
+            if self.shuffle:
+                rng.shuffle(starts)
+            if len(starts):
+                pending[shard_index] = starts[::-1].tolist()
+                remaining[shard_index] = self.rows[shard_index]
+
+        while pending:
+            shards = list(pending)
+            if self.shuffle:
+                weights = np.array([remaining[i] for i in shards], dtype=np.float64)
+                shard_index = shards[rng.choice(len(shards), p=weights / weights.sum())]
+            else:
+                shard_index = shards[0]
+            start = pending[shard_index].pop()
+            if not pending[shard_index]:
+                del pending[shard_index]
+            stop = min(start + self.chunk_rows, self.rows[shard_index])
+            remaining[shard_index] -= stop - start
+            keep = is_validation_row(shard_index, np.arange(start, stop), self.val_fraction)
+            if self.split == "train":
+                keep = ~keep
+            # Fancy indexing copies just this chunk out of the mapping.
+            yield {name: array[start:stop][keep] for name, array in arrays[shard_index].items()}
+
+    def batches(self, epoch: int = 0) -> Iterator[Dict[str, np.ndarray]]:
+        rng = np.random.default_rng(np.random.SeedSequence(SEED, spawn_key=(epoch,)))
+        buffer: List[Dict[str, np.ndarray]] = []
+        buffered = 0
+        for chunk in self._chunks(rng):
+            buffer.append(chunk)
+            buffered += len(chunk["x"])
+            if buffered < self.buffer_rows:
+                continue
+            merged = {name: np.concatenate([c[name] for c in buffer]) for name in chunk}
+            order = rng.permutation(buffered) if self.shuffle else np.arange(buffered)
+            full = buffered // self.batch_size * self.batch_size
+            for start in range(0, full, self.batch_size):
+                b = order[start : start + self.batch_size]
+                yield {name: array[b] for name, array in merged.items()}
+            # Carry the tail into the next buffer so every emitted batch is full.
+            tail = order[full:]
+            buffer = [{name: array[tail] for name, array in merged.items()}]
+            buffered = len(tail)
+
+        if buffered:
+            merged = {name: np.concatenate([c[name] for c in buffer]) for name in buffer[0]}
+            order = rng.permutation(buffered) if self.shuffle else np.arange(buffered)
+            for start in range(0, buffered, self.batch_size):
+                b = order[start : start + self.batch_size]
+                yield {name: array[b] for name, array in merged.items()}
+
+
+def _to_tensors(batch: Dict[str, np.ndarray]) -> Batch:
+    return (
+        torch.from_numpy(np.ascontiguousarray(batch["x"], dtype=np.float32)),
+        torch.from_numpy(np.ascontiguousarray(batch["y_cat"], dtype=np.int64)),
+        torch.from_numpy(np.ascontiguousarray(batch["y_intensity"], dtype=np.float32)),
+        torch.from_numpy(np.ascontiguousarray(batch["y_duration"], dtype=np.float32)),
+        batch["cells"],
+    )
+
+
+_END = object()
+
+
+def prefetch(batches: Iterator[Dict[str, np.ndarray]], depth: int = 4) -> Iterator[Batch]:
+    """Run `batches` (shard reads, shuffling, tensor conversion) on a background thread."""
+    ready: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+
+    def produce() -> None:
+        try:
+            for batch in batches:
+                item = _to_tensors(batch)
+                while not stop.is_set():
+                    try:
+                        ready.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            ready.put(_END)
+        except BaseException as exc:  # surfaced in the consumer
+            ready.put(exc)
+
+    thread = threading.Thread(target=produce, name="shard-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = ready.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join(timeout=5)
+
+
+class StreamingAudit:
+    """Running totals for the same audit `train_and_save` computes in one shot.
+
+    Everything is kept per (goal, fitness, age_bin, surgery) cell, which is enough for
+    both `build_audit` and fairness_audit's subgroup metrics and gap intervals.
+    """
+
+    def __init__(self) -> None:
+        n_cells = int(np.prod(GRID_SHAPE))
+        self.correct = np.zeros(n_cells, dtype=np.int64)
+        self.total = np.zeros(n_cells, dtype=np.int64)
+        # (sum, sum of squares) of the squared error per cell
+        self.sq_err = {name: (np.zeros(n_cells), np.zeros(n_cells)) for name in ("intensity_mse", "duration_mse")}
+        self.loss_sum = 0.0
+
+    def update(self, logits, p_i, p_d, y_cat, y_i, y_d, cells: np.ndarray, loss: float) -> None:
+        n_cells = len(self.total)
+        hit = (torch.argmax(logits, dim=1) == y_cat).numpy()
+        self.correct += np.bincount(cells, weights=hit.astype(np.float64), minlength=n_cells).astype(np.int64)
+        self.total += np.bincount(cells, minlength=n_cells)
+        for name, pred, target in (("intensity_mse", p_i, y_i), ("duration_mse", p_d, y_d)):
+            err = ((pred - target) ** 2).reshape(-1).double().numpy()
+            total, total_sq = self.sq_err[name]
+            total += np.bincount(cells, weights=err, minlength=n_cells)
+            total_sq += np.bincount(cells, weights=err * err, minlength=n_cells)
+        self.loss_sum += loss * len(cells)
+
+    @property
+    def rows(self) -> int:
+        return int(self.total.sum())
+
+    def loss(self) -> float:
+        return self.loss_sum / max(self.rows, 1)
+
+    def _accuracy_by(self, axis: int, names: List[str]) -> Dict[str, float]:
+        other = tuple(a for a in range(len(GRID_SHAPE)) if a != axis)
+        correct = self.correct.reshape(GRID_SHAPE).sum(axis=other)
+        total = self.total.reshape(GRID_SHAPE).sum(axis=other)
+        accuracy = {name: float(correct[i] / total[i]) for i, name in enumerate(names) if total[i]}
+        return dict(sorted(accuracy.items()))
+
+    def report(self, train_size: int) -> Dict[str, Any]:
+        rows = max(self.rows, 1)
+        metrics = {
+            "category_acc": float(self.correct.sum() / rows),
+            "intensity_mse": float(self.sq_err["intensity_mse"][0].sum() / rows),
+            "duration_mse": float(self.sq_err["duration_mse"][0].sum() / rows),
+        }
+        return build_audit(
+            metrics,
+            self._accuracy_by(0, GOALS),
+            self._accuracy_by(1, FITNESS_LEVELS),
+            self._accuracy_by(2, AGE_BINS),
+            self.rows,
+            train_size,
+        )
+
+    def subgroups(self) -> Dict[str, Any]:
+        """What `subgroup_audit` reports for the in-memory path, from the per-cell totals."""
+        goal_idx, fitness_idx, age_bin_idx, _ = np.unravel_index(np.arange(len(self.total)), GRID_SHAPE)
+        columns = {
+            "goal": np.asarray(GOALS)[goal_idx],
+            "fitness": np.asarray(FITNESS_LEVELS)[fitness_idx],
+            "age_bin": np.asarray(AGE_BINS)[age_bin_idx],
+        }
+        correct = self.correct.astype(np.float64)
+        totals = {"accuracy": (correct, correct), **self.sq_err}  # a 0/1 column is its own square
+        return subgroup_audit_from_totals(columns, self.total, totals, seed=SEED)
+
+
+def validate(model: nn.Module, stream: ShardStream, prefetch_depth: int) -> StreamingAudit:
+    ce = nn.CrossEntropyLoss()
+    mse = nn.MSELoss()
+    audit = StreamingAudit()
+    model.eval()
+    with torch.no_grad():
+        for xb, ycb, yib, ydb, cells in prefetch(stream.batches(), prefetch_depth):
+            logits, p_i, p_d = model(xb)
+            loss = ce(logits, ycb) + 0.5 * mse(p_i, yib) + 0.5 * mse(p_d, ydb)
+            audit.update(logits, p_i, p_d, ycb, yib, ydb, cells, float(loss))
+    return audit
+
+
+def train_streaming(
+    shard_dir: Path = SHARD_DIR,
+    samples_per_cell: int = 22,
+    epochs: int = 60,
+    batch_size: int = 128,
+    buffer_rows: int = 65536,
+    prefetch_depth: int = 4,
+    workers: Optional[int] = None,
+    out_path: Optional[Path] = None,
+) -> Dict[str, Any]:
+    manifest = ensure_shards(shard_dir, samples_per_cell, workers)
+    train_stream = ShardStream(shard_dir, manifest, "train", batch_size, buffer_rows)
+    val_stream = ShardStream(shard_dir, manifest, "val", 4096, buffer_rows, shuffle=False)
+
+    torch.manual_seed(SEED)
+    model = WorkoutRecommender()
+    optim = torch.optim.Adam(model.parameters(), lr=8e-4, weight_decay=1e-5)
+    ce = nn.CrossEntropyLoss()
+    mse = nn.MSELoss()
+
+    best: Dict[str, Any] = {"loss": float("inf"), "epoch": 0, "state": None}
+    train_size = 0
+    for epoch in range(1, epochs + 1):
+        model.train()
+        started = time.perf_counter()
+        total = torch.zeros(())
+        rows = 0
+        for xb, ycb, yib, ydb, _ in prefetch(train_stream.batches(epoch), prefetch_depth):
+            if len(xb) < 2:
+                continue  # BatchNorm needs more than one row in train mode
+            cat_logits, p_i, p_d = model(xb)
+            loss = ce(cat_logits, ycb) + 0.5 * mse(p_i, yib) + 0.5 * mse(p_d, ydb)
+            optim.zero_grad()
+            loss.backward()
+            optim.step()
+            total += loss.detach()
+            rows += len(xb)
+        train_size = rows
+        elapsed = time.perf_counter() - started
+
+        val_loss = validate(model, val_stream, prefetch_depth).loss()
+        if val_loss < best["loss"]:
+            best["loss"] = val_loss
+            best["epoch"] = epoch
+            best["state"] = {k: v.detach().cpu().clone() for k, v in model.state_dict().items()}
+        print(
+            f"epoch={epoch} train_loss={float(total):.4f} val_loss={val_loss:.6f} "
+            f"rows/s={rows / elapsed:.0f} rss_mib={_rss_mib() or 0:.0f}"
+        )
+
+    assert best["state"] is not None
+    model.load_state_dict(best["state"])
+    totals = validate(model, val_stream, prefetch_depth)
+    audit = totals.report(train_size)
+    print("audit:", json.dumps(audit, indent=2))
+
+    extra = {"generator": "sharded", "samples_per_cell": samples_per_cell, "training": "streaming"}
+    save_checkpoint(model, best["epoch"], best["loss"], audit, extra, out_path or MODEL_OUT_PATH, totals.subgroups())
+    return audit
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train the WorkoutRecommender from memory-mapped shards.")
+    parser.add_argument("--shard-dir", type=Path, default=SHARD_DIR)
+    parser.add_argument("--samples-per-cell", type=int, default=22)
+    parser.add_argument("--epochs", type=int, default=60)
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--buffer-rows", type=int, default=65536, help="shuffle buffer size")
+    parser.add_argument("--prefetch", type=int, default=4, help="batches prepared ahead of the training loop")
+    parser.add_argument("--workers", type=int, default=None, help="shard generation processes")
+    parser.add_argument("--out", type=Path, default=None, help="checkpoint path (default: app/models/workout_recommender.pt)")
+    args = parser.parse_args()
+
+    train_streaming(
+        args.shard_dir,
+        args.samples_per_cell,
+        args.epochs,
+        args.batch_size,
+        args.buffer_rows,
+        args.prefetch,
+        args.workers,
+        args.out,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import os
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from app.services.feature_pipeline import check_feature_schema
+
+
+class WorkoutRecommender(nn.Module):
+    """Inference architecture that matches workout_recommender.pt.
+
+    The layer sizes default to the production model; checkpoints written since
+    distillation was added carry their own in `metadata["architecture"]`.
+    """
+
+    def __init__(
+        self,
+        hidden: Sequence[int] = (128, 128),
+        embedding: int = 64,
+        category_hidden: int = 32,
+        regression_hidden: int = 16,
+    ) -> None:
+        super().__init__()
+        self.architecture = {
+            "hidden": list(hidden),
+            "embedding": embedding,
+            "category_hidden": category_hidden,
+            "regression_hidden": regression_hidden,
+        }
+        layers: List[nn.Module] = []
+        width = 14
+        for size in hidden:
+            layers += [nn.Linear(width, size), nn.BatchNorm1d(size), nn.ReLU(), nn.Dropout(0.3)]
+            width = size
+        layers.append(nn.Linear(width, embedding))
+        self.encoder = nn.Sequential(*layers)
+
+        self.category_head = nn.Sequential(
+            nn.Linear(embedding, category_hidden),
+            nn.ReLU(),
+            nn.Linear(category_hidden, 7),
+        )
+        self.intensity_head = nn.Sequential(
+            nn.Linear(embedding, regression_hidden),
+            nn.ReLU(),
+            nn.Linear(regression_hidden, 1),
+        )
+        self.duration_head = nn.Sequential(
+            nn.Linear(embedding, regression_hidden),
+            nn.ReLU(),
+            nn.Linear(regression_hidden, 1),
+        )
+
+    def forward(self, x: torch.Tensor):
+        shared = self.encoder(x)
+        category_logits = self.category_head(shared)
+        intensity = self.intensity_head(shared)
+        duration = self.duration_head(shared)
+        return category_logits, intensity, duration
+
+
+def load_checkpoint(model_path: str) -> Dict[str, Any]:
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model file not found: {model_path}")
+
+    checkpoint = torch.load(model_path, map_location="cpu")
+    if isinstance(checkpoint, dict) and "model_state_dict" in checkpoint:
+        return checkpoint
+    return {"model_state_dict": checkpoint}
+
+
+def load_model(model_path: str) -> WorkoutRecommender:
+    checkpoint = load_checkpoint(model_path)
+    metadata = checkpoint.get("metadata") or {}
+    check_feature_schema(checkpoint.get("metadata"), model_path)
+    state_dict = checkpoint["model_state_dict"]
+
+    model = WorkoutRecommender(**metadata.get("architecture", {}))
+    missing_keys, unexpected_keys = model.load_state_dict(state_dict, strict=False)
+    if missing_keys or unexpected_keys:
+        raise RuntimeError(
+            "Checkpoint architecture mismatch. "
+            f"Missing keys: {missing_keys}; Unexpected keys: {unexpected_keys}"
+        )
+
+    model.eval()
+    return model
+
+
+class TorchRecommender:
+    """Runs the torch module on NumPy input and returns NumPy outputs."""
+
+    backend = "torch"
+
+    def __init__(self, model: nn.Module) -> None:
+        self.model = model
+
+    @classmethod
+    def from_checkpoint(cls, model_path: str) -> "TorchRecommender":
+        return cls(load_model(model_path))
+
+    def __call__(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        with torch.no_grad():
+            category_logits, intensity, duration = self.model(torch.from_numpy(np.ascontiguousarray(x, dtype=np.float32)))
+        return category_logits.numpy(), intensity.numpy(), duration.numpy()
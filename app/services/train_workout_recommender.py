@@ -1,42 +1,44 @@
+import argparse
+import functools
+import hashlib
 import json
+import multiprocessing
+import os
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Sequence, Tuple
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 import torch
 import torch.nn as nn
 from sklearn.model_selection import train_test_split
 
+from app.services.fairness_audit import accuracy_by_group, subgroup_audit
+from app.services.feature_pipeline import (
+    FEATURE_NAMES,
+    FITNESS_LEVELS,
+    GOALS,
+    RECOVERY_PHASES,
+    SCHEMA_HASH,
+    encode_columns,
+    encode_record,
+    estimate_sleep_hours,
+    estimate_sleep_hours_array,
+    schema_metadata,
+)
+
 
 SEED = 42
 random.seed(SEED)
 np.random.seed(SEED)
 torch.manual_seed(SEED)
 
-GOALS = [
-    "weight_loss",
-    "muscle_gain",
-    "endurance",
-    "rehabilitation",
-    "flexibility",
-    "maintenance",
-]
-FITNESS_LEVELS = ["beginner", "intermediate", "advanced"]
-RECOVERY_PHASES = ["normal", "remodeling", "subacute", "acute"]
 AGE_BINS = ["minor", "adult", "older"]
+SURGERY_MODES = ["none", "remodeling", "subacute", "acute"]
 
-FITNESS_LEVEL_MAP = {"beginner": 0.0, "intermediate": 0.5, "advanced": 1.0}
-RECOVERY_PHASE_MAP = {"normal": 0.0, "remodeling": 0.33, "subacute": 0.66, "acute": 1.0}
-GOAL_ONE_HOT = {
-    "weight_loss": [1.0, 0.0, 0.0, 0.0],
-    "muscle_gain": [0.0, 1.0, 0.0, 0.0],
-    "endurance": [0.0, 0.0, 1.0, 0.0],
-    "rehabilitation": [0.0, 0.0, 0.0, 1.0],
-    "flexibility": [0.0, 0.0, 0.0, 0.0],
-    "maintenance": [0.0, 0.0, 0.0, 0.0],
-}
 CATEGORY_NAMES = {
     0: "bodyweight",
     1: "strength",
@@ -54,6 +56,8 @@ GOAL_PRIORITIES = {
     "flexibility": [3, 5],
     "maintenance": [0, 4, 5],
 }
+# Conditions the generator samples from. Whether a profile counts as cardiac for the
+# has_cardiac feature is decided by feature_pipeline.CARDIAC_CONDITIONS.
 CARDIAC_CONDITIONS = {
     "heart_disease",
     "hypertension",
@@ -66,24 +70,6 @@ NON_CARDIAC_CONDITIONS = {
     "arthritis",
     "thyroid_disorder",
 }
-FEATURE_NAMES = [
-    "age_norm",
-    "bmi_norm",
-    "fitness_norm",
-    "is_post_surgery",
-    "recovery_phase_norm",
-    "days_since_surgery_norm",
-    "pain_norm",
-    "sleep_norm",
-    "goal_weight_loss",
-    "goal_muscle_gain",
-    "goal_endurance",
-    "goal_rehabilitation",
-    "num_conditions_norm",
-    "has_cardiac",
-]
-
-
 def clamp(x: float, low: float, high: float) -> float:
     return max(low, min(high, x))
 
@@ -96,18 +82,6 @@ def age_from_bin(age_bin: str) -> int:
     return random.randint(18, 50)
 
 
-def estimate_sleep_hours(age: int) -> float:
-    if age <= 5:
-        return 11.0
-    if age <= 13:
-        return 9.5
-    if age <= 17:
-        return 8.5
-    if age <= 64:
-        return 7.5
-    return 7.0
-
-
 @dataclass
 class Profile:
     age: int
@@ -270,27 +244,7 @@ def target_duration(profile: Profile, category_id: int) -> float:
 
 
 def to_features(profile: Profile) -> List[float]:
-    age_norm = clamp(profile.age / 100.0, 0.0, 1.0)
-    bmi_norm = clamp(profile.bmi / 40.0, 0.0, 1.0)
-    fitness_norm = FITNESS_LEVEL_MAP[profile.fitness_level]
-    recovery_norm = RECOVERY_PHASE_MAP[profile.recovery_phase]
-    days_norm = clamp(1.0 - (profile.days_since_surgery / 180.0), 0.0, 1.0) if profile.is_post_surgery else 0.0
-    pain_norm = clamp(profile.pain_level / 10.0, 0.0, 1.0)
-    sleep_norm = clamp(profile.sleep_hours / 9.0, 0.0, 1.0)
-    num_conditions = clamp(min(len(profile.medical_conditions), 5) / 5.0, 0.0, 1.0)
-    return [
-        age_norm,
-        bmi_norm,
-        fitness_norm,
-        1.0 if profile.is_post_surgery else 0.0,
-        recovery_norm,
-        days_norm,
-        pain_norm,
-        sleep_norm,
-        *GOAL_ONE_HOT[profile.goal],
-        num_conditions,
-        1.0 if profile.has_cardiac else 0.0,
-    ]
+    return encode_record(vars(profile))
 
 
 def generate_dataset(samples_per_cell: int = 22) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, Dict[str, Sequence[str]]]:
@@ -302,11 +256,10 @@ def generate_dataset(samples_per_cell: int = 22) -> Tuple[np.ndarray, np.ndarray
     fitness_meta: List[str] = []
     age_meta: List[str] = []
 
-    surgery_modes = ["none", "remodeling", "subacute", "acute"]
     for goal in GOALS:
         for fitness in FITNESS_LEVELS:
             for age_bin in AGE_BINS:
-                for surgery_mode in surgery_modes:
+                for surgery_mode in SURGERY_MODES:
                     for _ in range(samples_per_cell):
                         profile = generate_profile(goal, fitness, age_bin, surgery_mode)
                         category_id = choose_category(profile)
@@ -330,23 +283,343 @@ def generate_dataset(samples_per_cell: int = 22) -> Tuple[np.ndarray, np.ndarray
     )
 
 
+# Lookup tables for the vectorized generator, indexed like the lists above.
+AGE_RANGES = np.array([[14, 17], [18, 50], [51, 75]])  # AGE_BINS
+SURGERY_DAY_RANGES = np.array([[0, 0], [61, 180], [15, 60], [0, 14]])  # SURGERY_MODES
+SURGERY_PHASE = np.array([RECOVERY_PHASES.index(p) for p in ["normal", "remodeling", "subacute", "acute"]])
+PHASE_BASE_PAIN = np.array([1.5, 3.0, 5.1, 7.8])  # RECOVERY_PHASES
+CONDITION_COLUMNS = sorted(CARDIAC_CONDITIONS | NON_CARDIAC_CONDITIONS)
+CARDIAC_COLUMNS = [CONDITION_COLUMNS.index(c) for c in sorted(CARDIAC_CONDITIONS)]
+NON_CARDIAC_COLUMNS = [CONDITION_COLUMNS.index(c) for c in sorted(NON_CARDIAC_CONDITIONS)]
+FITNESS_BASE_INTENSITY = np.array([0.32, 0.53, 0.74])  # FITNESS_LEVELS
+FITNESS_BASE_MINUTES = np.array([30, 40, 48])  # FITNESS_LEVELS
+GOAL_INTENSITY_OFFSET = np.array([0.08, 0.0, 0.08, -0.1, -0.1, 0.0])  # GOALS
+GOAL_MINUTES_OFFSET = np.array([5, 3, 0, -10, -6, 0])  # GOALS
+NO_PRIORITY = 99
+
+
+def _priority_ranks() -> np.ndarray:
+    """ranks[goal, has_diabetes, category] = position in the priority list `choose_category` walks."""
+    ranks = np.full((len(GOALS), 2, 7), NO_PRIORITY, dtype=np.int64)
+    for g, goal in enumerate(GOALS):
+        priorities = list(GOAL_PRIORITIES[goal])
+        diabetic = [c for c in [4, 0, 5, 6, 3, 1, 2] if c in priorities or c not in [2]]
+        for d, order in enumerate([priorities, diabetic]):
+            for rank, c in enumerate(order):
+                ranks[g, d, c] = rank
+    return ranks
+
+
+PRIORITY_RANKS = _priority_ranks()
+
+
+def generate_cells_vectorized(
+    goal_idx: np.ndarray,
+    fitness_idx: np.ndarray,
+    age_bin_idx: np.ndarray,
+    surgery_idx: np.ndarray,
+    rng: np.random.Generator,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Column-wise `generate_profile` + `choose_category` + targets + `to_features`.
+
+    Each argument holds one index per sample into GOALS, FITNESS_LEVELS, AGE_BINS
+    and SURGERY_MODES. The rules are the same as the per-sample generator; only the
+    random stream differs.
+    """
+    n = len(goal_idx)
+
+    age = rng.integers(AGE_RANGES[age_bin_idx, 0], AGE_RANGES[age_bin_idx, 1] + 1)
+    bmi = np.clip(np.round(rng.normal(25.5, 4.8, n), 1), 16.0, 40.0)
+
+    is_post_surgery = surgery_idx != 0
+    phase = SURGERY_PHASE[surgery_idx]
+    days_since_surgery = rng.integers(SURGERY_DAY_RANGES[surgery_idx, 0], SURGERY_DAY_RANGES[surgery_idx, 1] + 1)
+    pain = np.clip(rng.normal(PHASE_BASE_PAIN[phase], 1.4), 0.0, 10.0)
+    sleep = np.clip(rng.normal(estimate_sleep_hours_array(age), 1.1), 3.5, 10.5)
+
+    rows = np.arange(n)
+    conditions = np.zeros((n, len(CONDITION_COLUMNS)), dtype=bool)
+    cardiac_hint = rng.random(n) < 0.18
+    cardiac_pick = np.asarray(CARDIAC_COLUMNS)[rng.integers(0, len(CARDIAC_COLUMNS), n)]
+    conditions[rows[cardiac_hint], cardiac_pick[cardiac_hint]] = True
+    conditions[:, CONDITION_COLUMNS.index("diabetes")] |= rng.random(n) < 0.25
+    conditions[:, CONDITION_COLUMNS.index("hypertension")] |= rng.random(n) < 0.15
+    extra = rng.random(n) < 0.2
+    extra_pick = np.asarray(NON_CARDIAC_COLUMNS)[rng.integers(0, len(NON_CARDIAC_COLUMNS), n)]
+    conditions[rows[extra], extra_pick[extra]] = True
+    num_conditions = conditions.sum(axis=1)
+    has_cardiac = conditions[:, CARDIAC_COLUMNS].any(axis=1)
+    has_diabetes = conditions[:, CONDITION_COLUMNS.index("diabetes")]
+
+    # allowed_categories
+    acute = is_post_surgery & (phase == RECOVERY_PHASES.index("acute"))
+    subacute = is_post_surgery & (phase == RECOVERY_PHASES.index("subacute"))
+    allowed = np.ones((n, 7), dtype=bool)
+    allowed[:, 1] = ~((pain >= 4.0) | (age < 18))
+    allowed[:, 2] = ~((pain >= 4.0) | has_cardiac | (sleep < 5.0) | (bmi > 30))
+    restricted = (pain >= 7.0) | subacute
+    allowed[restricted] = [False, False, False, False, False, True, True]
+    allowed[acute] = [False, False, False, False, False, False, True]
+
+    # choose_category: best-ranked allowed priority, else a uniform pick among allowed.
+    ranks = np.where(allowed, PRIORITY_RANKS[goal_idx, has_diabetes.astype(np.int64)], NO_PRIORITY)
+    category = np.argmin(ranks, axis=1)
+    fallback = ranks[rows, category] == NO_PRIORITY
+    if fallback.any():
+        keys = rng.random((int(fallback.sum()), 7))
+        keys[~allowed[fallback]] = -1.0
+        category[fallback] = np.argmax(keys, axis=1)
+        category[fallback & ~allowed.any(axis=1)] = 6
+    low_effort = np.isin(category, [3, 5, 6])
+
+    # target_intensity
+    intensity = FITNESS_BASE_INTENSITY[fitness_idx] + GOAL_INTENSITY_OFFSET[goal_idx]
+    intensity = np.where(pain >= 7, np.minimum(intensity, 0.22), np.where(pain >= 4, np.minimum(intensity, 0.4), intensity))
+    intensity = np.where(acute, np.minimum(intensity, 0.2), intensity)
+    intensity = np.where(subacute, np.minimum(intensity, 0.35), intensity)
+    intensity = np.where(has_cardiac, np.minimum(intensity, 0.6), intensity)
+    intensity = intensity - 0.12 * (sleep < 5) - 0.08 * low_effort
+    intensity = np.clip(intensity, 0.1, 0.95)
+
+    # target_duration
+    minutes = FITNESS_BASE_MINUTES[fitness_idx] + GOAL_MINUTES_OFFSET[goal_idx]
+    minutes = np.where(pain >= 7, np.minimum(minutes, 20), np.where(pain >= 4, np.minimum(minutes, 30), minutes))
+    minutes = minutes - 6 * (sleep < 5) - 4 * low_effort
+    duration = np.clip(minutes / 60.0, 0.2, 1.0)
+
+    features = encode_columns(
+        {
+            "age": age,
+            "bmi": bmi,
+            "fitness_level": fitness_idx,
+            "is_post_surgery": is_post_surgery,
+            "recovery_phase": phase,
+            "days_since_surgery": days_since_surgery,
+            "pain_level": pain,
+            "sleep_hours": sleep,
+            "goal": goal_idx,
+            "num_conditions": num_conditions,
+            "has_cardiac": has_cardiac,
+        }
+    ).astype(np.float32)
+
+    return (
+        features,
+        category.astype(np.int64),
+        intensity.astype(np.float32).reshape(-1, 1),
+        duration.astype(np.float32).reshape(-1, 1),
+    )
+
+
+def cell_indices(samples_per_cell: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Per-sample (goal, fitness, age_bin, surgery_mode) indices in `generate_dataset` loop order."""
+    shape = (len(GOALS), len(FITNESS_LEVELS), len(AGE_BINS), len(SURGERY_MODES))
+    cells = np.repeat(np.arange(int(np.prod(shape))), samples_per_cell)
+    return np.unravel_index(cells, shape)
+
+
+def generate_dataset_vectorized(
+    samples_per_cell: int = 22, seed: int = SEED
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, Dict[str, Sequence[str]]]:
+    """Vectorized, seeded counterpart of `generate_dataset`, matching it in distribution only.
+
+    The outputs have the same shapes and the same cell layout (goal, fitness, age_bin and
+    surgery mode blocks in loop order), but every cell is drawn column by column from
+    this function's own RNG stream. The rows are therefore different samples and do not
+    reproduce `generate_dataset`. Use it only where a statistically equivalent dataset
+    will do (see tests/test_generator_parity.py).
+    """
+    goal_idx, fitness_idx, age_bin_idx, surgery_idx = cell_indices(samples_per_cell)
+    x, y_cat, y_i, y_d = generate_cells_vectorized(
+        goal_idx, fitness_idx, age_bin_idx, surgery_idx, np.random.default_rng(seed)
+    )
+    metadata = {
+        "goal": np.asarray(GOALS)[goal_idx],
+        "fitness": np.asarray(FITNESS_LEVELS)[fitness_idx],
+        "age_bin": np.asarray(AGE_BINS)[age_bin_idx],
+    }
+    return x, y_cat, y_i, y_d, metadata
+
+
+def generator_parity_report(samples_per_cell: int = 100) -> Dict[str, float]:
+    """Compare summary statistics of the per-sample and vectorized generators."""
+    xa, ca, ia, da, _ = generate_dataset(samples_per_cell)
+    xb, cb, ib, db, _ = generate_dataset_vectorized(samples_per_cell)
+    pa = np.bincount(ca, minlength=7) / len(ca)
+    pb = np.bincount(cb, minlength=7) / len(cb)
+    return {
+        "rows": float(len(xa)),
+        "max_feature_mean_diff": float(np.max(np.abs(xa.mean(axis=0) - xb.mean(axis=0)))),
+        "max_feature_std_diff": float(np.max(np.abs(xa.std(axis=0) - xb.std(axis=0)))),
+        "category_total_variation": float(0.5 * np.abs(pa - pb).sum()),
+        "intensity_mean_diff": float(abs(ia.mean() - ib.mean())),
+        "duration_mean_diff": float(abs(da.mean() - db.mean())),
+    }
+
+
+# Bump whenever the generation rules change so stale shards are regenerated.
+GENERATOR_VERSION = 1
+SHARD_ARRAYS = ("x", "y_cat", "y_intensity", "y_duration", "cells")
+SHARD_DIR = Path(__file__).resolve().parents[1] / "models" / "shards"
+
+
+def shard_cells(shard_index: int) -> np.ndarray:
+    """Flat cell ids (goal-major, `generate_dataset` order) covered by one shard: one (goal, fitness) pair."""
+    per_shard = len(AGE_BINS) * len(SURGERY_MODES)
+    return np.arange(shard_index * per_shard, (shard_index + 1) * per_shard)
+
+
+def num_shards() -> int:
+    return len(GOALS) * len(FITNESS_LEVELS)
+
+
+def _shard_path(out_dir: Path, shard_index: int, name: str) -> Path:
+    return out_dir / f"shard-{shard_index:05d}.{name}.npy"
+
+
+def _generate_shard(out_dir: str, shard_index: int, samples_per_cell: int, seed: int) -> Dict[str, Any]:
+    """Generate and write one shard. Its random stream depends only on (seed, shard_index)."""
+    shape = (len(GOALS), len(FITNESS_LEVELS), len(AGE_BINS), len(SURGERY_MODES))
+    cells = np.repeat(shard_cells(shard_index), samples_per_cell)
+    goal_idx, fitness_idx, age_bin_idx, surgery_idx = np.unravel_index(cells, shape)
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(shard_index,)))
+    x, y_cat, y_i, y_d = generate_cells_vectorized(goal_idx, fitness_idx, age_bin_idx, surgery_idx, rng)
+    arrays = {"x": x, "y_cat": y_cat, "y_intensity": y_i, "y_duration": y_d, "cells": cells.astype(np.int16)}
+
+    digest = hashlib.sha256()
+    for name in SHARD_ARRAYS:
+        path = _shard_path(Path(out_dir), shard_index, name)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as fh:
+            np.save(fh, arrays[name])
+        os.replace(tmp_path, path)
+        digest.update(path.read_bytes())
+    return {"index": shard_index, "rows": int(len(x)), "sha256": digest.hexdigest()}
+
+
+def _read_manifest(out_dir: Path) -> Optional[Dict[str, Any]]:
+    try:
+        with open(out_dir / "manifest.json") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def _manifest_matches(manifest: Optional[Dict[str, Any]], out_dir: Path, samples_per_cell: int, seed: int) -> bool:
+    if manifest is None:
+        return False
+    expected = {
+        "generator_version": GENERATOR_VERSION,
+        "feature_schema_hash": SCHEMA_HASH,
+        "seed": seed,
+        "samples_per_cell": samples_per_cell,
+    }
+    if any(manifest.get(key) != value for key, value in expected.items()):
+        return False
+    return len(manifest.get("shards", [])) == num_shards() and all(
+        _shard_path(out_dir, shard["index"], name).exists() for shard in manifest["shards"] for name in SHARD_ARRAYS
+    )
+
+
+def ensure_shards(
+    out_dir: Path = SHARD_DIR, samples_per_cell: int = 22, workers: Optional[int] = None, seed: int = SEED
+) -> Dict[str, Any]:
+    """Write the sharded dataset to `out_dir` unless a matching manifest is already there.
+
+    Shards are generated on a process pool; each one gets its own SeedSequence child of
+    `seed`, so the files are byte-identical whatever `workers` is.
+    """
+    out_dir = Path(out_dir)
+    manifest = _read_manifest(out_dir)
+    if _manifest_matches(manifest, out_dir, samples_per_cell, seed):
+        return manifest
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    indices = list(range(num_shards()))
+    if workers == 1:
+        shards = [_generate_shard(str(out_dir), i, samples_per_cell, seed) for i in indices]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            generate = functools.partial(_generate_shard, str(out_dir), samples_per_cell=samples_per_cell, seed=seed)
+            shards = list(pool.map(generate, indices))
+
+    manifest = {
+        "generator_version": GENERATOR_VERSION,
+        "feature_schema_hash": SCHEMA_HASH,
+        "seed": seed,
+        "samples_per_cell": samples_per_cell,
+        "feature_names": FEATURE_NAMES,
+        "rows": sum(shard["rows"] for shard in shards),
+        "shards": shards,
+    }
+    # The manifest goes in last, so a half-written directory is never reused.
+    tmp_path = out_dir / f"manifest.json.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as fh:
+        json.dump(manifest, fh, indent=2)
+    os.replace(tmp_path, out_dir / "manifest.json")
+    return manifest
+
+
+def load_shard(out_dir: Path, shard_index: int, mmap_mode: Optional[str] = None) -> Dict[str, np.ndarray]:
+    return {name: np.load(_shard_path(Path(out_dir), shard_index, name), mmap_mode=mmap_mode) for name in SHARD_ARRAYS}
+
+
+def cell_metadata(cells: np.ndarray) -> Dict[str, np.ndarray]:
+    shape = (len(GOALS), len(FITNESS_LEVELS), len(AGE_BINS), len(SURGERY_MODES))
+    goal_idx, fitness_idx, age_bin_idx, _ = np.unravel_index(cells, shape)
+    return {
+        "goal": np.asarray(GOALS)[goal_idx],
+        "fitness": np.asarray(FITNESS_LEVELS)[fitness_idx],
+        "age_bin": np.asarray(AGE_BINS)[age_bin_idx],
+    }
+
+
+def load_shards(
+    out_dir: Path = SHARD_DIR,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, Dict[str, Sequence[str]]]:
+    """Concatenate every shard in manifest order; same tuple as `generate_dataset`."""
+    manifest = _read_manifest(Path(out_dir))
+    if manifest is None:
+        raise FileNotFoundError(f"No shard manifest in {out_dir}")
+    shards = [load_shard(out_dir, shard["index"]) for shard in manifest["shards"]]
+    x, y_cat, y_i, y_d, cells = (np.concatenate([shard[name] for shard in shards]) for name in SHARD_ARRAYS)
+    return x, y_cat, y_i, y_d, cell_metadata(cells)
+
+
 class WorkoutRecommender(nn.Module):
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        dropout: float = 0.3,
+        hidden: Sequence[int] = (128, 128),
+        embedding: int = 64,
+        category_hidden: int = 32,
+        regression_hidden: int = 16,
+    ) -> None:
         super().__init__()
-        self.encoder = nn.Sequential(
-            nn.Linear(14, 128),
-            nn.BatchNorm1d(128),
-            nn.ReLU(),
-            nn.Dropout(0.3),
-            nn.Linear(128, 128),
-            nn.BatchNorm1d(128),
-            nn.ReLU(),
-            nn.Dropout(0.3),
-            nn.Linear(128, 64),
+        # Saved as checkpoint metadata so torch_inference can rebuild non-default sizes.
+        self.architecture = {
+            "hidden": list(hidden),
+            "embedding": embedding,
+            "category_hidden": category_hidden,
+            "regression_hidden": regression_hidden,
+        }
+        layers: List[nn.Module] = []
+        width = len(FEATURE_NAMES)
+        for size in hidden:
+            layers += [nn.Linear(width, size), nn.BatchNorm1d(size), nn.ReLU(), nn.Dropout(dropout)]
+            width = size
+        layers.append(nn.Linear(width, embedding))
+        self.encoder = nn.Sequential(*layers)
+        self.category_head = nn.Sequential(
+            nn.Linear(embedding, category_hidden), nn.ReLU(), nn.Linear(category_hidden, len(CATEGORY_NAMES))
+        )
+        self.intensity_head = nn.Sequential(
+            nn.Linear(embedding, regression_hidden), nn.ReLU(), nn.Linear(regression_hidden, 1)
+        )
+        self.duration_head = nn.Sequential(
+            nn.Linear(embedding, regression_hidden), nn.ReLU(), nn.Linear(regression_hidden, 1)
         )
-        self.category_head = nn.Sequential(nn.Linear(64, 32), nn.ReLU(), nn.Linear(32, 7))
-        self.intensity_head = nn.Sequential(nn.Linear(64, 16), nn.ReLU(), nn.Linear(16, 1))
-        self.duration_head = nn.Sequential(nn.Linear(64, 16), nn.ReLU(), nn.Linear(16, 1))
 
     def forward(self, x: torch.Tensor):
         shared = self.encoder(x)
@@ -365,18 +638,162 @@ def evaluate(model: nn.Module, x: torch.Tensor, y_cat: torch.Tensor, y_i: torch.
 
 
 def subgroup_accuracy(pred: np.ndarray, y: np.ndarray, group: Sequence[str]) -> Dict[str, float]:
-    out: Dict[str, float] = {}
-    for g in sorted(set(group)):
-        idx = np.where(np.asarray(group) == g)[0]
-        out[g] = float(np.mean(pred[idx] == y[idx])) if len(idx) else 0.0
-    return out
+    return accuracy_by_group(pred, y, group)
+
+
+MODEL_OUT_PATH = Path(__file__).resolve().parents[1] / "models" / "workout_recommender.pt"
 
 
-def train_and_save() -> None:
-    x, y_cat, y_i, y_d, meta = generate_dataset(samples_per_cell=22)
-    idx = np.arange(len(x))
-    train_idx, val_idx = train_test_split(idx, test_size=0.2, random_state=SEED, stratify=y_cat)
+def _gap(d: Dict[str, float]) -> float:
+    values = list(d.values())
+    return float(max(values) - min(values)) if values else 0.0
 
+
+def build_audit(
+    metrics: Dict[str, float],
+    goal_acc: Dict[str, float],
+    fitness_acc: Dict[str, float],
+    age_acc: Dict[str, float],
+    val_size: int,
+    train_size: int,
+) -> Dict[str, Any]:
+    return {
+        "overall": metrics,
+        "goal_accuracy": goal_acc,
+        "fitness_accuracy": fitness_acc,
+        "age_bin_accuracy": age_acc,
+        "fairness_gaps": {
+            "goal_gap": _gap(goal_acc),
+            "fitness_gap": _gap(fitness_acc),
+            "age_gap": _gap(age_acc),
+        },
+        "val_size": int(val_size),
+        "train_size": int(train_size),
+    }
+
+
+def save_checkpoint(
+    model: nn.Module,
+    epoch: int,
+    val_loss: float,
+    audit: Dict[str, Any],
+    extra_metadata: Optional[Dict[str, Any]] = None,
+    out_path: Path = MODEL_OUT_PATH,
+    subgroups: Optional[Dict[str, Any]] = None,
+) -> Path:
+    """Write the checkpoint payload every training path shares (see ml_service/torch_inference).
+
+    `audit` is the `build_audit` dict; `subgroups` (fairness_audit's per-subgroup metrics
+    and gap intervals) is stored next to it as `metadata.subgroup_audit`.
+    """
+    payload = {
+        "epoch": epoch,
+        "val_loss": val_loss,
+        "model_state_dict": model.state_dict(),
+        "metadata": {
+            "seed": SEED,
+            **(extra_metadata or {}),
+            "feature_names": FEATURE_NAMES,
+            **schema_metadata(),
+            "architecture": model.architecture,
+            "category_names": CATEGORY_NAMES,
+            "goals": GOALS,
+            "safety_rules_hard_enforced_in_inference": True,
+            "audit": audit,
+        },
+    }
+    if subgroups is not None:
+        payload["metadata"]["subgroup_audit"] = subgroups
+    torch.save(payload, out_path)
+    print(f"saved: {out_path}")
+    return Path(out_path)
+
+
+def audit_with_subgroups(
+    model: nn.Module,
+    data: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, Dict[str, Sequence[str]]],
+    train_idx: np.ndarray,
+    val_idx: np.ndarray,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """The checkpoint audit of `model` on the validation split, and its subgroup audit."""
+    x, y_cat, y_i, y_d, meta = data
+    x_val = torch.tensor(x[val_idx], dtype=torch.float32)
+    yc_val = torch.tensor(y_cat[val_idx], dtype=torch.long)
+    yi_val = torch.tensor(y_i[val_idx], dtype=torch.float32)
+    yd_val = torch.tensor(y_d[val_idx], dtype=torch.float32)
+    metrics = evaluate(model, x_val, yc_val, yi_val, yd_val)
+    with torch.no_grad():
+        val_logits, val_i, val_d = model(x_val)
+    val_pred = torch.argmax(val_logits, dim=1).cpu().numpy()
+
+    val_meta = {name: np.asarray(values)[val_idx] for name, values in meta.items()}
+    goal_acc = subgroup_accuracy(val_pred, y_cat[val_idx], val_meta["goal"])
+    fitness_acc = subgroup_accuracy(val_pred, y_cat[val_idx], val_meta["fitness"])
+    age_acc = subgroup_accuracy(val_pred, y_cat[val_idx], val_meta["age_bin"])
+
+    audit = build_audit(metrics, goal_acc, fitness_acc, age_acc, len(val_idx), len(train_idx))
+    subgroups = subgroup_audit(
+        val_pred, y_cat[val_idx], val_i.numpy(), y_i[val_idx], val_d.numpy(), y_d[val_idx], val_meta, seed=SEED
+    )
+    return audit, subgroups
+
+
+def audit_model(
+    model: nn.Module,
+    data: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, Dict[str, Sequence[str]]],
+    train_idx: np.ndarray,
+    val_idx: np.ndarray,
+) -> Dict[str, Any]:
+    """The checkpoint audit (`metadata.audit`) of `model` on the validation split."""
+    return audit_with_subgroups(model, data, train_idx, val_idx)[0]
+
+
+def finish_training(
+    model: nn.Module,
+    best: Dict[str, Any],
+    data: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, Dict[str, Sequence[str]]],
+    train_idx: np.ndarray,
+    val_idx: np.ndarray,
+    extra_metadata: Optional[Dict[str, Any]] = None,
+    out_path: Path = MODEL_OUT_PATH,
+) -> Dict[str, Any]:
+    """Restore the best state, audit it on the validation split and save the checkpoint."""
+    assert best["state"] is not None
+    model.load_state_dict(best["state"])
+    audit, subgroups = audit_with_subgroups(model, data, train_idx, val_idx)
+    print("audit:", json.dumps(audit, indent=2))
+
+    save_checkpoint(model, best["epoch"], best["loss"], audit, extra_metadata, out_path, subgroups)
+    return audit
+
+
+def split_indices(y_cat: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    return train_test_split(np.arange(len(y_cat)), test_size=0.2, random_state=SEED, stratify=y_cat)
+
+
+@dataclass
+class TrainConfig:
+    lr: float = 8e-4
+    weight_decay: float = 1e-5
+    batch_size: int = 128
+    epochs: int = 60
+    dropout: float = 0.3
+    intensity_weight: float = 0.5
+    duration_weight: float = 0.5
+
+
+def fit(
+    config: TrainConfig,
+    data: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray],
+    train_idx: np.ndarray,
+    val_idx: np.ndarray,
+    on_epoch: Optional[Callable[[int, float], bool]] = None,
+) -> Tuple[nn.Module, Dict[str, Any]]:
+    """The training loop of `train_and_save`, parameterised by `config`.
+
+    `on_epoch(epoch, val_loss)` may return False to stop early (sweep pruning).
+    """
+    x, y_cat, y_i, y_d = data[:4]
     x_train = torch.tensor(x[train_idx], dtype=torch.float32)
     yc_train = torch.tensor(y_cat[train_idx], dtype=torch.long)
     yi_train = torch.tensor(y_i[train_idx], dtype=torch.float32)
@@ -386,13 +803,14 @@ def train_and_save() -> None:
     yi_val = torch.tensor(y_i[val_idx], dtype=torch.float32)
     yd_val = torch.tensor(y_d[val_idx], dtype=torch.float32)
 
-    model = WorkoutRecommender()
-    optim = torch.optim.Adam(model.parameters(), lr=8e-4, weight_decay=1e-5)
+    model = WorkoutRecommender(config.dropout)
+    optim = torch.optim.Adam(model.parameters(), lr=config.lr, weight_decay=config.weight_decay)
     ce = nn.CrossEntropyLoss()
     mse = nn.MSELoss()
+    w_i, w_d = config.intensity_weight, config.duration_weight
 
-    batch_size = 128
-    n_epochs = 60
+    batch_size = config.batch_size
+    n_epochs = config.epochs
     best = {"loss": float("inf"), "epoch": 0, "state": None}
     n_train = x_train.shape[0]
 
@@ -407,7 +825,7 @@ def train_and_save() -> None:
             yib = yi_train[b]
             ydb = yd_train[b]
             cat_logits, p_i, p_d = model(xb)
-            loss = ce(cat_logits, ycb) + 0.5 * mse(p_i, yib) + 0.5 * mse(p_d, ydb)
+            loss = ce(cat_logits, ycb) + w_i * mse(p_i, yib) + w_d * mse(p_d, ydb)
             optim.zero_grad()
             loss.backward()
             optim.step()
@@ -416,61 +834,238 @@ def train_and_save() -> None:
         model.eval()
         with torch.no_grad():
             vc, vi, vd = model(x_val)
-            vloss = ce(vc, yc_val) + 0.5 * mse(vi, yi_val) + 0.5 * mse(vd, yd_val)
+            vloss = ce(vc, yc_val) + w_i * mse(vi, yi_val) + w_d * mse(vd, yd_val)
         if vloss.item() < best["loss"]:
             best["loss"] = float(vloss.item())
             best["epoch"] = epoch
             best["state"] = {k: v.detach().cpu().clone() for k, v in model.state_dict().items()}
         if epoch % 10 == 0:
             print(f"epoch={epoch} train_loss={total:.4f} val_loss={vloss.item():.6f}")
+        if on_epoch is not None and on_epoch(epoch, float(vloss.item())) is False:
+            break
 
-    assert best["state"] is not None
-    model.load_state_dict(best["state"])
+    return model, best
 
-    metrics = evaluate(model, x_val, yc_val, yi_val, yd_val)
-    with torch.no_grad():
-        val_pred = torch.argmax(model(x_val)[0], dim=1).cpu().numpy()
 
-    goal_acc = subgroup_accuracy(val_pred, y_cat[val_idx], [meta["goal"][i] for i in val_idx])
-    fitness_acc = subgroup_accuracy(val_pred, y_cat[val_idx], [meta["fitness"][i] for i in val_idx])
-    age_acc = subgroup_accuracy(val_pred, y_cat[val_idx], [meta["age_bin"][i] for i in val_idx])
+PROFILE_PHASES = ("data", "forward", "backward", "optimizer", "validation")
 
-    def gap(d: Dict[str, float]) -> float:
-        values = list(d.values())
-        return float(max(values) - min(values)) if values else 0.0
 
-    audit = {
-        "overall": metrics,
-        "goal_accuracy": goal_acc,
-        "fitness_accuracy": fitness_acc,
-        "age_bin_accuracy": age_acc,
-        "fairness_gaps": {
-            "goal_gap": gap(goal_acc),
-            "fitness_gap": gap(fitness_acc),
-            "age_gap": gap(age_acc),
-        },
-        "val_size": int(len(val_idx)),
-        "train_size": int(len(train_idx)),
-    }
-    print("audit:", json.dumps(audit, indent=2))
+def _compile(model: nn.Module, sample: torch.Tensor) -> Tuple[nn.Module, bool]:
+    """`torch.compile(model)` if this torch has it and the backend builds; otherwise `model` itself.
 
-    out_path = Path(__file__).resolve().parents[1] / "models" / "workout_recommender.pt"
-    payload = {
-        "epoch": best["epoch"],
-        "val_loss": best["loss"],
-        "model_state_dict": model.state_dict(),
-        "metadata": {
-            "seed": SEED,
-            "feature_names": FEATURE_NAMES,
-            "category_names": CATEGORY_NAMES,
-            "goals": GOALS,
-            "safety_rules_hard_enforced_in_inference": True,
-            "audit": audit,
-        },
+    The warm-up call runs in eval mode so the BatchNorm running statistics are untouched.
+    """
+    if not hasattr(torch, "compile"):
+        return model, False
+    try:
+        compiled = torch.compile(model)
+        model.eval()
+        with torch.no_grad():
+            compiled(sample)
+        return compiled, True
+    except Exception as exc:  # missing C++ toolchain, unsupported platform, ...
+        print(f"torch.compile unavailable, training eagerly: {exc.__class__.__name__}: {exc}")
+        return model, False
+
+
+def fit_throughput(
+    config: TrainConfig,
+    data: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray],
+    train_idx: np.ndarray,
+    val_idx: np.ndarray,
+    threads: Optional[int] = None,
+    compile_model: bool = False,
+    on_epoch: Optional[Callable[[int, float], bool]] = None,
+) -> Tuple[nn.Module, Dict[str, Any], Dict[str, Any]]:
+    """`fit` without the per-step overheads, plus a timing report.
+
+    Each epoch gathers the training tensors once into preallocated buffers in
+    shuffled order, so every batch is a contiguous slice instead of four
+    fancy-indexing copies. The running loss stays a tensor (no `.item()` sync per
+    step) and the best state is copied into buffers allocated once rather than
+    cloned on every improvement. It draws the same permutations and dropout masks
+    as `fit`, so an eager run ends with the same weights.
+    """
+    if threads:
+        torch.set_num_threads(threads)
+    x, y_cat, y_i, y_d = data[:4]
+    train = (
+        torch.tensor(x[train_idx], dtype=torch.float32),
+        torch.tensor(y_cat[train_idx], dtype=torch.long),
+        torch.tensor(y_i[train_idx], dtype=torch.float32),
+        torch.tensor(y_d[train_idx], dtype=torch.float32),
+    )
+    x_val = torch.tensor(x[val_idx], dtype=torch.float32)
+    yc_val = torch.tensor(y_cat[val_idx], dtype=torch.long)
+    yi_val = torch.tensor(y_i[val_idx], dtype=torch.float32)
+    yd_val = torch.tensor(y_d[val_idx], dtype=torch.float32)
+
+    model = WorkoutRecommender(config.dropout)
+    optim = torch.optim.Adam(model.parameters(), lr=config.lr, weight_decay=config.weight_decay)
+    ce = nn.CrossEntropyLoss()
+    mse = nn.MSELoss()
+    w_i, w_d = config.intensity_weight, config.duration_weight
+    forward, compiled = _compile(model, x_val[:2]) if compile_model else (model, False)
+
+    batch_size = config.batch_size
+    n_train = train[0].shape[0]
+    shuffled = tuple(torch.empty_like(t) for t in train)
+    best_state = {k: torch.empty_like(v) for k, v in model.state_dict().items()}
+    best: Dict[str, Any] = {"loss": float("inf"), "epoch": 0, "state": None}
+    seconds = dict.fromkeys(PROFILE_PHASES, 0.0)
+    epoch_seconds: List[float] = []
+    clock = time.perf_counter
+
+    for epoch in range(1, config.epochs + 1):
+        epoch_started = t0 = clock()
+        model.train()
+        order = torch.randperm(n_train)
+        for src, dst in zip(train, shuffled):
+            torch.index_select(src, 0, order, out=dst)
+        xs, ycs, yis, yds = shuffled
+        total = torch.zeros(())
+        t1 = clock()
+        seconds["data"] += t1 - t0
+
+        for start in range(0, n_train, batch_size):
+            end = start + batch_size
+            t0 = clock()
+            cat_logits, p_i, p_d = forward(xs[start:end])
+            loss = ce(cat_logits, ycs[start:end]) + w_i * mse(p_i, yis[start:end]) + w_d * mse(p_d, yds[start:end])
+            t1 = clock()
+            optim.zero_grad()
+            loss.backward()
+            t2 = clock()
+            optim.step()
+            total += loss.detach()
+            t3 = clock()
+            seconds["forward"] += t1 - t0
+            seconds["backward"] += t2 - t1
+            seconds["optimizer"] += t3 - t2
+
+        t0 = clock()
+        model.eval()
+        with torch.no_grad():
+            vc, vi, vd = forward(x_val)
+            vloss = float(ce(vc, yc_val) + w_i * mse(vi, yi_val) + w_d * mse(vd, yd_val))
+            if vloss < best["loss"]:
+                for k, v in model.state_dict().items():
+                    best_state[k].copy_(v)
+                best.update(loss=vloss, epoch=epoch, state=best_state)
+        seconds["validation"] += clock() - t0
+        epoch_seconds.append(clock() - epoch_started)
+
+        if epoch % 10 == 0:
+            print(f"epoch={epoch} train_loss={float(total):.4f} val_loss={vloss:.6f}")
+        if on_epoch is not None and on_epoch(epoch, vloss) is False:
+            break
+
+    # The first epoch carries allocation (and compilation) warm-up; leave it out of the rates when possible.
+    timed = epoch_seconds[1:] or epoch_seconds
+    measured = sum(seconds.values())
+    report = {
+        "epochs": len(epoch_seconds),
+        "rows": n_train,
+        "batch_size": batch_size,
+        "threads": torch.get_num_threads(),
+        "compiled": compiled,
+        "epoch_seconds": float(np.mean(timed)),
+        "first_epoch_seconds": epoch_seconds[0],
+        "samples_per_s": n_train * len(timed) / sum(timed),
+        "share": {phase: seconds[phase] / measured for phase in PROFILE_PHASES},
     }
-    torch.save(payload, out_path)
-    print(f"saved: {out_path}")
+    return model, best, report
+
+
+def print_profile(report: Dict[str, Any]) -> None:
+    print(
+        f"epochs={report['epochs']} rows={report['rows']} batch_size={report['batch_size']} "
+        f"threads={report['threads']} compiled={report['compiled']}"
+    )
+    print(
+        f"epoch_seconds={report['epoch_seconds']:.3f} (first {report['first_epoch_seconds']:.3f}) "
+        f"samples_per_s={report['samples_per_s']:.0f}"
+    )
+    for phase, share in report["share"].items():
+        print(f"  {phase:<10} {100 * share:5.1f}%")
+
+
+GENERATORS = {"python": generate_dataset, "vectorized": generate_dataset_vectorized}
+
+
+def load_training_data(
+    samples_per_cell: int = 22, generator: str = "python", shard_dir: Path = SHARD_DIR, workers: Optional[int] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, Dict[str, Sequence[str]]]:
+    if generator == "sharded":
+        ensure_shards(shard_dir, samples_per_cell, workers)
+        return load_shards(shard_dir)
+    return GENERATORS[generator](samples_per_cell)
+
+
+def train_and_save(
+    samples_per_cell: int = 22,
+    generator: str = "python",
+    shard_dir: Path = SHARD_DIR,
+    workers: Optional[int] = None,
+    throughput: bool = False,
+    threads: Optional[int] = None,
+    compile_model: bool = False,
+) -> None:
+    x, y_cat, y_i, y_d, meta = load_training_data(samples_per_cell, generator, shard_dir, workers)
+    train_idx, val_idx = split_indices(y_cat)
+
+    if throughput:
+        model, best, report = fit_throughput(
+            TrainConfig(), (x, y_cat, y_i, y_d), train_idx, val_idx, threads, compile_model
+        )
+        print_profile(report)
+    else:
+        model, best = fit(TrainConfig(), (x, y_cat, y_i, y_d), train_idx, val_idx)
+
+    finish_training(
+        model,
+        best,
+        (x, y_cat, y_i, y_d, meta),
+        train_idx,
+        val_idx,
+        {"generator": generator, "samples_per_cell": samples_per_cell},
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train the WorkoutRecommender on synthetic profiles.")
+    parser.add_argument("--generator", choices=sorted(GENERATORS) + ["sharded"], default="python")
+    parser.add_argument("--samples-per-cell", type=int, default=22)
+    parser.add_argument("--shard-dir", type=Path, default=SHARD_DIR, help="where --generator sharded keeps its .npy files")
+    parser.add_argument("--workers", type=int, default=None, help="shard generation processes (default: nproc)")
+    parser.add_argument("--shards-only", action="store_true", help="write the shards and exit without training")
+    parser.add_argument(
+        "--throughput", action="store_true", help="contiguous pre-shuffled batches, no per-step syncs, timing report"
+    )
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads for --throughput")
+    parser.add_argument("--compile", action="store_true", help="torch.compile the model under --throughput")
+    parser.add_argument(
+        "--check-parity", action="store_true", help="compare the two generators' statistics and exit"
+    )
+    args = parser.parse_args()
+
+    if args.check_parity:
+        print(json.dumps(generator_parity_report(args.samples_per_cell), indent=2))
+        return
+    if args.shards_only:
+        manifest = ensure_shards(args.shard_dir, args.samples_per_cell, args.workers)
+        print(f"shards: {len(manifest['shards'])} rows: {manifest['rows']} dir: {args.shard_dir}")
+        return
+    train_and_save(
+        args.samples_per_cell,
+        args.generator,
+        args.shard_dir,
+        args.workers,
+        args.throughput,
+        args.threads,
+        args.compile,
+    )
 
 
 if __name__ == "__main__":
-    train_and_save()
+    main()
@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# app.database builds its engine from DATABASE_URL on import.
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
@@ -0,0 +1,62 @@
+"""The vectorized generator must draw from the same distribution as the per-sample one."""
+import random
+
+import numpy as np
+import pytest
+
+from app.services import train_workout_recommender as trainer
+
+SAMPLES_PER_CELL = 200  # 2400 rows per (goal, fitness) cell
+
+# Across seeds, the observed differences at this size stay under half of each tolerance.
+FEATURE_MEAN_TOL = 0.01
+FEATURE_STD_TOL = 0.01
+CELL_CATEGORY_TV_TOL = 0.06
+TARGET_MEAN_TOL = 0.005
+CELL_TARGET_MEAN_TOL = 0.02
+
+
+@pytest.fixture(scope="module", params=[trainer.SEED, 1])
+def datasets(request):
+    random.seed(request.param)
+    return trainer.generate_dataset(SAMPLES_PER_CELL), trainer.generate_dataset_vectorized(
+        SAMPLES_PER_CELL, seed=request.param
+    )
+
+
+def _cells(metadata):
+    goals, fitness = np.asarray(metadata["goal"]), np.asarray(metadata["fitness"])
+    for goal in trainer.GOALS:
+        for level in trainer.FITNESS_LEVELS:
+            yield (goal, level), (goals == goal) & (fitness == level)
+
+
+def test_same_rows_and_cell_order(datasets):
+    (xa, _, _, _, ma), (xb, _, _, _, mb) = datasets
+    assert xa.shape == xb.shape
+    for key in ("goal", "fitness", "age_bin"):
+        assert list(ma[key]) == list(mb[key])
+
+
+def test_feature_moments(datasets):
+    (xa, *_), (xb, *_) = datasets
+    assert np.abs(xa.mean(axis=0) - xb.mean(axis=0)).max() < FEATURE_MEAN_TOL
+    assert np.abs(xa.std(axis=0) - xb.std(axis=0)).max() < FEATURE_STD_TOL
+
+
+def test_category_distribution_per_cell(datasets):
+    (_, ca, _, _, metadata), (_, cb, *_) = datasets
+    n_categories = max(ca.max(), cb.max()) + 1
+    for cell, mask in _cells(metadata):
+        pa = np.bincount(ca[mask], minlength=n_categories) / mask.sum()
+        pb = np.bincount(cb[mask], minlength=n_categories) / mask.sum()
+        assert 0.5 * np.abs(pa - pb).sum() < CELL_CATEGORY_TV_TOL, cell
+
+
+def test_target_means(datasets):
+    (_, _, ia, da, metadata), (_, _, ib, db, _) = datasets
+    assert abs(ia.mean() - ib.mean()) < TARGET_MEAN_TOL
+    assert abs(da.mean() - db.mean()) < TARGET_MEAN_TOL
+    for cell, mask in _cells(metadata):
+        assert abs(ia[mask].mean() - ib[mask].mean()) < CELL_TARGET_MEAN_TOL, cell
+        assert abs(da[mask].mean() - db[mask].mean()) < CELL_TARGET_MEAN_TOL, cell
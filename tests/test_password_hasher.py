@@ -0,0 +1,27 @@
+"""PasswordHasher keeps serving after a worker process dies."""
+import asyncio
+import os
+import signal
+
+from app.security import PasswordHasher, pwd_context
+
+
+def test_password_hasher_recovers_from_killed_worker():
+    hasher = PasswordHasher(processes=1)
+
+    async def scenario():
+        await hasher.start()
+        for pid in list(hasher._executor._processes):
+            os.kill(pid, signal.SIGKILL)
+        hashed = await hasher.hash("correct horse")
+        valid, _ = await hasher.verify_and_update("correct horse", hashed)
+        return hashed, valid
+
+    try:
+        hashed, valid = asyncio.run(scenario())
+    finally:
+        hasher.shutdown()
+    assert valid
+    assert pwd_context.verify("correct horse", hashed)
+    assert hasher.stats()["pool_restarts"] == 1
+    assert hasher.stats()["hashes"] == 1
@@ -0,0 +1,85 @@
+"""/predict/batch must give every row exactly what /predict gives it alone."""
+import random
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from app.Schemas.prediction_schema import PredictionInput
+from app.services import ml_service
+from app.services.feature_pipeline import FITNESS_LEVELS, GOALS, RECOVERY_PHASES
+
+# Values sitting on the safety-rule thresholds (pain 4 and 7, sleep 5 hours).
+PAIN_EDGES = [0.0, 3.99, 4.0, 6.99, 7.0, 10.0, 12.0]
+SLEEP_EDGES = [None, None, 4.99, 5.0, 5.01, 12.0]
+CONDITIONS = ["asthma", "diabetes", "hypertension", "arrhythmia", "Cardiac", "arthritis"]
+
+
+def random_profiles(n: int, seed: int = 7):
+    rng = random.Random(seed)
+    profiles = []
+    for i in range(n):
+        post_surgery = rng.random() < 0.5
+        profile = PredictionInput(
+            age=rng.choice([3, 10, 16, rng.randint(18, 64), 70, 120]),
+            weight_kg=rng.uniform(35, 160),
+            height_cm=rng.uniform(120, 210),
+            fitness_level=rng.choice(FITNESS_LEVELS),
+            is_post_surgery=post_surgery,
+            recovery_phase=rng.choice(RECOVERY_PHASES),
+            surgery_date=(
+                date.today() - timedelta(days=rng.randint(-10, 400)) if post_surgery and rng.random() < 0.8 else None
+            ),
+            pain_level=rng.choice(PAIN_EDGES) if i % 2 else rng.uniform(0, 10),
+            sleep_hours=rng.choice(SLEEP_EDGES) if i % 3 else rng.uniform(3, 10),
+            goal=rng.choice(GOALS),
+            medical_conditions=rng.sample(CONDITIONS, rng.randint(0, 3)),
+        )
+        profiles.append(profile.model_dump())
+    return profiles
+
+
+PROFILES = random_profiles(600)
+
+
+def test_encode_user_profiles_matches_per_row_encoding():
+    batch = ml_service.encode_user_profiles(PROFILES)
+    assert batch.shape == (len(PROFILES), 14)
+    for row, profile in zip(batch, PROFILES):
+        assert row.tolist() == ml_service.encode_user_profile(profile)
+
+
+def test_safe_categories_match_scalar_rules():
+    features = ml_service.encode_user_profiles(PROFILES)
+    rng = np.random.default_rng(7)
+    for _ in range(3):
+        predicted = rng.integers(0, len(ml_service.CATEGORY_NAMES), size=len(features))
+        safe = ml_service._safe_categories_from_features(predicted, features)
+        expected = [
+            ml_service._safe_category_from_features(int(category), row.tolist())
+            for category, row in zip(predicted, features)
+        ]
+        assert safe.tolist() == expected
+
+
+def _scalar_predict(model, features):
+    """The original per-row /predict: one torch forward pass, then the scalar safety rules."""
+    import torch
+
+    with torch.no_grad():
+        category_logits, intensity_pred, duration_pred = model(torch.tensor(features, dtype=torch.float32).unsqueeze(0))
+    category_id = ml_service._safe_category_from_features(int(torch.argmax(category_logits, dim=1).item()), features)
+    return category_id, float(intensity_pred.squeeze(1).item()), float(duration_pred.squeeze(1).item())
+
+
+def test_predict_batch_matches_per_row_torch_path():
+    from app.services.torch_inference import load_model
+
+    model = load_model(ml_service.MODEL_PATH)
+    batch = ml_service.predict_batch(ml_service.encode_user_profiles(PROFILES))
+    for result, profile in zip(batch, PROFILES):
+        category_id, intensity, duration = _scalar_predict(model, ml_service.encode_user_profile(profile))
+        assert result["category_id"] == category_id
+        assert result["exercises"] == ml_service.CATEGORY_EXERCISES[category_id]
+        assert result["intensity"] == pytest.approx(intensity, abs=1e-5)
+        assert result["duration"] == pytest.approx(duration, abs=1e-4)
@@ -0,0 +1,81 @@
+"""ReplicaRouter over a primary and replicas on separate SQLite files."""
+import time
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app.database import ReplicaRouter, make_engine
+
+
+@pytest.fixture
+def primary(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    yield engine
+    engine.dispose()
+
+
+def _router(primary, replica_urls, retry_seconds=30.0, sticky_seconds=5.0, **pool):
+    replicas = [make_engine(url, **pool) for url in replica_urls]
+    return ReplicaRouter(sessionmaker(bind=primary), replicas, retry_seconds, sticky_seconds)
+
+
+def _read_from(router, user=None):
+    with router.read_session(user) as session:
+        return session.get_bind()
+
+
+def test_reads_round_robin_over_replicas(primary, tmp_path):
+    router = _router(primary, [f"sqlite:///{tmp_path / 'a.db'}", f"sqlite:///{tmp_path / 'b.db'}"])
+    a, b = router.engines
+    assert [_read_from(router) for _ in range(4)] == [a, b, a, b]
+    stats = router.stats()
+    assert [r["reads"] for r in stats["replicas"]] == [2, 2]
+    assert stats["primary_reads"] == 0
+
+
+def test_unreachable_replica_is_marked_down_and_skipped(primary, tmp_path):
+    down = f"sqlite:///{tmp_path / 'missing' / 'down.db'}"  # the directory doesn't exist
+    router = _router(primary, [down, f"sqlite:///{tmp_path / 'up.db'}"])
+    up = router.engines[1]
+    assert [_read_from(router) for _ in range(3)] == [up, up, up]
+    stats = router.stats()
+    assert stats["failovers"] == 1
+    assert [r["healthy"] for r in stats["replicas"]] == [False, True]
+
+
+def test_falls_back_to_primary_and_retries_after_the_delay(primary, tmp_path):
+    router = _router(primary, [f"sqlite:///{tmp_path / 'missing' / 'down.db'}"], retry_seconds=0.2)
+    assert _read_from(router) is primary
+    assert _read_from(router) is primary
+    assert router.stats()["failovers"] == 1  # marked down, not retried on every read
+    time.sleep(0.25)
+    assert _read_from(router) is primary
+    stats = router.stats()
+    assert stats["failovers"] == 2
+    assert stats["primary_reads"] == 3
+
+
+def test_exhausted_replica_pool_fails_over(primary, tmp_path):
+    router = _router(
+        primary,
+        [f"sqlite:///{tmp_path / 'busy.db'}", f"sqlite:///{tmp_path / 'idle.db'}"],
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+    busy, idle = router.engines
+    with busy.connect():
+        assert _read_from(router) is idle  # busy's only connection is held: pool TimeoutError
+    assert router.stats()["replicas"][0]["healthy"] is False
+
+
+def test_reads_stick_to_primary_after_a_write(primary, tmp_path):
+    router = _router(primary, [f"sqlite:///{tmp_path / 'a.db'}"], sticky_seconds=0.2)
+    replica = router.engines[0]
+    router.mark_write("writer@example.com")
+    assert _read_from(router, "writer@example.com") is primary
+    assert _read_from(router, "reader@example.com") is replica
+    assert _read_from(router) is replica
+    time.sleep(0.25)
+    assert _read_from(router, "writer@example.com") is replica
+    assert router.stats()["sticky_reads"] == 1